@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+""" Epoch time and final mAP of fine-tuning the whole model, with the backbone frozen, and
+with the backbone frozen and its features cached.
+
+Training runs on synthetic images at a fixed input size without random augmentation,
+which caching requires, so that the modes only differ in what they compute. Pass the
+weights of a trained model with -w for a meaningful mAP. Every mode runs in a fresh
+process.
+
+    python -m benchmarks.backbone_freezing -a full -e 5 -n 64 -w backend.h5
+"""
+
+import os
+import argparse
+import tempfile
+import multiprocessing
+from benchmarks.common import ANCHORS, create_random_model, time_call, summarize
+from benchmarks.run import synthesize_dataset
+
+def _generator(instances, labels, args):
+    from generator import BatchGenerator
+    from utils.utils import normalize
+
+    return BatchGenerator(
+        instances           = instances,
+        anchors             = ANCHORS[args.architecture],
+        labels              = labels,
+        max_box_per_image   = args.max_box_per_image,
+        batch_size          = args.batch_size,
+        min_net_size        = args.net_size,
+        max_net_size        = args.net_size,
+        norm                = normalize,
+        num_scales          = 3 if args.architecture == 'full' else 2,
+        aug_jitter          = None,
+        aug_scale           = None,
+        aug_hue             = None,
+        aug_saturation      = None,
+        aug_exposure        = None,
+        aug_flip            = False,
+        aug_pad             = False
+    )
+
+def _measure(mode, train_ints, valid_ints, labels, cache_dir, args):
+    import yolo
+    from keras.optimizers import Adam
+    from generator import CachedFeatureGenerator
+    from utils.utils import evaluate
+
+    train_model, infer_model = create_random_model(args.architecture, nb_class=len(labels), max_box_per_image=args.max_box_per_image)
+    if args.weights:
+        infer_model.load_weights(args.weights, by_name=True, skip_mismatch=True)
+
+    train_generator, valid_generator = _generator(train_ints, labels, args), _generator(valid_ints, labels, args)
+    fit_generator = train_generator
+
+    first, last = yolo.BACKBONE_LAYERS[args.architecture]
+    cache_time = 0.
+    if mode != 'full':
+        yolo.freeze_layers(train_model, first, last)
+    if mode == 'cached':
+        backbone_model, train_model = yolo.split_backbone(train_model, last)
+        cache_time, fit_generator = time_call(CachedFeatureGenerator, train_generator, backbone_model, cache_dir)
+
+    train_model.compile(loss=yolo.dummy_loss, optimizer=Adam(lr=1e-4, clipnorm=0.001))
+
+    epoch_times = []
+    for epoch in range(args.epochs):
+        epoch_time, _ = time_call(train_model.fit_generator, fit_generator, steps_per_epoch=len(fit_generator),
+                                  epochs=epoch + 1, initial_epoch=epoch, verbose=0)
+        epoch_times.append(epoch_time)
+
+    average_precisions = evaluate(infer_model, valid_generator, net_h=args.net_size, net_w=args.net_size)
+    return summarize(epoch_times[1:] or epoch_times), cache_time, sum(average_precisions.values()) / len(average_precisions)
+
+def _main_(args):
+    from voc import parse_voc_annotation
+
+    labels = ['class_%d' % i for i in range(args.classes)]
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as path:
+        image_dir, annot_dir = synthesize_dataset(path, args.images, 3, labels)
+        instances, _ = parse_voc_annotation(annot_dir, image_dir, None, labels)
+        split = int(0.8 * len(instances))
+
+        for mode in ['full', 'frozen', 'cached']:
+            with context.Pool(1) as pool:
+                epoch, cache_time, mean_ap = pool.apply(_measure, (mode, instances[:split], instances[split:], labels,
+                                                                   os.path.join(path, 'features'), args))
+
+            print('%-7s epoch %8.2fs (p95 %8.2fs), cache filled in %7.2fs, mAP %.4f' % (
+                mode, epoch['mean'], epoch['p95'], cache_time, mean_ap))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark training with a frozen and a cached backbone')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-w', '--weights', help='weights to start from, loaded by layer name')
+    argparser.add_argument('-e', '--epochs', type=int, default=5)
+    argparser.add_argument('-n', '--images', type=int, default=64)
+    argparser.add_argument('-b', '--batch-size', type=int, default=8)
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('--classes', type=int, default=1)
+    argparser.add_argument('--max-box-per-image', type=int, default=10)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+""" Batch build time, true box padding and class balance of BatchGenerator batches for the
+samplers of utils.sampling, on a synthetic dataset where one class is much rarer than the
+others and the number of objects per image varies widely, as in the RBC dataset.
+
+The padding waste is the share of the rows of true boxes, max_box_per_image per image, or
+the fullest image of the batch with per_batch_boxes, that are left empty.
+
+    python -m benchmarks.batch_sampling -n 200 -o 10 -b 8
+"""
+
+import argparse
+import tempfile
+import numpy as np
+from benchmarks.common import ANCHORS, time_call, summarize
+from benchmarks.run import synthesize_dataset
+
+def _samplers(batch_size, seed):
+    from utils.sampling import ClassBalancedSampler, BucketSampler
+
+    return [
+        ('uniform',              lambda: None,                                                                     False),
+        ('uniform per-batch',    lambda: None,                                                                     True),
+        ('class_balanced',       lambda: ClassBalancedSampler(seed=seed),                                          True),
+        ('bucketed',             lambda: BucketSampler(batch_size, seed=seed),                                     True),
+        ('bucketed balanced',    lambda: BucketSampler(batch_size, sampler=ClassBalancedSampler(seed=seed), seed=seed), True)
+    ]
+
+def _run(instances, labels, max_box_per_image, create_sampler, per_batch_boxes, args):
+    from generator import BatchGenerator
+    from utils.utils import normalize
+
+    sampler = create_sampler()
+    generator = BatchGenerator(
+        instances           = list(instances),
+        anchors             = ANCHORS['full'],
+        labels              = labels,
+        max_box_per_image   = max_box_per_image,
+        batch_size          = args.batch_size,
+        min_net_size        = args.net_size,
+        max_net_size        = args.net_size,
+        shuffle             = True,
+        norm                = normalize,
+        sampler             = sampler,
+        per_batch_boxes     = per_batch_boxes
+    )
+
+    order_times, build_times = [], []
+    rows, filled, class_counts = 0, 0, np.zeros(len(labels))
+    for epoch in range(args.epochs):
+        for idx in range(len(generator)):
+            build_time, (inputs, _) = time_call(generator.__getitem__, idx)
+            build_times.append(build_time)
+
+            t_batch = inputs[1]
+            rows   += t_batch.shape[0] * t_batch.shape[4]
+            filled += int(np.sum(t_batch[..., 2] > 0))
+
+            for instance in generator._batch_instances(idx):
+                for obj in instance['object']:
+                    class_counts[labels.index(obj['name'])] += 1
+
+        order_time, _ = time_call(generator.on_epoch_end)
+        order_times.append(order_time)
+
+    return summarize(build_times), summarize(order_times), 1. - filled / float(rows), rows, class_counts
+
+def _main_(args):
+    from voc import parse_voc_annotation
+
+    # the last class is rare: a label list drawn from uniformly by synthesize_dataset
+    labels = ['class_%d' % i for i in range(args.classes)]
+    weighted = labels[:-1] * args.imbalance + labels[-1:]
+
+    with tempfile.TemporaryDirectory() as path:
+        image_dir, annot_dir = synthesize_dataset(path, args.images, args.objects, weighted, seed=args.seed)
+        instances, _ = parse_voc_annotation(annot_dir, image_dir, None, labels)
+        max_box_per_image = max(len(instance['object']) for instance in instances)
+
+        for name, create_sampler, per_batch_boxes in _samplers(args.batch_size, args.seed):
+            build, order, waste, rows, class_counts = _run(instances, labels, max_box_per_image, create_sampler, per_batch_boxes, args)
+
+            print('%-18s build %8.1fms per batch (p95 %8.1fms), order %6.2fms, padding waste %5.1f%% of %7d rows, rare class %5.1f%% of objects' % (
+                name, 1e3 * build['mean'], 1e3 * build['p95'], 1e3 * order['mean'], 100. * waste, rows,
+                100. * class_counts[-1] / class_counts.sum()))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark the batch samplers')
+    argparser.add_argument('-n', '--images', type=int, default=200)
+    argparser.add_argument('-o', '--objects', type=int, default=10, help='objects per image, from 1 to twice as many')
+    argparser.add_argument('-e', '--epochs', type=int, default=2)
+    argparser.add_argument('-b', '--batch-size', type=int, default=8)
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('--classes', type=int, default=3)
+    argparser.add_argument('--imbalance', type=int, default=10, help='how many times more common the other classes are')
+    argparser.add_argument('--seed', type=int, default=0)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+""" Time the end of an epoch holds up training to checkpoint the model, writing synchronously
+as model.save does versus in the background, and with weights deltas between full
+checkpoints of a model with a frozen backbone.
+
+A few training steps run between checkpoints, as the epochs would, and the step time
+right after a checkpoint shows what a background write costs the training thread.
+
+    python -m benchmarks.checkpoint_stall -a full -e 5
+"""
+
+import os
+import argparse
+import tempfile
+from benchmarks.common import create_random_model, random_training_batch, time_call, summarize
+
+def _run(architecture, path, async_write, full_every, freeze, args):
+    import yolo
+    from keras.optimizers import Adam
+    from callbacks import CustomModelCheckpoint
+    from utils.checkpoint import CheckpointWriter
+
+    train_model, infer_model = create_random_model(architecture)
+    if freeze:
+        yolo.freeze_layers(train_model, *yolo.BACKBONE_LAYERS[architecture])
+    train_model.compile(loss=yolo.dummy_loss, optimizer=Adam(lr=1e-4, clipnorm=0.001))
+
+    writer = CheckpointWriter(async_write=async_write)
+    checkpoint = CustomModelCheckpoint(model_to_save=infer_model, writer=writer, full_every=full_every,
+                                       filepath=os.path.join(path, 'checkpoint.h5'), monitor='loss', period=1)
+    checkpoint.set_model(train_model)
+
+    inputs, outputs = random_training_batch(architecture, args.batch_size, args.net_size)
+    train_model.train_on_batch(inputs, outputs)
+
+    first_steps, other_steps = [], []
+    for epoch in range(args.epochs):
+        checkpoint.on_epoch_end(epoch, {'loss': 1.})
+
+        for step in range(args.steps):
+            step_time, _ = time_call(train_model.train_on_batch, inputs, outputs)
+            (first_steps if step == 0 else other_steps).append(step_time)
+
+    checkpoint.on_train_end()
+    return summarize(checkpoint.stall_times), summarize(writer.write_times), summarize(first_steps), summarize(other_steps)
+
+def _main_(args):
+    for name, async_write, full_every, freeze in [('synchronous', False, 1, False),
+                                                  ('background', True, 1, False),
+                                                  ('deltas', True, args.full_every, True)]:
+        with tempfile.TemporaryDirectory() as path:
+            stall, write, first_step, other_step = _run(args.architecture, path, async_write, full_every, freeze, args)
+
+        print('%-11s stall %8.1fms (max %8.1fms), write %8.1fms, step after checkpoint %8.1fms vs %8.1fms' % (
+            name, 1e3 * stall['mean'], 1e3 * stall['max'], 1e3 * write['mean'], 1e3 * first_step['mean'], 1e3 * other_step['mean']))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark checkpoint writing')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-e', '--epochs', type=int, default=5)
+    argparser.add_argument('-n', '--steps', type=int, default=5, help='training steps between checkpoints')
+    argparser.add_argument('-f', '--full-every', type=int, default=5, help='full checkpoint every N saves in the deltas mode')
+    argparser.add_argument('-b', '--batch-size', type=int, default=2)
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+
+    args = argparser.parse_args()
+    _main_(args)
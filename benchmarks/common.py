@@ -0,0 +1,108 @@
+import os
+import time
+import platform
+import subprocess
+import numpy as np
+
+ANCHORS = {
+    "full":  [10,13, 16,30, 33,23, 30,61, 62,45, 59,119, 116,90, 156,198, 373,326],
+    "tiny":  [10,14, 23,27, 37,58, 81,82, 135,169, 344,319],
+    "micro": [10,14, 23,27, 37,58, 81,82, 135,169, 344,319]
+}
+
+def create_random_model(architecture="full", nb_class=1, max_box_per_image=30, **kwargs):
+    """ Build a train/infer model pair with random weights for timing purposes.
+
+    Extra keyword arguments are passed on to yolo.create_yolo_model.
+    """
+    import yolo
+
+    num_scales = yolo.get_num_yolo_scales(architecture)
+
+    return yolo.create_yolo_model(
+        architecture,
+        nb_class            = nb_class,
+        anchors             = ANCHORS[architecture],
+        max_box_per_image   = max_box_per_image,
+        warmup_batches      = 0,
+        ignore_thresh       = 0.5,
+        grid_scales         = [1]*num_scales,
+        obj_scale           = 5,
+        noobj_scale         = 1,
+        xywh_scale          = 1,
+        class_scale         = 1,
+        **kwargs
+    )
+
+def random_training_batch(architecture, batch_size, net_size, nb_class=1, max_box_per_image=30, nb_objects=3):
+    """ Random inputs and dummy targets for one train_on_batch call of a model from create_random_model.
+
+    nb_objects boxes per image are put in the ground truth of the coarsest scale.
+    """
+    num_scales = 3 if architecture == "full" else 2
+    grids      = [net_size // 32 * 2**i for i in range(num_scales)]
+
+    images     = np.random.uniform(0, 1, (batch_size, net_size, net_size, 3))
+    true_boxes = np.zeros((batch_size, 1, 1, 1, max_box_per_image, 4))
+    true_yolos = [np.zeros((batch_size, grid, grid, 3, 5 + nb_class)) for grid in grids]
+
+    for i in range(batch_size):
+        for j in range(min(nb_objects, max_box_per_image)):
+            y, x = np.random.randint(grids[0], size=2)
+            w, h = np.random.uniform(16, net_size / 2., size=2)
+            true_yolos[0][i, y, x, j % 3, :5] = [x + .5, y + .5, 0., 0., 1.]
+            true_yolos[0][i, y, x, j % 3, 5]  = 1.
+            true_boxes[i, 0, 0, 0, j] = [x + .5, y + .5, w, h]
+
+    return [images, true_boxes] + true_yolos, [np.zeros((batch_size, 1)) for _ in range(num_scales)]
+
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def summarize(timings):
+    timings = np.asarray(timings, dtype=np.float64)
+
+    return {
+        'count': int(len(timings)),
+        'mean':  float(np.mean(timings)),
+        'std':   float(np.std(timings)),
+        'p50':   float(np.percentile(timings, 50)),
+        'p95':   float(np.percentile(timings, 95)),
+        'min':   float(np.min(timings)),
+        'max':   float(np.max(timings))
+    }
+
+def print_summary(name, timings, unit=1e3, unit_name='ms'):
+    s = summarize(timings)
+    print('%-40s n=%-4d mean=%8.2f%s p50=%8.2f%s p95=%8.2f%s max=%8.2f%s' % (
+        name, s['count'],
+        s['mean']*unit, unit_name, s['p50']*unit, unit_name,
+        s['p95']*unit, unit_name, s['max']*unit, unit_name))
+
+def machine_info():
+    """ Describe the machine and the software versions, to store next to benchmark results.
+    """
+    info = {
+        'platform':  platform.platform(),
+        'machine':   platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python':    platform.python_version(),
+        'numpy':     np.__version__,
+        'time':      time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+    for module in ['cv2', 'tensorflow', 'keras']:
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            info[module] = None
+
+    try:
+        info['commit'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        info['commit'] = None
+
+    return info
@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+""" Compare two results files of benchmarks.run and report regressions.
+
+Exits with status 1 when any benchmark got slower than the threshold, so it can
+gate a CI job.
+
+    python -m benchmarks.compare base.json results.json -t 0.1
+"""
+
+import sys
+import json
+import argparse
+
+def compare(base, current, metric='p50', threshold=0.1):
+    """ Compare the benchmarks present in both results.
+
+    # Returns
+        A list of (name, base time, current time, relative change, regressed) sorted by name.
+    """
+    rows = []
+
+    for name in sorted(set(base['results']) & set(current['results'])):
+        before = base['results'][name][metric]
+        after  = current['results'][name][metric]
+        change = (after - before) / before if before > 0 else 0.
+
+        rows.append((name, before, after, change, change > threshold))
+
+    return rows
+
+def _main_(args):
+    with open(args.base) as base_file, open(args.current) as current_file:
+        base, current = json.load(base_file), json.load(current_file)
+
+    for key in ['commit', 'processor', 'cpu_count', 'numpy', 'tensorflow']:
+        if base['machine'].get(key) != current['machine'].get(key):
+            print('%-10s %s -> %s' % (key, base['machine'].get(key), current['machine'].get(key)))
+
+    rows = compare(base, current, args.metric, args.threshold)
+
+    for name, before, after, change, regressed in rows:
+        print('%-50s %10.3fms %10.3fms %+7.1f%% %s' % (name, 1e3 * before, 1e3 * after, 100. * change, 'REGRESSION' if regressed else ''))
+
+    for name in sorted(set(base['results']) ^ set(current['results'])):
+        print('%-50s only in %s' % (name, args.base if name in base['results'] else args.current))
+
+    regressions = [row for row in rows if row[-1]]
+    print('\n%d benchmarks compared, %d regressed by more than %.0f%%' % (len(rows), len(regressions), 100. * args.threshold))
+
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Compare two benchmark results files')
+    argparser.add_argument('base', help='results of the reference commit')
+    argparser.add_argument('current', help='results of the commit under test')
+    argparser.add_argument('-m', '--metric', default='p50', help='statistic to compare: mean, p50, p95, min or max')
+    argparser.add_argument('-t', '--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+
+    args = argparser.parse_args()
+    sys.exit(_main_(args))
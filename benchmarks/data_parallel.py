@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+""" Training throughput of data-parallel workers on one machine, for 1, 2 and 4 processes
+and every allreduce backend.
+
+Every worker trains on its own batches of the given size, so N workers process N times
+more images per step. The time of averaging the gradients alone is reported as well.
+With -k, the weights are updated every k batches through GradientAccumulation, and the
+gradients are only exchanged on those batches.
+
+    python -m benchmarks.data_parallel -a tiny -p 1 2 4 -b 4
+"""
+
+import argparse
+import numpy as np
+from benchmarks.common import create_random_model, random_training_batch, time_call, summarize
+
+def _worker(architecture, batch_size, net_size, steps, accumulation_steps, rank, world_size, allreduce):
+    import yolo
+    from keras import backend as K
+    from keras.optimizers import Adam
+    from utils.accumulation import GradientAccumulation
+    from utils.data_parallel import DataParallelOptimizer, broadcast_weights, limit_threads
+
+    limit_threads(world_size)
+    train_model, _ = create_random_model(architecture)
+    optimizer = Adam(lr=1e-4, clipnorm=0.001)
+    if accumulation_steps > 1:
+        optimizer = GradientAccumulation(optimizer, accumulation_steps)
+    train_model.compile(loss=yolo.dummy_loss, optimizer=DataParallelOptimizer(optimizer, allreduce))
+    broadcast_weights(train_model, allreduce)
+
+    inputs, outputs = random_training_batch(architecture, batch_size, net_size)
+    train_model.train_on_batch(inputs, outputs)
+
+    step_times = [time_call(train_model.train_on_batch, inputs, outputs)[0] for _ in range(steps)]
+
+    gradients = [np.zeros(K.int_shape(weight), dtype=np.float32) for weight in train_model.trainable_weights]
+    allreduce_times = [time_call(allreduce.allreduce, gradients)[0] for _ in range(steps)]
+
+    return summarize(step_times), summarize(allreduce_times)
+
+def _main_(args):
+    from utils.allreduce import BACKENDS, launch
+
+    for backend in args.backends or sorted(BACKENDS):
+        baseline = None
+        for processes in args.processes:
+            results = launch(_worker, processes, backend, devices=[''],
+                             args=(args.architecture, args.batch_size, args.net_size, args.steps, args.accumulation_steps))
+
+            # a step ends for all workers at the same gradient exchange, the slowest sets the pace
+            step = max(results, key=lambda result: result[0]['mean'])[0]
+            images_per_s = processes * args.batch_size / step['mean']
+            baseline = baseline or images_per_s / processes
+
+            print('%-13s %d processes: step %8.1fms (p95 %8.1fms) %8.1f images/s, scaling %4.2f, allreduce %8.1fms' % (
+                backend, processes, 1e3 * step['mean'], 1e3 * step['p95'], images_per_s,
+                images_per_s / (baseline * processes), 1e3 * results[0][1]['mean']))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark data-parallel training')
+    argparser.add_argument('-a', '--architecture', default='tiny', help='full, tiny or micro')
+    argparser.add_argument('-p', '--processes', type=int, nargs='+', default=[1, 2, 4])
+    argparser.add_argument('--backends', nargs='+', help='allreduce backends, all of them by default')
+    argparser.add_argument('-b', '--batch-size', type=int, default=4, help='batch size of every process')
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('-n', '--steps', type=int, default=10)
+    argparser.add_argument('-k', '--accumulation-steps', type=int, default=1, help='batches per weight update')
+
+    args = argparser.parse_args()
+    _main_(args)
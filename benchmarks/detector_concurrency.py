@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+""" Compare Detector throughput for many concurrent callers against awaiting one
+image at a time, on a random-weight model.
+
+    python -m benchmarks.detector_concurrency -a tiny -n 64 -c 16
+"""
+
+import argparse
+import asyncio
+import time
+import numpy as np
+from benchmarks.common import ANCHORS, create_random_model
+from detector import Detector
+
+async def _sequential(detector, images):
+    for image in images:
+        await detector.detect(image)
+
+async def _concurrent(detector, images, callers):
+    queue = asyncio.Queue()
+    for image in images:
+        queue.put_nowait(image)
+
+    async def caller():
+        while not queue.empty():
+            await detector.detect(queue.get_nowait())
+
+    await asyncio.gather(*[caller() for _ in range(callers)])
+
+async def _run(args):
+    _, infer_model = create_random_model(args.architecture)
+    images = [np.random.randint(0, 255, (args.height, args.width, 3), dtype=np.uint8) for _ in range(args.num_images)]
+
+    async with Detector(infer_model, ANCHORS[args.architecture], ['object'], max_batch_size=args.max_batch_size) as detector:
+        # warm up both the single image and the full batch shapes
+        await detector.detect(images[0])
+        await detector.detect_many(images[:args.max_batch_size])
+
+        start = time.perf_counter()
+        await _sequential(detector, images)
+        sequential = len(images) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await _concurrent(detector, images, args.callers)
+        concurrent = len(images) / (time.perf_counter() - start)
+
+    print('sequential:             %.2f images/s' % sequential)
+    print('%3d concurrent callers: %.2f images/s (%.2fx)' % (args.callers, concurrent, concurrent / sequential))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark the asyncio Detector under concurrent load')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-n', '--num-images', type=int, default=64)
+    argparser.add_argument('-c', '--callers', type=int, default=16, help='number of concurrent callers')
+    argparser.add_argument('-b', '--max-batch-size', type=int, default=8)
+    argparser.add_argument('--width', type=int, default=640)
+    argparser.add_argument('--height', type=int, default=480)
+
+    args = argparser.parse_args()
+    asyncio.get_event_loop().run_until_complete(_run(args))
@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+""" Per-frame draw time of draw_boxes versus BoxRenderer (full resolution and
+preview) for growing numbers of boxes on a 4K frame.
+
+    python -m benchmarks.draw_boxes -n 10 100 500
+"""
+
+import argparse
+import numpy as np
+from benchmarks.common import time_call, print_summary
+from utils.bbox import BoundBox, draw_boxes
+from utils.render import BoxRenderer, boxes_to_columns
+
+def _random_boxes(count, nb_class, image_h, image_w):
+    boxes = []
+    for _ in range(count):
+        w, h = np.random.randint(20, image_w // 8), np.random.randint(20, image_h // 8)
+        x, y = np.random.randint(0, image_w - w), np.random.randint(60, image_h - h)
+
+        classes = np.zeros(nb_class)
+        classes[np.random.randint(nb_class)] = np.random.uniform(0.5, 1.)
+        boxes.append(BoundBox(x, y, x + w, y + h, 1., classes))
+
+    return boxes
+
+def _main_(args):
+    labels = ['class_%d' % i for i in range(args.classes)]
+    frame  = np.random.randint(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+
+    renderer = BoxRenderer(labels)
+    preview  = BoxRenderer(labels, preview_scale=args.preview_scale)
+
+    for count in args.boxes:
+        boxes = _random_boxes(count, len(labels), args.height, args.width)
+
+        # the sprite caches fill on first use, time the steady state
+        renderer.render(frame.copy(), boxes_to_columns(boxes, 0.4))
+        preview.render(frame, boxes_to_columns(boxes, 0.4))
+
+        print_summary('draw_boxes %4d boxes' % count,
+                      [time_call(draw_boxes, frame.copy(), boxes, labels, 0.4)[0] for _ in range(args.repeat)])
+        print_summary('renderer   %4d boxes' % count,
+                      [time_call(lambda image: renderer.render(image, boxes_to_columns(boxes, 0.4)), frame.copy())[0] for _ in range(args.repeat)])
+        print_summary('preview    %4d boxes' % count,
+                      [time_call(lambda: preview.render(frame, boxes_to_columns(boxes, 0.4)))[0] for _ in range(args.repeat)])
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark box drawing')
+    argparser.add_argument('-n', '--boxes', type=int, nargs='+', default=[10, 100, 500])
+    argparser.add_argument('-c', '--classes', type=int, default=20)
+    argparser.add_argument('-r', '--repeat', type=int, default=20)
+    argparser.add_argument('--preview-scale', type=float, default=0.25)
+    argparser.add_argument('--width', type=int, default=3840)
+    argparser.add_argument('--height', type=int, default=2160)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+""" Peak memory and time per weight update of training with the whole effective batch
+at once versus smaller batches with accumulated gradients.
+
+Every configuration runs in a fresh process, so that the peak resident memory
+reported belongs to that configuration alone.
+
+    python -m benchmarks.gradient_accumulation -a full -e 8 16 -m 2 4
+"""
+
+import argparse
+import resource
+import multiprocessing
+from benchmarks.common import create_random_model, random_training_batch, time_call, summarize
+
+def _measure(architecture, effective_batch_size, steps, net_size, updates):
+    import yolo
+    from keras.optimizers import Adam
+    from utils.accumulation import GradientAccumulation
+
+    train_model, _ = create_random_model(architecture)
+
+    optimizer = Adam(lr=1e-4, clipnorm=0.001)
+    if steps > 1:
+        optimizer = GradientAccumulation(optimizer, steps)
+    train_model.compile(loss=yolo.dummy_loss, optimizer=optimizer)
+
+    inputs, outputs = random_training_batch(architecture, effective_batch_size // steps, net_size)
+
+    def update():
+        for _ in range(steps):
+            train_model.train_on_batch(inputs, outputs)
+
+    update()
+    timings = [time_call(update)[0] for _ in range(updates)]
+    return summarize(timings), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def _main_(args):
+    context = multiprocessing.get_context('spawn')
+
+    for effective_batch_size in args.effective_batch_sizes:
+        for steps in [1] + args.steps:
+            if effective_batch_size % steps != 0:
+                continue
+
+            with context.Pool(1) as pool:
+                update, peak_mb = pool.apply(_measure, (args.architecture, effective_batch_size, steps, args.net_size, args.updates))
+
+            print('effective batch %3d = %3d x %d: update %8.1fms (p95 %8.1fms) %8.1f images/s, peak memory %8.1fMB' % (
+                effective_batch_size, effective_batch_size // steps, steps, 1e3 * update['mean'], 1e3 * update['p95'],
+                effective_batch_size / update['mean'], peak_mb))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark gradient accumulation')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-e', '--effective-batch-sizes', type=int, nargs='+', default=[8, 16])
+    argparser.add_argument('-m', '--steps', type=int, nargs='+', default=[2, 4], help='batches per weight update')
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('-n', '--updates', type=int, default=5)
+
+    args = argparser.parse_args()
+    _main_(args)
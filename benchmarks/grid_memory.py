@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+""" Peak memory and step time of training at large input sizes, including a final
+batch smaller than the others.
+
+Every input size runs in a fresh process, so that the peak resident memory reported
+belongs to it alone.
+
+    python -m benchmarks.grid_memory -a full -s 608 832 -b 8
+"""
+
+import argparse
+import resource
+import multiprocessing
+from benchmarks.common import create_random_model, random_training_batch, time_call, summarize
+
+def _measure(architecture, batch_size, net_size, steps):
+    import yolo
+    from keras.optimizers import Adam
+
+    train_model, _ = create_random_model(architecture)
+    train_model.compile(loss=yolo.dummy_loss, optimizer=Adam(lr=1e-4, clipnorm=0.001))
+
+    inputs, outputs = random_training_batch(architecture, batch_size, net_size)
+    train_model.train_on_batch(inputs, outputs)
+
+    timings = [time_call(train_model.train_on_batch, inputs, outputs)[0] for _ in range(steps)]
+
+    # the last batch of an epoch is usually smaller
+    inputs, outputs = random_training_batch(architecture, max(1, batch_size // 2 + 1), net_size)
+    train_model.train_on_batch(inputs, outputs)
+
+    return summarize(timings), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def _main_(args):
+    context = multiprocessing.get_context('spawn')
+
+    for net_size in args.net_sizes:
+        with context.Pool(1) as pool:
+            step, peak_mb = pool.apply(_measure, (args.architecture, args.batch_size, net_size, args.steps))
+
+        print('input %4d batch %3d: step %8.1fms (p95 %8.1fms), peak memory %8.1fMB' % (
+            net_size, args.batch_size, 1e3 * step['mean'], 1e3 * step['p95'], peak_mb))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark training memory at large input sizes')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-s', '--net-sizes', type=int, nargs='+', default=[608, 832])
+    argparser.add_argument('-b', '--batch-size', type=int, default=8)
+    argparser.add_argument('-n', '--steps', type=int, default=5)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+""" Time to reach a target mAP training with uniformly shuffled images versus images drawn
+by utils.sampling.HardExampleSampler, on a synthetic dataset where one class is much rarer
+than the others.
+
+The mAP is evaluated after every epoch on the training images, and the wall-clock time of
+the first epoch that reaches the target is reported, evaluation time excluded. Both modes
+start from the same random weights and see the same number of images per epoch.
+
+    python -m benchmarks.hard_example_mining -a tiny -n 200 -e 30 -t 0.3
+"""
+
+import time
+import argparse
+import tempfile
+import multiprocessing
+from benchmarks.common import ANCHORS, create_random_model
+from benchmarks.run import synthesize_dataset
+
+def _run(mode, instances, labels, args):
+    import yolo
+    import numpy as np
+    from keras.callbacks import Callback
+    from keras.optimizers import Adam
+    from generator import BatchGenerator
+    from callbacks import MeanAveragePrecision, HardExampleMining
+    from utils.sampling import HardExampleSampler, ImageLosses
+    from utils.utils import normalize
+
+    np.random.seed(args.seed)
+    train_model, infer_model = create_random_model(args.architecture, nb_class=len(labels))
+
+    sampler, image_losses = None, None
+    if mode == 'hard_examples':
+        sampler, image_losses = HardExampleSampler(seed=args.seed), ImageLosses()
+        train_model.compile(loss=yolo.dummy_loss, optimizer=Adam(lr=args.learning_rate),
+                            fetches=[image_losses.fetch(train_model)])
+    else:
+        train_model.compile(loss=yolo.dummy_loss, optimizer=Adam(lr=args.learning_rate))
+
+    generator = BatchGenerator(
+        instances           = instances,
+        anchors             = ANCHORS[args.architecture],
+        labels              = labels,
+        max_box_per_image   = 30,
+        batch_size          = args.batch_size,
+        min_net_size        = args.net_size,
+        max_net_size        = args.net_size,
+        shuffle             = sampler is None,
+        num_scales          = yolo.get_num_yolo_scales(args.architecture),
+        norm                = normalize,
+        sampler             = sampler
+    )
+    map_evaluation = MeanAveragePrecision(infer_model, instances, labels, ANCHORS[args.architecture],
+                                          net_size=args.net_size, batch_size=args.batch_size, seed=args.seed, verbose=0)
+
+    class TimeToTarget(Callback):
+        def on_train_begin(self, logs=None):
+            self.start, self.elapsed, self.reached, self.history = time.perf_counter(), 0., None, []
+
+        def on_epoch_end(self, epoch, logs=None):
+            # the evaluation of the epoch ran in the callback before this one
+            self.elapsed += time.perf_counter() - self.start - map_evaluation.eval_times[-1]
+            self.history.append(logs['val_mAP'])
+            if self.reached is None and logs['val_mAP'] >= args.target:
+                self.reached = (epoch + 1, self.elapsed)
+                self.model.stop_training = True
+            self.start = time.perf_counter()
+
+    time_to_target = TimeToTarget()
+    callbacks = [map_evaluation, time_to_target]
+    if sampler is not None:
+        callbacks.insert(0, HardExampleMining(generator, image_losses))
+
+    train_model.fit_generator(
+        generator        = generator,
+        steps_per_epoch  = len(generator),
+        epochs           = args.epochs,
+        verbose          = 0,
+        callbacks        = callbacks,
+        workers          = 1,
+        shuffle          = sampler is None
+    )
+    return time_to_target.reached, time_to_target.elapsed, time_to_target.history
+
+def _main_(args):
+    from voc import parse_voc_annotation
+
+    # the last class is rare: a label list drawn from uniformly by synthesize_dataset
+    labels = ['class_%d' % i for i in range(args.classes)]
+    weighted = labels[:-1] * args.imbalance + labels[-1:]
+
+    with tempfile.TemporaryDirectory() as path:
+        image_dir, annot_dir = synthesize_dataset(path, args.images, 3, weighted, seed=args.seed)
+        instances, _ = parse_voc_annotation(annot_dir, image_dir, None, labels)
+
+        for mode in ['uniform', 'hard_examples']:
+            # a fresh process, and so a fresh graph, per mode
+            with multiprocessing.get_context('spawn').Pool(1) as pool:
+                reached, elapsed, history = pool.apply(_run, (mode, instances, labels, args))
+
+            if reached:
+                print('%-13s mAP %.2f after %3d epochs, %8.1fs' % (mode, args.target, reached[0], reached[1]))
+            else:
+                print('%-13s mAP %.2f not reached in %3d epochs (best %.4f), %8.1fs' % (
+                    mode, args.target, len(history), max(history), elapsed))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark the time to a target mAP with hard example sampling')
+    argparser.add_argument('-a', '--architecture', default='tiny', help='full, tiny or micro')
+    argparser.add_argument('-n', '--images', type=int, default=200)
+    argparser.add_argument('-e', '--epochs', type=int, default=30, help='epochs at most')
+    argparser.add_argument('-t', '--target', type=float, default=0.3, help='target mAP')
+    argparser.add_argument('-b', '--batch-size', type=int, default=8)
+    argparser.add_argument('-s', '--net-size', type=int, default=288)
+    argparser.add_argument('-l', '--learning-rate', type=float, default=1e-3)
+    argparser.add_argument('--classes', type=int, default=3)
+    argparser.add_argument('--imbalance', type=int, default=10, help='how many times more common the other classes are')
+    argparser.add_argument('--seed', type=int, default=0)
+
+    args = argparser.parse_args()
+    _main_(args)
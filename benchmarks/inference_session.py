@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+""" Measure first-call versus steady-state latency of the inference model at
+several input resolutions, with and without an InferenceSession.
+
+    python -m benchmarks.inference_session -a tiny -s 320x320 416x416 608x352
+"""
+
+import argparse
+import numpy as np
+from benchmarks.common import create_random_model, time_call, print_summary
+from utils.inference import InferenceSession
+
+def _parse_shape(value):
+    net_w, net_h = value.lower().split('x')
+    return int(net_h), int(net_w)
+
+def _run(name, predict, shapes, batch_size, repeat):
+    for net_h, net_w in shapes:
+        batch_input = np.random.uniform(size=(batch_size, net_h, net_w, 3))
+
+        first, _ = time_call(predict, batch_input)
+        steady   = [time_call(predict, batch_input)[0] for _ in range(repeat)]
+
+        print_summary('%s %dx%d first' % (name, net_w, net_h), [first])
+        print_summary('%s %dx%d steady' % (name, net_w, net_h), steady)
+
+def _main_(args):
+    shapes = [_parse_shape(shape) for shape in args.shapes]
+
+    _, infer_model = create_random_model(args.architecture)
+    _run('model', infer_model.predict_on_batch, shapes, args.batch_size, args.repeat)
+
+    # a fresh model, so nothing is shared with the plain run above
+    _, infer_model = create_random_model(args.architecture)
+    session = InferenceSession(infer_model, max_shapes=len(shapes))
+    session.warmup([(args.batch_size, net_h, net_w) for net_h, net_w in shapes])
+    _run('session', session.predict_on_batch, shapes, args.batch_size, args.repeat)
+
+    print(session.stats())
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark shape-specialized inference')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-s', '--shapes', nargs='+', default=['416x416', '320x320', '608x352'], help='input sizes as WIDTHxHEIGHT')
+    argparser.add_argument('-b', '--batch-size', type=int, default=1)
+    argparser.add_argument('-r', '--repeat', type=int, default=10)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+""" Load generator for server.py. Sends a synthetic JPEG from several concurrent
+clients for a fixed duration and reports throughput, client-side latency
+percentiles and the server's own batching metrics.
+
+    python server.py -c config.json &
+    python -m benchmarks.load_generator -n 16 -d 30
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+import cv2
+import numpy as np
+from benchmarks.common import print_summary
+
+def _post(url, payload):
+    request = urllib.request.Request(url, data=payload, headers={'Content-Type': 'image/jpeg'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+def _client(url, payload, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            _post(url, payload)
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors.append(1)
+
+def _main_(args):
+    url     = 'http://%s:%d' % (args.host, args.port)
+    image   = np.random.randint(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+    payload = cv2.imencode('.jpg', image)[1].tobytes()
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.duration
+    clients  = [threading.Thread(target=_client, args=(url + '/detect', payload, deadline, latencies, errors)) for _ in range(args.clients)]
+
+    start = time.perf_counter()
+    for client in clients: client.start()
+    for client in clients: client.join()
+    elapsed = time.perf_counter() - start
+
+    print('%d clients, %d requests, %d errors, %.2f requests/s' % (args.clients, len(latencies), len(errors), len(latencies) / elapsed))
+    if latencies:
+        print_summary('client latency', latencies)
+
+    with urllib.request.urlopen(url + '/metrics') as response:
+        print(json.dumps(json.loads(response.read().decode('utf-8')), indent=4))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Generate load against server.py')
+    argparser.add_argument('--host', default='127.0.0.1')
+    argparser.add_argument('-p', '--port', type=int, default=8080)
+    argparser.add_argument('-n', '--clients', type=int, default=8, help='number of concurrent clients')
+    argparser.add_argument('-d', '--duration', type=float, default=20., help='seconds to run')
+    argparser.add_argument('--width', type=int, default=640)
+    argparser.add_argument('--height', type=int, default=480)
+
+    args = argparser.parse_args()
+    _main_(args)
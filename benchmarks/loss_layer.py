@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+""" Train step time and peak memory of the YoloLayer loss for growing max_box_per_image,
+with and without the loss statistics.
+
+Images hold a handful of objects whatever max_box_per_image is, as in real datasets
+where it is set by the single most crowded image. Every configuration runs in a fresh
+process so that the peak resident memory belongs to it alone.
+
+    python -m benchmarks.loss_layer -a full -m 30 100 500
+"""
+
+import argparse
+import resource
+import multiprocessing
+from benchmarks.common import create_random_model, random_training_batch, time_call, summarize
+
+def _measure(architecture, batch_size, net_size, max_box_per_image, nb_objects, stats, steps):
+    import yolo
+    from keras.optimizers import Adam
+
+    train_model, _ = create_random_model(architecture, max_box_per_image=max_box_per_image, loss_stats=stats)
+    train_model.compile(loss=yolo.dummy_loss, optimizer=Adam(lr=1e-4, clipnorm=0.001))
+    if stats: yolo.add_loss_stats(train_model)
+
+    inputs, outputs = random_training_batch(architecture, batch_size, net_size, max_box_per_image=max_box_per_image, nb_objects=nb_objects)
+    train_model.train_on_batch(inputs, outputs)
+
+    timings = [time_call(train_model.train_on_batch, inputs, outputs)[0] for _ in range(steps)]
+    return summarize(timings), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def _main_(args):
+    context = multiprocessing.get_context('spawn')
+
+    for max_box_per_image in args.max_box_per_image:
+        for stats in [False, True]:
+            with context.Pool(1) as pool:
+                step, peak_mb = pool.apply(_measure, (args.architecture, args.batch_size, args.net_size,
+                                                      max_box_per_image, args.objects, stats, args.steps))
+
+            print('max_box_per_image %4d stats %-5s: step %8.1fms (p95 %8.1fms), peak memory %8.1fMB' % (
+                max_box_per_image, stats, 1e3 * step['mean'], 1e3 * step['p95'], peak_mb))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark the YoloLayer loss')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-m', '--max-box-per-image', type=int, nargs='+', default=[30, 100, 500])
+    argparser.add_argument('-o', '--objects', type=int, default=5, help='objects per image')
+    argparser.add_argument('-b', '--batch-size', type=int, default=8)
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('-n', '--steps', type=int, default=10)
+
+    args = argparser.parse_args()
+    _main_(args)
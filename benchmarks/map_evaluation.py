@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+""" Time of an mAP evaluation with utils.utils.evaluate, which reads, letterboxes and runs
+the images one by one, versus the MeanAveragePrecision callback on the same images, cached
+letterboxed in memory, run in batches and scored with array operations.
+
+Pass the weights of a trained model with -w for detections, and so an mAP, worth comparing.
+
+    python -m benchmarks.map_evaluation -a full -n 100 -w backend.h5
+"""
+
+import argparse
+import tempfile
+from benchmarks.common import ANCHORS, create_random_model, time_call, summarize
+from benchmarks.run import synthesize_dataset
+
+def _main_(args):
+    from voc import parse_voc_annotation
+    from generator import BatchGenerator
+    from callbacks import MeanAveragePrecision
+    from utils.utils import evaluate, normalize
+
+    labels = ['class_%d' % i for i in range(args.classes)]
+    _, infer_model = create_random_model(args.architecture, nb_class=len(labels))
+    if args.weights:
+        infer_model.load_weights(args.weights, by_name=True, skip_mismatch=True)
+
+    with tempfile.TemporaryDirectory() as path:
+        image_dir, annot_dir = synthesize_dataset(path, args.images, 3, labels)
+        instances, _ = parse_voc_annotation(annot_dir, image_dir, None, labels)
+
+        generator = BatchGenerator(
+            instances           = instances,
+            anchors             = ANCHORS[args.architecture],
+            labels              = labels,
+            batch_size          = args.batch_size,
+            min_net_size        = args.net_size,
+            max_net_size        = args.net_size,
+            shuffle             = False,
+            norm                = normalize
+        )
+        callback = MeanAveragePrecision(infer_model, instances, labels, ANCHORS[args.architecture],
+                                        net_size=args.net_size, batch_size=args.batch_size, verbose=0)
+
+        evaluate_times, callback_times = [], []
+        for _ in range(args.repeat):
+            evaluate_time, evaluate_aps = time_call(evaluate, infer_model, generator, net_h=args.net_size, net_w=args.net_size)
+            evaluate_times.append(evaluate_time)
+        cache_time, _ = time_call(callback.on_train_begin)
+        for _ in range(args.repeat):
+            callback_time, callback_aps = time_call(callback.evaluate)
+            callback_times.append(callback_time)
+
+    for name, times, average_precisions in [('evaluate', evaluate_times, evaluate_aps),
+                                            ('callback', callback_times, callback_aps)]:
+        timing = summarize(times)
+        print('%-8s %8.2fs per evaluation (%6.1fms per image), mAP %.4f' % (
+            name, timing['mean'], 1e3 * timing['mean'] / len(instances),
+            sum(average_precisions.values()) / len(average_precisions)))
+    print('images cached in %.2fs, %.1f MB' % (cache_time, callback.images.nbytes / 2.**20))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark the mAP evaluation during training')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-w', '--weights', help='weights of the model, loaded by layer name')
+    argparser.add_argument('-n', '--images', type=int, default=100)
+    argparser.add_argument('-b', '--batch-size', type=int, default=8)
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('-r', '--repeat', type=int, default=3)
+    argparser.add_argument('--classes', type=int, default=1)
+
+    args = argparser.parse_args()
+    _main_(args)
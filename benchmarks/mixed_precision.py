@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+""" Train step time and peak memory of float32 versus mixed precision training.
+
+Every configuration runs in a fresh process, so that the peak resident memory
+reported belongs to that configuration alone.
+
+    python -m benchmarks.mixed_precision -a full -b 8 16 -d float32 bfloat16 float16
+"""
+
+import argparse
+import resource
+import multiprocessing
+from benchmarks.common import create_random_model, random_training_batch, time_call, summarize
+
+def _measure(architecture, batch_size, net_size, dtype, steps):
+    import yolo
+    from keras.optimizers import Adam
+    from utils.precision import LossScaledAdam
+
+    compute_dtype = None if dtype == 'float32' else dtype
+    train_model, _ = create_random_model(architecture, compute_dtype=compute_dtype)
+
+    if compute_dtype is None:
+        optimizer = Adam(lr=1e-4, clipnorm=0.001)
+    else:
+        optimizer = LossScaledAdam(loss_scale=128. if dtype == 'float16' else 1., lr=1e-4, clipnorm=0.001)
+    train_model.compile(loss=yolo.dummy_loss, optimizer=optimizer)
+
+    inputs, outputs = random_training_batch(architecture, batch_size, net_size)
+    train_model.train_on_batch(inputs, outputs)
+
+    timings = [time_call(train_model.train_on_batch, inputs, outputs)[0] for _ in range(steps)]
+    return summarize(timings), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def _main_(args):
+    context = multiprocessing.get_context('spawn')
+
+    for batch_size in args.batch_sizes:
+        for dtype in args.dtypes:
+            with context.Pool(1) as pool:
+                try:
+                    step, peak_mb = pool.apply(_measure, (args.architecture, batch_size, args.net_size, dtype, args.steps))
+                except Exception as e: # e.g. no bfloat16 convolution kernel on this CPU or build
+                    print('batch %3d %-9s failed: %s' % (batch_size, dtype, e))
+                    continue
+
+            print('batch %3d %-9s step %8.1fms (p95 %8.1fms) %8.1f images/s, peak memory %8.1fMB' % (
+                batch_size, dtype, 1e3 * step['mean'], 1e3 * step['p95'], batch_size / step['mean'], peak_mb))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark mixed precision training')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-b', '--batch-sizes', type=int, nargs='+', default=[8, 16])
+    argparser.add_argument('-d', '--dtypes', nargs='+', default=['float32', 'bfloat16', 'float16'])
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('-n', '--steps', type=int, default=10)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+""" Compare motion-gated ROI detection against full-frame detection on a mostly
+static clip: frames/s and CPU utilization (process CPU time over wall time).
+
+    python -m benchmarks.motion_roi -c config.json -i static_camera.mp4
+    python -m benchmarks.motion_roi -a tiny -i static_camera.mp4
+"""
+
+import argparse
+import json
+import os
+import time
+import cv2
+from benchmarks.common import ANCHORS, create_random_model
+from utils.utils import get_yolo_boxes
+from utils.motion import MotionGatedDetector
+
+def _measure(name, detect, frames):
+    wall, cpu = time.perf_counter(), sum(os.times()[:2])
+    for frame in frames:
+        detect(frame)
+    wall, cpu = time.perf_counter() - wall, sum(os.times()[:2]) - cpu
+
+    print('%-12s %7.2f frames/s, CPU %5.1f%%' % (name, len(frames) / wall, 100. * cpu / wall))
+
+def _main_(args):
+    if args.conf:
+        from keras.models import load_model
+
+        with open(args.conf) as config_buffer:
+            config = json.load(config_buffer)
+        infer_model = load_model(config['train']['saved_weights_name'])
+        anchors = config['model']['anchors']
+    else:
+        _, infer_model = create_random_model(args.architecture)
+        anchors = ANCHORS[args.architecture]
+
+    video_reader = cv2.VideoCapture(args.input)
+    frames = []
+    while len(frames) < args.max_frames:
+        ret_val, frame = video_reader.read()
+        if not ret_val: break
+        frames.append(frame)
+    video_reader.release()
+
+    net_size = args.net_size
+    get_yolo_boxes(infer_model, frames[:1], net_size, net_size, anchors, 0.5, 0.45) # warm up
+
+    _measure('full frame', lambda frame: get_yolo_boxes(infer_model, [frame], net_size, net_size, anchors, 0.5, 0.45), frames)
+
+    detector = MotionGatedDetector(infer_model, anchors, 0.5, 0.45, net_size=net_size)
+    _measure('motion roi', detector, frames)
+    print('%d frames, %d network calls, %d crops' % (detector.frames, detector.detections, detector.crops))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark motion-gated ROI detection')
+    argparser.add_argument('-c', '--conf', help='config of a trained model; a random-weight model is used otherwise')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro, for the random-weight model')
+    argparser.add_argument('-i', '--input', help='path to a sample video')
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('--max-frames', type=int, default=300)
+
+    args = argparser.parse_args()
+    _main_(args)
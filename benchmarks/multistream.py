@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+""" Measure aggregate frames/s of the multi-stream runner as the number of streams
+grows. Streams are read from local sample files (reused round-robin when there
+are fewer files than streams) as fast as they decode, on a random-weight model.
+
+    python -m benchmarks.multistream -a tiny -i a.mp4 b.mp4 -n 1 2 4 8
+"""
+
+import argparse
+from benchmarks.common import ANCHORS, create_random_model
+from utils.inference import InferenceSession
+from utils.multistream import MultiStreamRunner
+
+def _main_(args):
+    _, infer_model = create_random_model(args.architecture)
+    infer_model = InferenceSession(infer_model, max_shapes=args.max_batch_size)
+    infer_model.warmup([(size, args.net_size, args.net_size) for size in range(1, args.max_batch_size + 1)])
+
+    for count in args.streams:
+        sources = [args.inputs[i % len(args.inputs)] for i in range(count)]
+        runner  = MultiStreamRunner(infer_model, sources, ANCHORS[args.architecture],
+                                    args.net_size, args.net_size, 0.5, 0.45,
+                                    on_result      = lambda *_: None,
+                                    max_batch_size = args.max_batch_size,
+                                    pace           = args.pace)
+        stats = runner.run(args.duration)
+
+        dropped = sum(stream['dropped'] for stream in stats['streams'])
+        decoded = sum(stream['decoded'] for stream in stats['streams'])
+        print('%3d streams: %7.2f aggregate fps, %5.2f images/batch, %5.1f%% frames dropped' % (
+            count, stats['aggregate_fps'],
+            sum(stream['processed'] for stream in stats['streams']) / float(max(stats['batches'], 1)),
+            100. * dropped / max(decoded, 1)))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark cross-stream batching')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-i', '--inputs', nargs='+', help='local sample video files')
+    argparser.add_argument('-n', '--streams', type=int, nargs='+', default=[1, 2, 4, 8])
+    argparser.add_argument('-b', '--max-batch-size', type=int, default=8)
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('-d', '--duration', type=float, default=20.)
+    argparser.add_argument('--pace', action='store_true', help='read files at their native frame rate')
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+""" Step time variance of multi-scale training with input sizes switching every 10
+batches versus grouped per epoch, with and without recycled batch buffers.
+
+A random-weight model is trained on synthetic images for a few epochs per mode and
+the time of every generator call and train step is recorded.
+
+    python -m benchmarks.net_size_schedule -a tiny -e 3 -n 64
+"""
+
+import argparse
+import tempfile
+import numpy as np
+from benchmarks.common import ANCHORS, create_random_model, time_call, summarize
+from benchmarks.run import synthesize_dataset
+
+def _run(train_model, instances, labels, args, contiguous, buffer_pool):
+    from generator import BatchGenerator, NetSizeScheduler
+    from utils.utils import normalize
+
+    generator = BatchGenerator(
+        instances           = instances,
+        anchors             = ANCHORS[args.architecture],
+        labels              = labels,
+        max_box_per_image   = args.max_box_per_image,
+        batch_size          = args.batch_size,
+        min_net_size        = args.min_net_size,
+        max_net_size        = args.max_net_size,
+        norm                = normalize,
+        net_size_scheduler  = NetSizeScheduler(args.min_net_size, args.max_net_size, seed=0, contiguous=contiguous),
+        buffer_pool         = buffer_pool
+    )
+
+    getitem_times, step_times, switches = [], [], 0
+    for epoch in range(args.epochs):
+        switches += generator.net_size_scheduler.switches(epoch, len(generator))
+
+        for idx in range(len(generator)):
+            getitem_time, (inputs, outputs) = time_call(generator.__getitem__, idx)
+            step_time, _ = time_call(train_model.train_on_batch, inputs, outputs)
+
+            getitem_times.append(getitem_time)
+            step_times.append(step_time)
+        generator.on_epoch_end()
+
+    # the first epoch pays for building the graph of every size
+    skip = len(generator)
+    return summarize(getitem_times[skip:]), summarize(step_times[skip:]), summarize(step_times[:skip]), switches
+
+def _main_(args):
+    import yolo
+    from keras.optimizers import Adam
+    from voc import parse_voc_annotation
+
+    labels = ['class_%d' % i for i in range(args.classes)]
+
+    with tempfile.TemporaryDirectory() as path:
+        image_dir, annot_dir = synthesize_dataset(path, args.images, 3, labels)
+        instances, _ = parse_voc_annotation(annot_dir, image_dir, None, labels)
+
+        for contiguous, buffer_pool in [(False, 0), (True, 0), (True, 4)]:
+            train_model, _ = create_random_model(args.architecture, nb_class=args.classes, max_box_per_image=args.max_box_per_image)
+            train_model.compile(loss=yolo.dummy_loss, optimizer=Adam(lr=1e-4))
+
+            getitem, step, first_epoch, switches = _run(train_model, instances, labels, args, contiguous, buffer_pool)
+            print('%-10s buffers=%d: %3d size switches, step %7.1fms +- %6.1fms (p95 %7.1fms), first epoch step p95 %7.1fms, getitem %6.1fms' % (
+                'grouped' if contiguous else 'every 10', buffer_pool, switches,
+                1e3 * step['mean'], 1e3 * step['std'], 1e3 * step['p95'], 1e3 * first_epoch['p95'], 1e3 * getitem['mean']))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark net size scheduling')
+    argparser.add_argument('-a', '--architecture', default='tiny', help='full, tiny or micro')
+    argparser.add_argument('-e', '--epochs', type=int, default=3)
+    argparser.add_argument('-n', '--images', type=int, default=64)
+    argparser.add_argument('-b', '--batch-size', type=int, default=4)
+    argparser.add_argument('--classes', type=int, default=4)
+    argparser.add_argument('--max-box-per-image', type=int, default=10)
+    argparser.add_argument('--min-net-size', type=int, default=288)
+    argparser.add_argument('--max-net-size', type=int, default=448)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+""" Compare square letterboxing with rectangular inference on 16:9 inputs.
+
+Throughput is measured on synthetic frames with a random-weight model. When a
+config is given, mAP of the trained model on its validation set is reported for
+both modes as well.
+
+    python -m benchmarks.rect_inference -a tiny -n 50
+    python -m benchmarks.rect_inference -c config.json
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+from benchmarks.common import ANCHORS, create_random_model
+from utils.utils import get_yolo_boxes, get_rect_net_size, evaluate, normalize
+
+def _throughput(model, images, net_h, net_w, anchors):
+    start = time.perf_counter()
+    for image in images:
+        get_yolo_boxes(model, [image], net_h, net_w, anchors, 0.5, 0.45)
+    return len(images) / (time.perf_counter() - start)
+
+def _map(config, net_size):
+    from keras.models import load_model
+    from voc import parse_voc_annotation
+    from generator import BatchGenerator
+
+    valid_ints, labels = parse_voc_annotation(
+        config['valid']['valid_annot_folder'],
+        config['valid']['valid_image_folder'],
+        config['valid']['cache_name'],
+        config['model']['labels']
+    )
+    valid_generator = BatchGenerator(
+        instances   = valid_ints,
+        anchors     = config['model']['anchors'],
+        labels      = sorted(config['model']['labels'] or labels.keys()),
+        shuffle     = False,
+        norm        = normalize
+    )
+    infer_model = load_model(config['train']['saved_weights_name'])
+
+    for rect in [False, True]:
+        average_precisions = evaluate(infer_model, valid_generator, net_h=net_size, net_w=net_size, rect=rect)
+        print('%-6s mAP: %.4f' % ('rect' if rect else 'square', sum(average_precisions.values()) / len(average_precisions)))
+
+def _main_(args):
+    if args.conf:
+        with open(args.conf) as config_buffer:
+            _map(json.load(config_buffer), args.net_size)
+        return
+
+    _, infer_model = create_random_model(args.architecture)
+    anchors = ANCHORS[args.architecture]
+
+    images = [np.random.randint(0, 255, (args.height, args.width, 3), dtype=np.uint8) for _ in range(args.num_images)]
+    rect_h, rect_w = get_rect_net_size(args.height, args.width, args.net_size)
+
+    # warm up both shapes so neither mode pays the first-call cost
+    get_yolo_boxes(infer_model, images[:1], args.net_size, args.net_size, anchors, 0.5, 0.45)
+    get_yolo_boxes(infer_model, images[:1], rect_h, rect_w, anchors, 0.5, 0.45)
+
+    square = _throughput(infer_model, images, args.net_size, args.net_size, anchors)
+    rect   = _throughput(infer_model, images, rect_h, rect_w, anchors)
+
+    print('square %dx%d: %.2f images/s' % (args.net_size, args.net_size, square))
+    print('rect   %dx%d: %.2f images/s (%.1f%% fewer input pixels)' % (
+        rect_w, rect_h, rect, 100. * (1 - float(rect_h*rect_w) / (args.net_size*args.net_size))))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark rectangular versus square letterbox inference')
+    argparser.add_argument('-a', '--architecture', default='full', help='full, tiny or micro')
+    argparser.add_argument('-c', '--conf', help='config of a trained model, to compare mAP on its validation set')
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('-n', '--num-images', type=int, default=20)
+    argparser.add_argument('--width', type=int, default=1920)
+    argparser.add_argument('--height', type=int, default=1080)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+""" Run the benchmark suite on synthetic data and write the timings as JSON.
+
+Images, VOC annotations and random-weight models are generated on the fly, so the
+suite runs on a CPU-only machine without any dataset. Benchmarks that need Keras
+are reported as skipped when it is not installed.
+
+    python -m benchmarks.run -o results.json
+    python -m benchmarks.run -a tiny -s 320 416 -n 64 -k decode_netout do_nms
+    python -m benchmarks.compare base.json results.json
+"""
+
+import io
+import os
+import json
+import random
+import argparse
+import tempfile
+import contextlib
+import cv2
+import numpy as np
+from benchmarks.common import ANCHORS, create_random_model, time_call, summarize, print_summary, machine_info
+from utils.bbox import BoundBox
+from utils.utils import preprocess_input, decode_netout, do_nms, get_yolo_boxes, evaluate, normalize
+
+def synthesize_dataset(path, num_images, objects_per_image, labels, seed=0):
+    """ Write random images with rectangles on them and matching VOC annotations.
+
+    # Returns
+        The image and annotation directories.
+    """
+    rng = np.random.RandomState(seed)
+    image_dir = os.path.join(path, 'images')
+    annot_dir = os.path.join(path, 'annotations')
+    os.makedirs(image_dir)
+    os.makedirs(annot_dir)
+
+    for i in range(num_images):
+        image_h, image_w = [(480, 640), (720, 1280), (1080, 1920)][i % 3]
+        image = rng.randint(0, 255, (image_h, image_w, 3)).astype(np.uint8)
+        filename = 'image_%05d.jpg' % i
+
+        objects = []
+        for _ in range(rng.randint(1, 2*objects_per_image)):
+            w, h = rng.randint(16, image_w // 3), rng.randint(16, image_h // 3)
+            x, y = rng.randint(0, image_w - w), rng.randint(0, image_h - h)
+            cv2.rectangle(image, (x, y), (x + w, y + h), tuple(int(c) for c in rng.randint(0, 255, 3)), -1)
+            objects.append(
+                '<object><name>%s</name><bndbox><xmin>%d</xmin><ymin>%d</ymin><xmax>%d</xmax><ymax>%d</ymax></bndbox></object>' % (
+                labels[rng.randint(len(labels))], x, y, x + w, y + h))
+
+        cv2.imwrite(os.path.join(image_dir, filename), image)
+
+        with open(os.path.join(annot_dir, 'image_%05d.xml' % i), 'w') as annotation:
+            annotation.write('<annotation><filename>%s</filename><size><width>%d</width><height>%d</height><depth>3</depth></size>%s</annotation>' % (
+                filename, image_w, image_h, ''.join(objects)))
+
+    return image_dir, annot_dir
+
+def _random_netout(grid_h, grid_w, nb_class, rng, positive_ratio=0.01):
+    netout = rng.normal(0, 1, (grid_h, grid_w, 3*(5 + nb_class))).astype(np.float32)
+    objectness = netout.reshape((grid_h, grid_w, 3, -1))[..., 4]
+    objectness[:] = np.where(rng.uniform(size=objectness.shape) < positive_ratio, 4., -4.)
+    return netout
+
+def bench_preprocess_input(args, context):
+    for image in context['images'][:3]:
+        image_h, image_w = image.shape[:2]
+        for net_size in args.net_sizes:
+            yield 'preprocess_input/%dx%d/%d' % (image_w, image_h, net_size), \
+                  [time_call(preprocess_input, image, net_size, net_size)[0] for _ in range(args.repeat)]
+
+def bench_decode_netout(args, context):
+    rng = np.random.RandomState(0)
+    for net_size in args.net_sizes:
+        for scale, anchors in zip([1, 2, 4], [ANCHORS['full'][12:], ANCHORS['full'][6:12], ANCHORS['full'][:6]]):
+            grid = scale * net_size // 32
+            netouts = [_random_netout(grid, grid, args.classes, rng) for _ in range(args.repeat)]
+
+            yield 'decode_netout/%d/grid%d' % (net_size, grid), \
+                  [time_call(decode_netout, netout, anchors, 0.5, net_size, net_size)[0] for netout in netouts]
+
+def bench_do_nms(args, context):
+    rng = np.random.RandomState(0)
+    for net_size in args.net_sizes:
+        boxes = []
+        for scale, anchors in zip([1, 2, 4], [ANCHORS['full'][12:], ANCHORS['full'][6:12], ANCHORS['full'][:6]]):
+            grid = scale * net_size // 32
+            boxes += decode_netout(_random_netout(grid, grid, args.classes, rng, positive_ratio=0.05), anchors, 0.5, net_size, net_size)
+
+        timings = []
+        for _ in range(args.repeat):
+            copies = [BoundBox(box.xmin, box.ymin, box.xmax, box.ymax, box.c, box.classes.copy()) for box in boxes]
+            timings.append(time_call(do_nms, copies, 0.45)[0])
+
+        yield 'do_nms/%d/%dboxes' % (net_size, len(boxes)), timings
+
+def bench_get_yolo_boxes(args, context):
+    image = context['images'][1]
+    for architecture in args.architectures:
+        model = context['model'](architecture)
+        for net_size in args.net_sizes:
+            get_yolo_boxes(model, [image], net_size, net_size, ANCHORS[architecture], 0.5, 0.45)
+
+            yield 'get_yolo_boxes/%s/%d' % (architecture, net_size), \
+                  [time_call(get_yolo_boxes, model, [image], net_size, net_size, ANCHORS[architecture], 0.5, 0.45)[0] for _ in range(args.repeat)]
+
+def bench_batch_generator(args, context):
+    from generator import BatchGenerator
+
+    for net_size in args.net_sizes:
+        generator = BatchGenerator(
+            instances           = context['instances'],
+            anchors             = ANCHORS['full'],
+            labels              = context['labels'],
+            max_box_per_image   = max(len(instance['object']) for instance in context['instances']),
+            batch_size          = args.batch_size,
+            shuffle             = False,
+            norm                = normalize,
+            explicit_net_size   = (net_size, net_size)
+        )
+        yield 'BatchGenerator.__getitem__/%d/batch%d' % (net_size, args.batch_size), \
+              [time_call(generator.__getitem__, i % len(generator))[0] for i in range(args.repeat)]
+
+def bench_parse_voc_annotation(args, context):
+    from voc import parse_voc_annotation
+
+    yield 'parse_voc_annotation/%dfiles' % args.images, \
+          [time_call(parse_voc_annotation, context['annot_dir'], context['image_dir'], None, context['labels'])[0] for _ in range(args.repeat)]
+
+def bench_run_kmeans(args, context):
+    from gen_anchors import run_kmeans
+
+    dims = np.array([((obj['xmax'] - obj['xmin']) / float(instance['width']), (obj['ymax'] - obj['ymin']) / float(instance['height']))
+                     for instance in context['instances'] for obj in instance['object']])
+
+    timings = []
+    for i in range(args.repeat):
+        random.seed(i)
+        with contextlib.redirect_stdout(io.StringIO()): # run_kmeans prints every iteration
+            timings.append(time_call(run_kmeans, dims.copy(), 9)[0])
+
+    yield 'run_kmeans/%dboxes' % len(dims), timings
+
+def bench_evaluate(args, context):
+    from generator import BatchGenerator
+
+    generator = BatchGenerator(
+        instances   = context['instances'],
+        anchors     = ANCHORS[args.architectures[0]],
+        labels      = context['labels'],
+        shuffle     = False,
+        norm        = normalize
+    )
+    model = context['model'](args.architectures[0])
+    net_size = args.net_sizes[0]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        timings = [time_call(evaluate, model, generator, net_h=net_size, net_w=net_size)[0] for _ in range(max(1, args.repeat // 5))]
+
+    yield 'evaluate/%s/%d/%dimages' % (args.architectures[0], net_size, args.images), timings
+
+BENCHMARKS = [
+    ('preprocess_input',        bench_preprocess_input),
+    ('decode_netout',           bench_decode_netout),
+    ('do_nms',                  bench_do_nms),
+    ('get_yolo_boxes',          bench_get_yolo_boxes),
+    ('batch_generator',         bench_batch_generator),
+    ('parse_voc_annotation',    bench_parse_voc_annotation),
+    ('run_kmeans',              bench_run_kmeans),
+    ('evaluate',                bench_evaluate)
+]
+
+def _main_(args):
+    labels = ['class_%d' % i for i in range(args.classes)]
+    models = {}
+
+    def model(architecture):
+        if architecture not in models:
+            models[architecture] = create_random_model(architecture, nb_class=args.classes)[1]
+        return models[architecture]
+
+    results = {'machine': machine_info(), 'config': vars(args), 'results': {}, 'skipped': {}}
+
+    with tempfile.TemporaryDirectory() as path:
+        image_dir, annot_dir = synthesize_dataset(path, args.images, args.objects, labels)
+        context = {
+            'labels':    labels,
+            'image_dir': image_dir,
+            'annot_dir': annot_dir,
+            'images':    [cv2.imread(os.path.join(image_dir, filename)) for filename in sorted(os.listdir(image_dir))],
+            'model':     model
+        }
+
+        from voc import parse_voc_annotation
+        context['instances'], _ = parse_voc_annotation(annot_dir, image_dir, None, labels)
+
+        for name, benchmark in BENCHMARKS:
+            if args.only and name not in args.only: continue
+
+            try:
+                for key, timings in benchmark(args, context):
+                    results['results'][key] = summarize(timings)
+                    print_summary(key, timings)
+            except ImportError as e:
+                results['skipped'][name] = str(e)
+                print('%-40s skipped: %s' % (name, e))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4, sort_keys=True)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Run the benchmark suite on synthetic data')
+    argparser.add_argument('-o', '--output', help='path of the JSON results file')
+    argparser.add_argument('-k', '--only', nargs='+', help='only run these benchmarks: ' + ', '.join(name for name, _ in BENCHMARKS))
+    argparser.add_argument('-a', '--architectures', nargs='+', default=['full', 'tiny', 'micro'])
+    argparser.add_argument('-s', '--net-sizes', type=int, nargs='+', default=[320, 416, 608])
+    argparser.add_argument('-n', '--images', type=int, default=32, help='number of synthetic images and annotations')
+    argparser.add_argument('--objects', type=int, default=5, help='average number of objects per image')
+    argparser.add_argument('--classes', type=int, default=4)
+    argparser.add_argument('-b', '--batch-size', type=int, default=8)
+    argparser.add_argument('-r', '--repeat', type=int, default=10)
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+""" Compare tracking-assisted video detection against running the network on every
+frame: effective FPS, and recall of the every-frame detections (same label,
+IoU >= 0.5) by the tracked boxes.
+
+    python -m benchmarks.video_tracking -c config.json -i sample.mp4 -n 2 5 10
+"""
+
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+from keras.models import load_model
+from utils.utils import get_yolo_boxes, compute_overlap
+from utils.tracking import TrackingDetector
+
+def _read_frames(path, max_frames):
+    video_reader = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret_val, frame = video_reader.read()
+        if not ret_val: break
+        frames.append(frame)
+    video_reader.release()
+    return frames
+
+def _recall(reference, tracked, obj_thresh):
+    found, total = 0, 0
+
+    for ref_boxes, boxes in zip(reference, tracked):
+        ref_boxes = [box for box in ref_boxes if box.get_score() > obj_thresh]
+        total += len(ref_boxes)
+        if len(ref_boxes) == 0 or len(boxes) == 0: continue
+
+        ious = compute_overlap(np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in ref_boxes], dtype=np.float64),
+                               np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in boxes], dtype=np.float64))
+        same_label = np.array([b.get_label() for b in ref_boxes])[:, None] == np.array([b.get_label() for b in boxes])[None, :]
+
+        found += int(np.sum(np.max(ious * same_label, axis=1) >= 0.5))
+
+    return float(found) / max(total, 1)
+
+def _main_(args):
+    with open(args.conf) as config_buffer:
+        config = json.load(config_buffer)
+
+    net_h, net_w = args.net_size, args.net_size
+    obj_thresh, nms_thresh = 0.5, 0.45
+    anchors = config['model']['anchors']
+
+    infer_model = load_model(config['train']['saved_weights_name'])
+    frames = _read_frames(args.input, args.max_frames)
+
+    def detect(frame):
+        return get_yolo_boxes(infer_model, [frame], net_h, net_w, anchors, obj_thresh, nms_thresh)[0]
+
+    detect(frames[0]) # warm up
+
+    start = time.perf_counter()
+    reference = [detect(frame) for frame in frames]
+    print('every frame:     %7.2f fps' % (len(frames) / (time.perf_counter() - start)))
+
+    for detect_every in args.detect_every:
+        tracker = TrackingDetector(detect, detect_every=detect_every, obj_thresh=obj_thresh)
+
+        start = time.perf_counter()
+        tracked = [tracker(frame) for frame in frames]
+        fps = len(frames) / (time.perf_counter() - start)
+
+        print('every %3d frames: %7.2f fps, %4d detections, recall %.3f' % (
+            detect_every, fps, tracker.detections, _recall(reference, tracked, obj_thresh)))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark tracking-assisted video detection')
+    argparser.add_argument('-c', '--conf', help='path to configuration file of a trained model')
+    argparser.add_argument('-i', '--input', help='path to a sample video')
+    argparser.add_argument('-n', '--detect-every', type=int, nargs='+', default=[2, 5, 10])
+    argparser.add_argument('-s', '--net-size', type=int, default=416)
+    argparser.add_argument('--max-frames', type=int, default=300)
+
+    args = argparser.parse_args()
+    _main_(args)
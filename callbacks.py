@@ -1,6 +1,16 @@
-from keras.callbacks import TensorBoard, ModelCheckpoint
+from keras.callbacks import TensorBoard, ModelCheckpoint, Callback
 import tensorflow as tf
+from keras import backend as K
 import numpy as np
+import warnings
+import random
+import time
+import csv
+import cv2
+import os
+import yolo
+from utils.checkpoint import CheckpointWriter, snapshot_training_state, load_training_state
+from utils.utils import letterbox_image, decode_yolo_arrays, compute_average_precisions
 
 class CustomTensorBoard(TensorBoard):
     """ to log the loss after each batch
@@ -27,12 +37,36 @@ class CustomTensorBoard(TensorBoard):
 
 class CustomModelCheckpoint(ModelCheckpoint):
     """ to save the template model, not the multi-GPU model
+
+    The weights are copied to memory at the end of the epoch and written by a CheckpointWriter,
+    in the background by default, through a temporary file renamed over filepath: training
+    does not wait for the disk, and a crash never leaves a truncated checkpoint behind.
+
+    # Arguments
+        writer      : The utils.checkpoint.CheckpointWriter, which several checkpoints can share.
+                      A background one is made if None.
+        keep        : Number of most recent files kept when filepath is formatted, e.g. with
+                      the epoch. All are kept if None.
+        full_every  : Write only the changed layers as a weights delta in between full
+                      checkpoints, see CheckpointWriter.save.
     """
-    def __init__(self, model_to_save, **kwargs):
+    def __init__(self, model_to_save, writer=None, keep=None, full_every=1, **kwargs):
         super(CustomModelCheckpoint, self).__init__(**kwargs)
         self.model_to_save = model_to_save
+        self.writer        = writer or CheckpointWriter()
+        self.keep          = keep
+        self.full_every    = full_every
+
+        # time every on_epoch_end held up training for
+        self.stall_times   = []
+
+    def _save(self, filepath):
+        self.writer.save(self.model_to_save, filepath, weights_only=self.save_weights_only,
+                         keep=self.keep, group=self.filepath, full_every=self.full_every)
 
     def on_epoch_end(self, epoch, logs=None):
+        start = time.perf_counter()
+
         logs = logs or {}
         self.epochs_since_last_save += 1
         if self.epochs_since_last_save >= self.period:
@@ -51,10 +85,7 @@ class CustomModelCheckpoint(ModelCheckpoint):
                                   % (epoch + 1, self.monitor, self.best,
                                      current, filepath))
                         self.best = current
-                        if self.save_weights_only:
-                            self.model_to_save.save_weights(filepath, overwrite=True)
-                        else:
-                            self.model_to_save.save(filepath, overwrite=True)
+                        self._save(filepath)
                     else:
                         if self.verbose > 0:
                             print('\nEpoch %05d: %s did not improve from %0.5f' %
@@ -62,9 +93,421 @@ class CustomModelCheckpoint(ModelCheckpoint):
             else:
                 if self.verbose > 0:
                     print('\nEpoch %05d: saving model to %s' % (epoch + 1, filepath))
-                if self.save_weights_only:
-                    self.model_to_save.save_weights(filepath, overwrite=True)
-                else:
-                    self.model_to_save.save(filepath, overwrite=True)
+                self._save(filepath)
+
+        self.stall_times.append(time.perf_counter() - start)
+
+        super(CustomModelCheckpoint, self).on_batch_end(epoch, logs)
+
+    def on_train_end(self, logs=None):
+        # the files are complete once fit_generator returns
+        self.writer.flush()
+
+class TrainingThroughput(Callback):
+    """ to log where the time of every training batch goes
+
+    The time between the end of a batch and the beginning of the next one is spent waiting
+    for fit_generator's queue, i.e. for the generator; the time between the beginning and
+    the end of a batch is the train step. The __getitem__ timings the generator recorded
+    since the previous batch (augmentation, target construction, net size) are averaged in.
+    A wait time that is large compared to the step time means the generator is the bottleneck.
+
+    # Arguments
+        generator   : The BatchGenerator feeding fit_generator.
+        log_dir     : Directory of the TensorBoard event file, or None.
+        csv_path    : Path of the CSV file with one row per batch, or None.
+        log_every   : Write a TensorBoard summary every this many batches.
+    """
+    FIELDS = ['step', 'epoch', 'batch', 'wait_ms', 'step_ms', 'images_per_s',
+              'getitem_ms', 'aug_ms', 'target_ms', 'batches_produced', 'net_h', 'net_w']
+
+    def __init__(self, generator, log_dir=None, csv_path=None, log_every=1):
+        super(TrainingThroughput, self).__init__()
+        self.generator = generator
+        self.log_dir   = log_dir
+        self.csv_path  = csv_path
+        self.log_every = log_every
+        self.step      = 0
+        self.epoch     = 0
+        self.writer    = None
+        self.csv_file  = None
+
+    def on_train_begin(self, logs=None):
+        if self.log_dir is not None:
+            self.writer = tf.summary.FileWriter(self.log_dir)
+        if self.csv_path is not None:
+            append = os.path.exists(self.csv_path)
+            self.csv_file   = open(self.csv_path, 'a' if append else 'w')
+            self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=self.FIELDS)
+            if not append: self.csv_writer.writeheader()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.last_batch_end = time.perf_counter()
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_begin = time.perf_counter()
+
+    def on_batch_end(self, batch, logs=None):
+        logs = logs or {}
+        now  = time.perf_counter()
+
+        wait_time = self.batch_begin - self.last_batch_end
+        step_time = now - self.batch_begin
+        self.last_batch_end = now
+
+        timings = []
+        while len(self.generator.timings) > 0:
+            timings.append(self.generator.timings.popleft())
+
+        row = {
+            'step':             self.step,
+            'epoch':            self.epoch,
+            'batch':            batch,
+            'wait_ms':          1e3 * wait_time,
+            'step_ms':          1e3 * step_time,
+            'images_per_s':     logs.get('size', self.generator.batch_size) / max(wait_time + step_time, 1e-9),
+            'batches_produced': len(timings),
+            'net_h':            self.generator.net_h,
+            'net_w':            self.generator.net_w
+        }
+        for name in ['getitem', 'aug', 'target']:
+            row[name + '_ms'] = 1e3 * np.mean([timing[name + '_time'] for timing in timings]) if timings else 0.
+        if timings:
+            row['net_h'], row['net_w'] = timings[-1]['net_h'], timings[-1]['net_w']
+
+        if self.csv_file is not None:
+            self.csv_writer.writerow(row)
+
+        if self.writer is not None and self.step % self.log_every == 0:
+            summary = tf.Summary()
+            for name in self.FIELDS[3:]:
+                summary_value = summary.value.add()
+                summary_value.simple_value = float(row[name])
+                summary_value.tag = 'throughput/' + name
+            self.writer.add_summary(summary, self.step)
+
+        self.step += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.writer is not None: self.writer.flush()
+        if self.csv_file is not None: self.csv_file.flush()
+
+    def on_train_end(self, logs=None):
+        if self.writer is not None: self.writer.close()
+        if self.csv_file is not None: self.csv_file.close()
+
+class AverageLogs(Callback):
+    """ Averages the epoch logs (loss, val_loss, metrics) over the workers of a data-parallel
+    run, so that early stopping, learning rate reduction and checkpointing decide alike on
+    all of them. It must come before the callbacks reading the logs.
+
+    # Arguments
+        allreduce   : The utils.allreduce.AllReduce of this worker.
+    """
+    def __init__(self, allreduce):
+        super(AverageLogs, self).__init__()
+        self.allreduce = allreduce
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not logs:
+            return
+
+        names = sorted(logs)
+        values = self.allreduce.allreduce([np.float32(logs[name]) for name in names])
+        for name, value in zip(names, values):
+            logs[name] = float(value)
+
+class MeanAveragePrecision(Callback):
+    """ to evaluate the mAP of the inference model every few epochs of training
+
+    A fixed subset of the validation images is read, letterboxed to net_size and kept in
+    memory once, at the beginning of training. An evaluation then only runs the model on
+    batches of them and scores the detections with array operations, see
+    utils.utils.decode_yolo_arrays and compute_average_precisions.
+
+    The mAP is added to the epoch logs as val_mAP for the callbacks after this one:
+    CustomTensorBoard logs it, and CustomModelCheckpoint keeps the best model by it with
+    monitor='val_mAP', mode='max' and the same period. The AP of every class and the time
+    every evaluation took are written to log_dir.
+
+    # Arguments
+        model           : The inference model.
+        instances       : The validation instances, as parsed by parse_voc_annotation.
+        labels          : The class names, in the order of the model outputs.
+        anchors         : The anchors of the model.
+        period          : Evaluate every period epochs.
+        images          : Number of validation images evaluated on, all of them if None.
+        net_size        : Size of the square network input the images are letterboxed to.
+        batch_size      : Number of images per predict_on_batch.
+        iou_threshold   : As for utils.utils.evaluate.
+        obj_thresh      : As for utils.utils.evaluate.
+        nms_thresh      : As for utils.utils.evaluate.
+        log_dir         : Directory of the TensorBoard event file, or None.
+        seed            : Seed of the choice of the subset.
+        verbose         : Print the mAP and the time of every evaluation.
+    """
+    def __init__(self, model, instances, labels, anchors, period=1, images=None, net_size=416, batch_size=8,
+                 iou_threshold=0.5, obj_thresh=0.5, nms_thresh=0.45, log_dir=None, seed=0, verbose=1):
+        super(MeanAveragePrecision, self).__init__()
+        self.model_to_evaluate = model
+        self.labels            = list(labels)
+        self.anchors           = anchors
+        self.period            = period
+        self.net_size          = net_size
+        self.batch_size        = batch_size
+        self.iou_threshold     = iou_threshold
+        self.obj_thresh        = obj_thresh
+        self.nms_thresh        = nms_thresh
+        self.log_dir           = log_dir
+        self.verbose           = verbose
+
+        # the generators shuffle their instances in place, the subset is chosen now
+        if images is not None and images < len(instances):
+            chosen = np.sort(np.random.RandomState(seed).choice(len(instances), images, replace=False))
+            instances = [instances[i] for i in chosen]
+        self.instances = list(instances)
+
+        self.images      = None
+        self.cache_time  = 0.
+        self.eval_times  = []
+        self.epochs_since_last_eval = 0
+        self.writer      = None
+
+    def _cache_images(self):
+        channels = self.model_to_evaluate.input_shape[-1] or 3
+
+        self.images       = np.zeros((len(self.instances), self.net_size, self.net_size, channels), dtype=np.uint8)
+        self.image_shapes = []
+        self.annotations  = []
+
+        for i, instance in enumerate(self.instances):
+            image = cv2.imread(instance['filename'])
+            self.image_shapes.append(image.shape[:2])
+
+            image = letterbox_image(image, self.net_size, self.net_size)
+            if channels == 1:
+                image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)[:,:,np.newaxis]
+            self.images[i] = image
+
+            boxes  = np.array([[obj['xmin'], obj['ymin'], obj['xmax'], obj['ymax']] for obj in instance['object']]).reshape(-1, 4)
+            labels = np.array([self.labels.index(obj['name']) for obj in instance['object']], dtype=int)
+            self.annotations.append([boxes[labels == label] for label in range(len(self.labels))])
+
+    def evaluate(self):
+        """ The AP of every class on the cached images, as utils.utils.evaluate returns it.
+        """
+        start = time.perf_counter()
+        if self.images is None:
+            self._cache_images()
+
+        all_detections = []
+        for l_bound in range(0, len(self.images), self.batch_size):
+            batch_input  = self.images[l_bound:l_bound + self.batch_size].astype(np.float32) / 255.
+            batch_output = self.model_to_evaluate.predict_on_batch(batch_input)
+            if not isinstance(batch_output, list):
+                batch_output = [batch_output]
+
+            for i in range(len(batch_input)):
+                image_h, image_w = self.image_shapes[l_bound + i]
+                detections, labels = decode_yolo_arrays([output[i] for output in batch_output], self.anchors,
+                                                        self.obj_thresh, self.nms_thresh,
+                                                        image_h, image_w, self.net_size, self.net_size)
+                all_detections.append([detections[labels == label] for label in range(len(self.labels))])
+
+        average_precisions = compute_average_precisions(all_detections, self.annotations, self.iou_threshold)
+
+        self.eval_times.append(time.perf_counter() - start)
+        return average_precisions
+
+    def on_train_begin(self, logs=None):
+        if self.images is None:
+            start = time.perf_counter()
+            self._cache_images()
+            self.cache_time = time.perf_counter() - start
+
+            if self.verbose > 0:
+                print('Cached %d validation images for mAP in %.2fs (%.1f MB).' % (
+                    len(self.images), self.cache_time, self.images.nbytes / 2.**20))
+
+        if self.log_dir is not None:
+            self.writer = tf.summary.FileWriter(self.log_dir)
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs if logs is not None else {}
+
+        self.epochs_since_last_eval += 1
+        if self.epochs_since_last_eval < self.period or len(self.instances) == 0:
+            return
+        self.epochs_since_last_eval = 0
+
+        average_precisions = self.evaluate()
+        mean_ap = sum(average_precisions.values()) / len(average_precisions)
+        logs['val_mAP'] = mean_ap
+
+        if self.verbose > 0:
+            print('\nEpoch %05d: val_mAP %.4f on %d images in %.2fs' % (
+                epoch + 1, mean_ap, len(self.images), self.eval_times[-1]))
+
+        if self.writer is not None:
+            summary = tf.Summary()
+            for label, average_precision in average_precisions.items():
+                summary.value.add(tag='mAP/' + self.labels[label], simple_value=float(average_precision))
+            summary.value.add(tag='mAP/eval_seconds', simple_value=self.eval_times[-1])
+            self.writer.add_summary(summary, epoch)
+            self.writer.flush()
+
+    def on_train_end(self, logs=None):
+        if self.writer is not None: self.writer.close()
+
+class TrainingState(Callback):
+    """ to resume training where it stopped, e.g. after preemption
+
+    At the end of every epoch, the state of training is written to filepath by a
+    CheckpointWriter, through a temporary file renamed over it:
+    - the weights of model_to_save and of the optimizer (e.g. the moments and iterations of
+      Adam), and the learning rate;
+    - the next epoch and the number of batches the YoloLayers counted for the warmup;
+    - the best values and patience counters of the other callbacks, e.g. EarlyStopping,
+      ReduceLROnPlateau and CustomModelCheckpoint;
+    - the order and seeds of the generator (see BatchGenerator.get_state) and the state of
+      the numpy and python random number generators.
+
+    With resume, they are loaded back in on_train_begin. The other callbacks reset themselves
+    there, so this one has to come after them. fit_generator has to start at the saved
+    epoch, see utils.checkpoint.read_training_state.
+
+    # Arguments
+        filepath        : The training state file.
+        model_to_save   : The model whose weights are saved, as for CustomModelCheckpoint.
+        callbacks       : The other callbacks, whose state is saved.
+        generator       : The BatchGenerator of the training images, or None.
+        writer          : The utils.checkpoint.CheckpointWriter, a background one is made if None.
+        resume          : Load the state in filepath at the beginning of training.
+        save            : Write the state at the end of every epoch, e.g. only on the first
+                          worker of a data-parallel run.
+        settings        : A JSON-serializable dict saved along, e.g. the settings training
+                          has to resume with.
+    """
+    ATTRIBUTES = ['best', 'wait', 'cooldown_counter', 'stopped_epoch', 'epochs_since_last_save',
+                  'epochs_since_last_eval', 'counter', 'step']
+
+    def __init__(self, filepath, model_to_save, callbacks, generator=None, writer=None, resume=False, save=True, settings=None):
+        super(TrainingState, self).__init__()
+        self.filepath       = filepath
+        self.model_to_save  = model_to_save
+        self.callbacks      = [callback for callback in callbacks if callback is not self]
+        self.generator      = generator
+        self.writer         = writer or CheckpointWriter()
+        self.resume         = resume
+        self.save           = save
+        self.settings       = settings or {}
+
+    def _callback_states(self):
+        return [{
+            'class_name': type(callback).__name__,
+            'attributes': {name: getattr(callback, name) for name in self.ATTRIBUTES if hasattr(callback, name)}
+        } for callback in self.callbacks]
+
+    def _restore(self):
+        state = load_training_state(self.model_to_save, self.model.optimizer, self.filepath)
+
+        K.set_value(self.model.optimizer.lr, state['lr'])
+        yolo.set_batches_seen(self.model, state['batches_seen'])
+
+        # by class, in order, as another worker of a data-parallel run has fewer callbacks
+        saved = list(state['callbacks'])
+        for callback in self.callbacks:
+            for i, callback_state in enumerate(saved):
+                if callback_state['class_name'] == type(callback).__name__:
+                    for name, value in callback_state['attributes'].items():
+                        setattr(callback, name, value)
+                    del saved[i]
+                    break
+
+        if self.generator is not None and state['generator'] is not None:
+            self.generator.set_state(state['generator'])
+
+            # fit_generator shuffles the generator when it runs out, which may not have happened yet when saving
+            while self.generator.epoch < state['generator_epoch']:
+                self.generator.on_epoch_end()
+
+        numpy_random = state['numpy_random']
+        np.random.set_state((numpy_random[0], np.array(numpy_random[1], dtype=np.uint32)) + tuple(numpy_random[2:]))
+        python_random = state['python_random']
+        random.setstate((python_random[0], tuple(python_random[1]), python_random[2]))
+
+        print('Resuming training at epoch %d from %s.' % (state['epoch'] + 1, self.filepath))
+
+    def on_train_begin(self, logs=None):
+        if self.resume and os.path.exists(self.filepath):
+            self._restore()
+
+        self.first_epoch = None
+        if self.generator is not None:
+            self.first_generator_epoch = self.generator.epoch
+            self.generator_passes      = max(1, self.params['steps'] // len(self.generator))
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if self.first_epoch is None:
+            self.first_epoch = epoch
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not self.save:
+            return
+
+        state = {
+            'epoch':         epoch + 1,
+            'settings':      self.settings,
+            'lr':            float(K.get_value(self.model.optimizer.lr)),
+            'batches_seen':  yolo.get_batches_seen(self.model),
+            'callbacks':     self._callback_states(),
+            'generator':     None,
+            'numpy_random':  np.random.get_state(),
+            'python_random': random.getstate()
+        }
+        if self.generator is not None:
+            state['generator']       = self.generator.get_state()
+            state['generator_epoch'] = self.first_generator_epoch + (epoch + 1 - self.first_epoch) * self.generator_passes
+
+        self.writer.save_snapshot(snapshot_training_state(self.model_to_save, self.model.optimizer, state), self.filepath)
+
+    def on_train_end(self, logs=None):
+        self.writer.flush()
+
+class HardExampleMining(Callback):
+    """ to report the training loss of every image to the sampler of the generator
+
+    The losses of every batch are collected by utils.sampling.ImageLosses, armed here before
+    the batch, and the generator records which images the batch had. fit_generator has to
+    train on the batches in the order of the generator (shuffle=False), so that training
+    batch n is batch n % len(generator) of the generator.
+
+    # Arguments
+        generator       : The BatchGenerator, with a sampler such as utils.sampling.HardExampleSampler.
+        image_losses    : The utils.sampling.ImageLosses the train model was compiled with.
+    """
+    def __init__(self, generator, image_losses):
+        super(HardExampleMining, self).__init__()
+        self.generator    = generator
+        self.image_losses = image_losses
+
+    def on_train_begin(self, logs=None):
+        self.step        = 0
+        self.first_epoch = None
+
+    def on_batch_begin(self, batch, logs=None):
+        # read at the first batch, after TrainingState resumed the generator
+        if self.first_epoch is None:
+            self.first_epoch = self.generator.epoch
+        self.image_losses.armed = True
+
+    def on_batch_end(self, batch, logs=None):
+        epoch, idx = divmod(self.step, len(self.generator))
+        epoch += self.first_epoch
+        self.step += 1
 
-        super(CustomModelCheckpoint, self).on_batch_end(epoch, logs)
\ No newline at end of file
+        losses  = self.image_losses.pop()
+        indices = self.generator.batch_indices.pop((epoch, idx), None)
+        if losses is not None and indices is not None and len(losses) == len(indices):
+            self.generator.sampler.update(indices, losses, epoch)
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tensorflow as tf
+from utils.utils import preprocess_input, decode_yolo_output
+
+class Detector:
+    """ asyncio front-end for a trained inference model.
+
+    Preprocessing and decoding run in a thread pool, while a single batching task
+    feeds the model: requests arriving within max_latency seconds of each other are
+    stacked into one predict_on_batch call, which runs on its own thread so the event
+    loop stays responsive.
+
+        detector = Detector.from_config(config)
+        async with detector:
+            boxes = await detector.detect(image, timeout=1.)
+
+    # Arguments
+        model           : The inference model.
+        anchors         : The anchors, as in config['model']['anchors'].
+        labels          : The labels, as in config['model']['labels'].
+        net_h, net_w    : The network input size, multiples of 32.
+        obj_thresh      : The threshold used to distinguish between object and non-object.
+        nms_thresh      : The threshold used to determine whether two detections are duplicates.
+        max_batch_size  : The largest batch sent through the model.
+        max_latency     : Seconds the first request of a batch waits for others.
+        workers         : Number of threads for preprocessing and decoding.
+    """
+    def __init__(self, model, anchors, labels, net_h=416, net_w=416, obj_thresh=0.5, nms_thresh=0.45,
+                 max_batch_size=8, max_latency=0.005, workers=4):
+        self.model          = model
+        self.anchors        = anchors
+        self.labels         = labels
+        self.net_h          = net_h
+        self.net_w          = net_w
+        self.obj_thresh     = obj_thresh
+        self.nms_thresh     = nms_thresh
+        self.max_batch_size = max_batch_size
+        self.max_latency    = max_latency
+
+        self.graph          = tf.get_default_graph()
+        self.executor       = ThreadPoolExecutor(max_workers=workers)
+        self.model_executor = ThreadPoolExecutor(max_workers=1)
+
+        self._queue         = None
+        self._worker        = None
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        from keras.models import load_model
+
+        model = load_model(config['train']['saved_weights_name'])
+        return cls(model, config['model']['anchors'], config['model']['labels'], **kwargs)
+
+    async def start(self):
+        if self._worker is None:
+            self._queue  = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._run())
+        return self
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        self.executor.shutdown(wait=False)
+        self.model_executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _predict(self, batch_input):
+        with self.graph.as_default():
+            return self.model.predict_on_batch(batch_input)
+
+    async def _collect(self):
+        batch    = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_latency
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0: break
+
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # callers that were cancelled or timed out while waiting are dropped here
+        return [(batch_input, future) for batch_input, future in batch if not future.done()]
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            batch = await self._collect()
+            if len(batch) == 0: continue
+
+            try:
+                batch_input  = np.concatenate([batch_input for batch_input, _ in batch])
+                batch_output = await loop.run_in_executor(self.model_executor, self._predict, batch_input)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done(): future.set_exception(e)
+                continue
+
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result([output[i] for output in batch_output])
+
+    async def _detect(self, image):
+        if self._worker is None:
+            await self.start()
+
+        loop = asyncio.get_event_loop()
+
+        batch_input = await loop.run_in_executor(self.executor, preprocess_input, image, self.net_h, self.net_w)
+
+        future = loop.create_future()
+        await self._queue.put((batch_input, future))
+        yolos = await future
+
+        image_h, image_w, _ = image.shape
+        return await loop.run_in_executor(self.executor, decode_yolo_output, yolos, self.anchors, self.obj_thresh, self.nms_thresh,
+                                          image_h, image_w, self.net_h, self.net_w)
+
+    async def detect(self, image, timeout=None):
+        """ Detect objects in one image, as loaded by cv2.imread. Returns a list of BoundBox.
+        Raises asyncio.TimeoutError if the result is not ready within timeout seconds.
+        """
+        return await asyncio.wait_for(self._detect(image), timeout)
+
+    async def detect_many(self, images, timeout=None):
+        """ Detect objects in several images concurrently, so they share batches.
+        """
+        return await asyncio.gather(*[self.detect(image, timeout) for image in images])
@@ -8,6 +8,7 @@ from voc import parse_voc_annotation
 from yolo import create_yolov3_model
 from generator import BatchGenerator
 from utils.utils import normalize, evaluate
+from utils.profiling import profiler
 from keras.callbacks import EarlyStopping, ModelCheckpoint
 from keras.optimizers import Adam
 from keras.models import load_model
@@ -41,7 +42,6 @@ def _main_(args):
         min_net_size        = config['model']['min_input_size'],
         max_net_size        = config['model']['max_input_size'],   
         shuffle             = True, 
-        jitter              = 0.0, 
         norm                = normalize
     )
 
@@ -52,17 +52,26 @@ def _main_(args):
 
     infer_model = load_model(config['train']['saved_weights_name'])
 
+    if args.profile: profiler.enable()
+
     # compute mAP for all the classes
-    average_precisions = evaluate(infer_model, valid_generator)
+    average_precisions = evaluate(infer_model, valid_generator, rect=args.rect)
 
     # print the score
     for label, average_precision in average_precisions.items():
         print(labels[label] + ': {:.4f}'.format(average_precision))
     print('mAP: {:.4f}'.format(sum(average_precisions.values()) / len(average_precisions)))           
 
+    if args.profile:
+        print(profiler.report())
+        if args.profile_output: profiler.save(args.profile_output)
+
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description='Evaluate YOLO_v3 model on any dataset')
     argparser.add_argument('-c', '--conf', help='path to configuration file')    
+    argparser.add_argument('--rect', action='store_true', help='letterbox into the smallest rectangle covering the image aspect ratio instead of a square')
+    argparser.add_argument('--profile', action='store_true', help='time every stage of the inference path and print the breakdown')
+    argparser.add_argument('--profile-output', help='also write the breakdown to this file, in Prometheus text format if it ends with .prom, JSON otherwise')
     
     args = argparser.parse_args()
     _main_(args)
@@ -75,7 +75,7 @@ def run_kmeans(ann_dims, anchor_num):
             return centroids
 
         #calculate new centroids
-        centroid_sums=np.zeros((anchor_num, anchor_dim), np.float)
+        centroid_sums=np.zeros((anchor_num, anchor_dim), np.float64)
         for i in range(ann_num):
             centroid_sums[assignments[i]]+=ann_dims[i]
         for j in range(anchor_num):
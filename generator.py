@@ -1,10 +1,61 @@
+import os
 import cv2
 import copy
+import time
+import hashlib
+import threading
 import numpy as np
+from collections import deque
 from keras.utils import Sequence
 from utils.bbox import BoundBox, bbox_iou
 from utils.image import apply_random_scale_and_crop, random_distort_image, random_flip, correct_bounding_boxes
 
+class NetSizeScheduler:
+    """ Plans the multi-scale training input sizes of every batch of an epoch up front.
+
+    The plan only depends on the seed and the epoch, so a batch gets the same size no
+    matter in which order, or by which worker, it is requested.
+
+    # Arguments
+        min_net_size        : The smallest input size, a multiple of downsample.
+        max_net_size        : The largest input size, a multiple of downsample.
+        downsample          : Step between sizes.
+        batches_per_size    : Number of consecutive batches drawn at the same size.
+        seed                : Seed of the plan, a random one is picked if None.
+        contiguous          : Group the batches of every size together, so each size is
+                              switched to once per epoch instead of every batches_per_size batches.
+                              Consecutive epochs go through the sizes in alternating order, so
+                              the last size of an epoch is also the first of the next one.
+    """
+    def __init__(self, min_net_size, max_net_size, downsample=32, batches_per_size=10, seed=None, contiguous=False):
+        self.min_net_size       = min_net_size
+        self.max_net_size       = max_net_size
+        self.downsample         = downsample
+        self.batches_per_size   = batches_per_size
+        self.seed               = np.random.randint(2**31) if seed is None else seed
+        self.contiguous         = contiguous
+
+    def plan(self, epoch, num_batches):
+        """ The input size of every batch of an epoch, as an array of num_batches sizes.
+        """
+        rng = np.random.RandomState((self.seed + epoch) % 2**32)
+        num_chunks = int(np.ceil(float(num_batches) / self.batches_per_size))
+
+        sizes = self.downsample*rng.randint(self.min_net_size//self.downsample,
+                                            self.max_net_size//self.downsample+1, num_chunks)
+
+        if self.contiguous:
+            sizes = np.sort(sizes)
+            if epoch % 2 == 1: sizes = sizes[::-1]
+
+        return np.repeat(sizes, self.batches_per_size)[:num_batches]
+
+    def switches(self, epoch, num_batches):
+        """ The number of times the input size changes within an epoch.
+        """
+        plan = self.plan(epoch, num_batches)
+        return int(np.sum(plan[1:] != plan[:-1]))
+
 class BatchGenerator(Sequence):
     def __init__(self, 
         instances, 
@@ -26,13 +77,18 @@ class BatchGenerator(Sequence):
         aug_exposure=1.5,
         aug_gray=False,
         aug_flip=True,
-        aug_pad=True
+        aug_pad=True,
+        net_size_scheduler=None,
+        buffer_pool=0,
+        sampler=None,
+        per_batch_boxes=False
     ):
         self.instances          = instances
         self.batch_size         = batch_size
         self.labels             = labels
         self.downsample         = downsample
         self.max_box_per_image  = max_box_per_image
+        self.per_batch_boxes    = per_batch_boxes
         self.min_net_size       = (min_net_size//self.downsample)*self.downsample
         self.max_net_size       = (max_net_size//self.downsample)*self.downsample
         self.shuffle            = shuffle
@@ -52,116 +108,64 @@ class BatchGenerator(Sequence):
         self.aug_flip            = aug_flip
         self.aug_pad             = aug_pad
 
-        if shuffle: np.random.shuffle(self.instances)
+        # per-batch timings of __getitem__, drained by callbacks.TrainingThroughput
+        self.timings             = deque(maxlen=1000)
+
+        self.net_size_scheduler  = net_size_scheduler or NetSizeScheduler(self.min_net_size, self.max_net_size, self.downsample)
+        self.epoch               = 0
+        self._net_size_plan      = None
+
+        # batch arrays are recycled round-robin per shape, so buffer_pool has to exceed the number
+        # of batches alive at once (fit_generator workers + max_queue_size + the batch being trained on)
+        self.buffer_pool         = buffer_pool
+        self._buffers            = {}
+        self._buffer_slots       = {}
+        self._buffer_lock        = threading.Lock()
+
+        # the order of every epoch only depends on the seed, see get_state
+        self.shuffle_seed        = np.random.randint(2**31)
+        self._state_lock         = threading.Lock()
+
+        # a sampler, e.g. utils.sampling.HardExampleSampler, decides which images every epoch goes
+        # through, as indices into instances, whose order it keeps
+        self.sampler             = sampler
+        self._order              = None
+        self.batch_indices       = {}
+        if sampler is not None: sampler.bind(self.instances)
+
+        if shuffle or sampler is not None: self._shuffle()
 
     def __len__(self):
         return int(np.ceil(float(len(self.instances))/self.batch_size))
 
     def __getitem__(self, idx):
-        # get image input size, change every 10 batches
-        net_h, net_w = self._get_net_size(idx)
-        base_grid_h, base_grid_w = net_h//self.downsample, net_w//self.downsample
+        start = time.perf_counter()
+        aug_time, target_time = 0., 0.
 
-        # determine the first and the last indices of the batch
-        l_bound = idx*self.batch_size
-        r_bound = (idx+1)*self.batch_size
+        # get image input size, planned per epoch by the net size scheduler
+        net_h, net_w = self._get_net_size(idx)
 
-        if r_bound > len(self.instances):
-            r_bound = len(self.instances)
-            l_bound = r_bound - self.batch_size
+        instances = self._batch_instances(idx)
 
         num_channels = 3
         if self.aug_gray and self.norm is not None:
             num_channels = 1
 
-        x_batch = np.zeros((r_bound - l_bound, net_h, net_w, num_channels))             # input images
-        t_batch = np.zeros((r_bound - l_bound, 1, 1, 1,  self.max_box_per_image, 4))    # list of groundtruth boxes
+        x_batch, t_batch, yolos, dummy_yolos = self._get_buffers(len(instances), net_h, net_w, num_channels, self._box_count(instances))
 
-        # initialize the inputs and the outputs
-        if self.num_scales == 3:
-            yolo_1 = np.zeros((r_bound - l_bound, 1*base_grid_h,  1*base_grid_w, len(self.anchors)//3, 4+1+len(self.labels))) # desired network output 1
-            yolo_2 = np.zeros((r_bound - l_bound, 2*base_grid_h,  2*base_grid_w, len(self.anchors)//3, 4+1+len(self.labels))) # desired network output 2
-            yolo_3 = np.zeros((r_bound - l_bound, 4*base_grid_h,  4*base_grid_w, len(self.anchors)//3, 4+1+len(self.labels))) # desired network output 3
-            yolos = [yolo_3, yolo_2, yolo_1]
-
-            dummy_yolo_1 = np.zeros((r_bound - l_bound, 1))
-            dummy_yolo_2 = np.zeros((r_bound - l_bound, 1))
-            dummy_yolo_3 = np.zeros((r_bound - l_bound, 1))
-            dummy_yolos = [dummy_yolo_1, dummy_yolo_2, dummy_yolo_3]
-        elif self.num_scales == 2:
-            yolo_1 = np.zeros((r_bound - l_bound, 1*base_grid_h,  1*base_grid_w, len(self.anchors)//2, 4+1+len(self.labels))) # desired network output 1
-            yolo_2 = np.zeros((r_bound - l_bound, 2*base_grid_h,  2*base_grid_w, len(self.anchors)//2, 4+1+len(self.labels))) # desired network output 2
-            yolos = [yolo_2, yolo_1]
-
-            dummy_yolo_1 = np.zeros((r_bound - l_bound, 1))
-            dummy_yolo_2 = np.zeros((r_bound - l_bound, 1))
-            dummy_yolos = [dummy_yolo_1, dummy_yolo_2]
-        else:
-            raise RuntimeError("generator does not support yolo with num_scales=%s" % self.num_scales)
-        
         instance_count = 0
-        true_box_index = 0
 
         # do the logic to fill in the inputs and the output
-        for train_instance in self.instances[l_bound:r_bound]:
+        for train_instance in instances:
             # augment input image and fix object's position and size
+            aug_start = time.perf_counter()
             img, all_objs = self._aug_image(train_instance, net_h, net_w)
-            
-            for obj in all_objs:
-                # find the best anchor box for this object
-                max_anchor = None                
-                max_index  = -1
-                max_iou    = -1
-
-                shifted_box = BoundBox(0, 
-                                       0,
-                                       obj['xmax']-obj['xmin'],
-                                       obj['ymax']-obj['ymin'])
-                
-                for i in range(len(self.anchors)):
-                    anchor = self.anchors[i]
-                    iou    = bbox_iou(shifted_box, anchor)
-
-                    if max_iou < iou:
-                        max_anchor = anchor
-                        max_index  = i
-                        max_iou    = iou                
-                
-                # determine the yolo to be responsible for this bounding box
-                yolo = yolos[max_index//3]
-                grid_h, grid_w = yolo.shape[1:3]
-                
-                # determine the position of the bounding box on the grid
-                center_x = .5*(obj['xmin'] + obj['xmax'])
-                center_x = center_x / float(net_w) * grid_w # sigma(t_x) + c_x
-                center_y = .5*(obj['ymin'] + obj['ymax'])
-                center_y = center_y / float(net_h) * grid_h # sigma(t_y) + c_y
-                
-                # determine the sizes of the bounding box
-                w = np.log((obj['xmax'] - obj['xmin']) / float(max_anchor.xmax)) # t_w
-                h = np.log((obj['ymax'] - obj['ymin']) / float(max_anchor.ymax)) # t_h
-
-                box = [center_x, center_y, w, h]
+            target_start = time.perf_counter()
+            aug_time += target_start - aug_start
 
-                # determine the index of the label
-                obj_indx = self.labels.index(obj['name'])
+            self._fill_targets(all_objs, instance_count, yolos, t_batch, net_h, net_w)
 
-                # determine the location of the cell responsible for this object
-                grid_x = int(np.floor(center_x))
-                grid_y = int(np.floor(center_y))
-
-                # assign ground truth x, y, w, h, confidence and class probs to y_batch
-                yolo[instance_count, grid_y, grid_x, max_index%3]      = 0
-                yolo[instance_count, grid_y, grid_x, max_index%3, 0:4] = box
-                yolo[instance_count, grid_y, grid_x, max_index%3, 4  ] = 1.
-                yolo[instance_count, grid_y, grid_x, max_index%3, 5+obj_indx] = 1
-
-                # assign the true box to t_batch
-                true_box = [center_x, center_y, obj['xmax'] - obj['xmin'], obj['ymax'] - obj['ymin']]
-                t_batch[instance_count, 0, 0, 0, true_box_index] = true_box
-
-                true_box_index += 1
-                true_box_index  = true_box_index % self.max_box_per_image    
+            target_time += time.perf_counter() - target_start
 
             # assign input image to x_batch
             if self.norm != None: 
@@ -183,20 +187,172 @@ class BatchGenerator(Sequence):
 
             # increase instance counter in the current batch
             instance_count += 1                 
-                
+
+        self.timings.append({
+            'getitem_time': time.perf_counter() - start,
+            'aug_time':     aug_time,
+            'target_time':  target_time,
+            'images':       instance_count,
+            'net_h':        net_h,
+            'net_w':        net_w
+        })
+
         return [x_batch, t_batch] + list(reversed(yolos)), dummy_yolos
 
+    def _batch_bounds(self, idx):
+        # determine the first and the last indices of the batch
+        l_bound = idx*self.batch_size
+        r_bound = (idx+1)*self.batch_size
+
+        if r_bound > len(self.instances):
+            r_bound = len(self.instances)
+            l_bound = r_bound - self.batch_size
+
+        return l_bound, r_bound
+
+    def _batch_instances(self, idx):
+        l_bound, r_bound = self._batch_bounds(idx)
+        if self._order is None:
+            return self.instances[l_bound:r_bound]
+
+        # which images a batch had, for reporting their losses to the sampler, see callbacks.HardExampleMining
+        indices = self._order[l_bound:r_bound]
+        self.batch_indices[(self.epoch, idx)] = indices
+
+        return [self.instances[i] for i in indices]
+
+    def _box_count(self, instances):
+        # the rows of true boxes of a batch: the fullest image of the batch with per_batch_boxes, which
+        # needs a train model created with max_box_per_image=None, and max_box_per_image otherwise
+        if not self.per_batch_boxes:
+            return self.max_box_per_image
+        return max(1, min(self.max_box_per_image, max(len(instance['object']) for instance in instances)))
+
+    def _fill_targets(self, all_objs, instance_count, yolos, t_batch, net_h, net_w):
+        # the true boxes of every image fill its rows from the first one, which YoloLayer relies on
+        true_box_index = 0
+
+        for obj in all_objs:
+            # find the best anchor box for this object
+            max_anchor = None                
+            max_index  = -1
+            max_iou    = -1
+
+            shifted_box = BoundBox(0, 
+                                   0,
+                                   obj['xmax']-obj['xmin'],
+                                   obj['ymax']-obj['ymin'])
+            
+            for i in range(len(self.anchors)):
+                anchor = self.anchors[i]
+                iou    = bbox_iou(shifted_box, anchor)
+
+                if max_iou < iou:
+                    max_anchor = anchor
+                    max_index  = i
+                    max_iou    = iou                
+            
+            # determine the yolo to be responsible for this bounding box
+            yolo = yolos[max_index//3]
+            grid_h, grid_w = yolo.shape[1:3]
+            
+            # determine the position of the bounding box on the grid
+            center_x = .5*(obj['xmin'] + obj['xmax'])
+            center_x = center_x / float(net_w) * grid_w # sigma(t_x) + c_x
+            center_y = .5*(obj['ymin'] + obj['ymax'])
+            center_y = center_y / float(net_h) * grid_h # sigma(t_y) + c_y
+            
+            # determine the sizes of the bounding box
+            w = np.log((obj['xmax'] - obj['xmin']) / float(max_anchor.xmax)) # t_w
+            h = np.log((obj['ymax'] - obj['ymin']) / float(max_anchor.ymax)) # t_h
+
+            box = [center_x, center_y, w, h]
+
+            # determine the index of the label
+            obj_indx = self.labels.index(obj['name'])
+
+            # determine the location of the cell responsible for this object
+            grid_x = int(np.floor(center_x))
+            grid_y = int(np.floor(center_y))
+
+            # assign ground truth x, y, w, h, confidence and class probs to y_batch
+            yolo[instance_count, grid_y, grid_x, max_index%3]      = 0
+            yolo[instance_count, grid_y, grid_x, max_index%3, 0:4] = box
+            yolo[instance_count, grid_y, grid_x, max_index%3, 4  ] = 1.
+            yolo[instance_count, grid_y, grid_x, max_index%3, 5+obj_indx] = 1
+
+            # assign the true box to t_batch
+            true_box = [center_x, center_y, obj['xmax'] - obj['xmin'], obj['ymax'] - obj['ymin']]
+            t_batch[instance_count, 0, 0, 0, true_box_index] = true_box
+
+            true_box_index += 1
+            true_box_index  = true_box_index % t_batch.shape[4]
+
     def _get_net_size(self, idx):
         if self.explicit_net_size is not None:
             return self.explicit_net_size[1], self.explicit_net_size[0]
 
-        if idx%10 == 0:
-            net_size = self.downsample*np.random.randint(self.min_net_size/self.downsample, \
-                                                         self.max_net_size/self.downsample+1)
-            print("resizing: ", net_size, net_size)
-            self.net_h, self.net_w = net_size, net_size
-        return self.net_h, self.net_w
-    
+        if self._net_size_plan is None or len(self._net_size_plan) != len(self):
+            self._net_size_plan = self.net_size_scheduler.plan(self.epoch, len(self))
+
+        net_size = int(self._net_size_plan[idx % len(self._net_size_plan)])
+        self.net_h, self.net_w = net_size, net_size
+        return net_size, net_size
+
+    def _allocate_batch(self, batch_size, net_h, net_w, num_channels, max_boxes=None):
+        base_grid_h, base_grid_w = net_h//self.downsample, net_w//self.downsample
+        max_boxes = max_boxes or self.max_box_per_image
+
+        x_batch = np.zeros((batch_size, net_h, net_w, num_channels))             # input images
+        t_batch = np.zeros((batch_size, 1, 1, 1,  max_boxes, 4))                 # list of groundtruth boxes
+
+        # initialize the inputs and the outputs
+        if self.num_scales == 3:
+            yolo_1 = np.zeros((batch_size, 1*base_grid_h,  1*base_grid_w, len(self.anchors)//3, 4+1+len(self.labels))) # desired network output 1
+            yolo_2 = np.zeros((batch_size, 2*base_grid_h,  2*base_grid_w, len(self.anchors)//3, 4+1+len(self.labels))) # desired network output 2
+            yolo_3 = np.zeros((batch_size, 4*base_grid_h,  4*base_grid_w, len(self.anchors)//3, 4+1+len(self.labels))) # desired network output 3
+            yolos = [yolo_3, yolo_2, yolo_1]
+
+            dummy_yolo_1 = np.zeros((batch_size, 1))
+            dummy_yolo_2 = np.zeros((batch_size, 1))
+            dummy_yolo_3 = np.zeros((batch_size, 1))
+            dummy_yolos = [dummy_yolo_1, dummy_yolo_2, dummy_yolo_3]
+        elif self.num_scales == 2:
+            yolo_1 = np.zeros((batch_size, 1*base_grid_h,  1*base_grid_w, len(self.anchors)//2, 4+1+len(self.labels))) # desired network output 1
+            yolo_2 = np.zeros((batch_size, 2*base_grid_h,  2*base_grid_w, len(self.anchors)//2, 4+1+len(self.labels))) # desired network output 2
+            yolos = [yolo_2, yolo_1]
+
+            dummy_yolo_1 = np.zeros((batch_size, 1))
+            dummy_yolo_2 = np.zeros((batch_size, 1))
+            dummy_yolos = [dummy_yolo_1, dummy_yolo_2]
+        else:
+            raise RuntimeError("generator does not support yolo with num_scales=%s" % self.num_scales)
+
+        return x_batch, t_batch, yolos, dummy_yolos
+
+    def _get_buffers(self, batch_size, net_h, net_w, num_channels, max_boxes=None):
+        if self.buffer_pool <= 0:
+            return self._allocate_batch(batch_size, net_h, net_w, num_channels, max_boxes)
+
+        key = (batch_size, net_h, net_w, num_channels, max_boxes)
+        with self._buffer_lock:
+            if key not in self._buffers:
+                self._buffers[key] = [None] * self.buffer_pool
+                self._buffer_slots[key] = 0
+            slot = self._buffer_slots[key]
+            self._buffer_slots[key] = (slot + 1) % self.buffer_pool
+
+            if self._buffers[key][slot] is None:
+                self._buffers[key][slot] = self._allocate_batch(batch_size, net_h, net_w, num_channels, max_boxes)
+                return self._buffers[key][slot]
+
+        # every row of x_batch is overwritten, the targets have to be cleared
+        x_batch, t_batch, yolos, dummy_yolos = self._buffers[key][slot]
+        t_batch.fill(0)
+        for yolo in yolos: yolo.fill(0)
+
+        return x_batch, t_batch, yolos, dummy_yolos
+
     def _aug_image(self, instance, net_h, net_w):
         # Read image in BGR format
         filename = instance['filename']
@@ -251,9 +407,69 @@ class BatchGenerator(Sequence):
         
         return im_sized, all_objs   
 
+    def _shuffle(self):
+        if self.sampler is not None:
+            self._order = self.sampler.order(self.epoch)
+        else:
+            np.random.RandomState((self.shuffle_seed + self.epoch) % 2**32).shuffle(self.instances)
+
     def on_epoch_end(self):
-        if self.shuffle: np.random.shuffle(self.instances)
+        with self._state_lock:
+            self.epoch += 1
+            self._net_size_plan = None
+            if self.shuffle or self.sampler is not None: self._shuffle()
+
+            # the batches of older epochs are not going to be reported anymore
+            for key in [key for key in list(self.batch_indices) if key[0] < self.epoch - 1]:
+                self.batch_indices.pop(key, None)
+
+    def get_state(self):
+        """ The epoch, the order of the images and the seeds of the shuffling and of the input
+        sizes, from which set_state makes the following epochs go through the same images at
+        the same sizes. The random augmentation is not part of it.
+        """
+        with self._state_lock:
+            state = {
+                'epoch':         self.epoch,
+                'order':         [instance['filename'] for instance in self.instances],
+                'shuffle_seed':  int(self.shuffle_seed),
+                'net_size_seed': int(self.net_size_scheduler.seed)
+            }
+            if self.sampler is not None:
+                state['sampled'] = [int(i) for i in self._order]
+                state['sampler'] = self.sampler.get_state()
+
+            return state
+
+    def set_state(self, state):
+        """ Continue from a get_state of a generator of the same images. The order is only
+        restored if the images are the same, e.g. not for another shard of a data-parallel run.
+        """
+        with self._state_lock:
+            by_filename = {}
+            for instance in self.instances:
+                by_filename.setdefault(instance['filename'], []).append(instance)
+
+            if sorted(state['order']) == sorted(instance['filename'] for instance in self.instances):
+                self.instances[:] = [by_filename[filename].pop() for filename in state['order']]
+
+                if self.sampler is not None and 'sampler' in state:
+                    self.sampler.bind(self.instances)
+                    self.sampler.set_state(state['sampler'])
+                    self._order = np.array(state['sampled'], dtype=np.int64)
+
+            self.epoch                   = state['epoch']
+            self.shuffle_seed            = state['shuffle_seed']
+            self.net_size_scheduler.seed = state['net_size_seed']
+            self._net_size_plan          = None
             
+    def is_deterministic(self):
+        """ Whether every image always comes out the same: a fixed input size and no random augmentation.
+        """
+        fixed_size = self.explicit_net_size is not None or self.min_net_size == self.max_net_size
+        return (fixed_size and self.aug_jitter == 0 and tuple(self.aug_scale) == (1, 1) and self.aug_hue == 0
+                and self.aug_saturation == 1 and self.aug_exposure == 1 and not self.aug_flip and not self.aug_pad)
+
     def num_classes(self):
         return len(self.labels)
 
@@ -280,4 +496,100 @@ class BatchGenerator(Sequence):
         return np.array(annots)
 
     def load_image(self, i):
-        return cv2.imread(self.instances[i]['filename'])     
\ No newline at end of file
+        return cv2.imread(self.instances[i]['filename'])     
+class CachedFeatureGenerator(Sequence):
+    """ Serves the batches of a deterministic BatchGenerator (see is_deterministic) as the
+    backbone features of its images, for training the model returned by yolo.split_backbone.
+
+    The features of every image are computed once with backbone_model and stored in
+    cache_dir, as float16 along with the boxes of the image, so later epochs and runs
+    neither decode images nor run the backbone. The cache is kept per backbone weights and
+    input size: changing either starts a new one.
+
+    # Arguments
+        generator       : The BatchGenerator, which keeps deciding the order of the images.
+        backbone_model  : The backbone model returned by yolo.split_backbone.
+        cache_dir       : Directory of the cached features.
+        batch_size      : Number of images per backbone prediction while filling the cache.
+    """
+    def __init__(self, generator, backbone_model, cache_dir, batch_size=8):
+        if not generator.is_deterministic():
+            raise ValueError('backbone features can only be cached without random augmentation and with a fixed input size')
+
+        self.generator      = generator
+        self.net_h, self.net_w = generator._get_net_size(0)
+        self.num_features   = len(backbone_model.outputs)
+        self.cache_dir      = os.path.join(cache_dir, self._fingerprint(backbone_model))
+
+        # per-batch timings of __getitem__, drained by callbacks.TrainingThroughput
+        self.timings        = deque(maxlen=1000)
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._fill_cache(backbone_model, batch_size)
+
+    def _fingerprint(self, backbone_model):
+        digest = hashlib.sha1(('%dx%d' % (self.net_h, self.net_w)).encode())
+        for weights in backbone_model.get_weights():
+            digest.update(weights.tobytes())
+        return digest.hexdigest()[:16]
+
+    def _cache_path(self, instance):
+        return os.path.join(self.cache_dir, hashlib.sha1(instance['filename'].encode()).hexdigest() + '.npz')
+
+    def _fill_cache(self, backbone_model, batch_size):
+        missing = [instance for instance in self.generator.instances if not os.path.exists(self._cache_path(instance))]
+
+        for start in range(0, len(missing), batch_size):
+            instances = missing[start:start + batch_size]
+            images, objects = zip(*[self.generator._aug_image(instance, self.net_h, self.net_w) for instance in instances])
+
+            features = backbone_model.predict_on_batch(np.array([self.generator.norm(image) for image in images]))
+            if self.num_features == 1: features = [features]
+
+            for i, instance in enumerate(instances):
+                arrays = {'features_%d' % k: feature[i].astype(np.float16) for k, feature in enumerate(features)}
+                arrays['boxes'] = np.array([[obj['xmin'], obj['ymin'], obj['xmax'], obj['ymax']] for obj in objects[i]], dtype=np.int32).reshape(-1, 4)
+                arrays['names'] = np.array([obj['name'] for obj in objects[i]], dtype=str)
+
+                # write-then-rename so an interrupted run never leaves a truncated file behind
+                path = self._cache_path(instance)
+                with open(path + '.tmp', 'wb') as handle:
+                    np.savez(handle, **arrays)
+                os.replace(path + '.tmp', path)
+
+    def __len__(self):
+        return len(self.generator)
+
+    def __getitem__(self, idx):
+        start = time.perf_counter()
+        instances = self.generator._batch_instances(idx)
+
+        # the YoloLayers only read the input size from the image, which has no channels here
+        x_batch, t_batch, yolos, dummy_yolos = self.generator._allocate_batch(len(instances), self.net_h, self.net_w, 0,
+                                                                              self.generator._box_count(instances))
+        features = [[] for _ in range(self.num_features)]
+
+        for instance_count, instance in enumerate(instances):
+            with np.load(self._cache_path(instance)) as cached:
+                all_objs = [{'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax, 'name': name}
+                            for (xmin, ymin, xmax, ymax), name in zip(cached['boxes'].tolist(), cached['names'].tolist())]
+                for k in range(self.num_features):
+                    features[k].append(cached['features_%d' % k])
+
+            self.generator._fill_targets(all_objs, instance_count, yolos, t_batch, self.net_h, self.net_w)
+
+        self.timings.append({
+            'getitem_time': time.perf_counter() - start,
+            'aug_time':     0.,
+            'target_time':  0.,
+            'images':       len(instances),
+            'net_h':        self.net_h,
+            'net_w':        self.net_w
+        })
+
+        features = [np.array(feature, dtype=np.float32) for feature in features]
+        return [x_batch] + features + [t_batch] + list(reversed(yolos)), dummy_yolos
+
+    def on_epoch_end(self):
+        self.generator.on_epoch_end()
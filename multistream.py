@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+
+import os
+import argparse
+import json
+import cv2
+from keras.models import load_model
+from utils.utils import makedirs
+from utils.bbox import draw_boxes
+from utils.inference import InferenceSession
+from utils.multistream import MultiStreamRunner
+from utils.streaming import boxes_to_records
+
+class StreamOutputs:
+    """ Routes the detections of each stream to its own annotated video and JSON-lines file.
+
+    frame_rate is a function of the stream id returning the frame rate of its source, which
+    the video of the stream is written at; 25 fps if it is None or returns 0.
+    """
+    def __init__(self, output_path, labels, obj_thresh, write_video=True, show=False, frame_rate=None):
+        self.output_path = output_path
+        self.labels      = labels
+        self.obj_thresh  = obj_thresh
+        self.write_video = write_video
+        self.show        = show
+        self.frame_rate  = frame_rate
+        self.writers     = {}
+        self.detections  = {}
+
+    def __call__(self, stream_id, frame_index, frame, boxes):
+        if stream_id not in self.detections:
+            self.detections[stream_id] = open(os.path.join(self.output_path, 'stream_%d.jsonl' % stream_id), 'w')
+
+        self.detections[stream_id].write(json.dumps({
+            'frame': frame_index,
+            'boxes': boxes_to_records(boxes, self.labels, self.obj_thresh)
+        }) + '\n')
+
+        if not (self.write_video or self.show): return
+
+        draw_boxes(frame, boxes, self.labels, self.obj_thresh)
+
+        if self.write_video:
+            if stream_id not in self.writers:
+                self.writers[stream_id] = cv2.VideoWriter(os.path.join(self.output_path, 'stream_%d.avi' % stream_id),
+                                                          cv2.VideoWriter_fourcc(*'MPEG'),
+                                                          (self.frame_rate and self.frame_rate(stream_id)) or 25.0,
+                                                          (frame.shape[1], frame.shape[0]))
+            self.writers[stream_id].write(frame)
+
+        if self.show:
+            cv2.imshow('stream %d' % stream_id, frame)
+            cv2.waitKey(1)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.release()
+        for detections in self.detections.values():
+            detections.close()
+        if self.show: cv2.destroyAllWindows()
+
+def _main_(args):
+    config_path = args.conf
+
+    with open(config_path) as config_buffer:
+        config = json.load(config_buffer)
+
+    streams_config = config['streams']
+    output_path    = streams_config.get('output_folder', 'output/streams/')
+    makedirs(output_path)
+
+    ###############################
+    #   Set some parameter
+    ###############################
+    net_h, net_w = 416, 416 # a multiple of 32, the smaller the faster
+    obj_thresh, nms_thresh = 0.5, 0.45
+    max_batch_size = streams_config.get('max_batch_size', 8)
+
+    ###############################
+    #   Load the model
+    ###############################
+    os.environ['CUDA_VISIBLE_DEVICES'] = config['train']['gpus']
+    infer_model = InferenceSession(load_model(config['train']['saved_weights_name']), max_shapes=max_batch_size)
+    infer_model.warmup([(max_batch_size, net_h, net_w)])
+
+    ###############################
+    #   Run all the streams
+    ###############################
+    outputs = StreamOutputs(output_path,
+                            config['model']['labels'],
+                            obj_thresh,
+                            write_video = streams_config.get('write_video', True),
+                            show        = streams_config.get('show', False))
+
+    runner = MultiStreamRunner(infer_model,
+                               streams_config['sources'],
+                               config['model']['anchors'],
+                               net_h, net_w, obj_thresh, nms_thresh,
+                               outputs,
+                               max_batch_size    = max_batch_size,
+                               frames_per_stream = streams_config.get('frames_per_stream', 1),
+                               buffer_size       = streams_config.get('buffer_size', 2),
+                               pace              = streams_config.get('pace', True))
+
+    # known once a reader has opened its source, which is before its first frame
+    outputs.frame_rate = lambda stream_id: runner.readers[stream_id].fps
+    try:
+        stats = runner.run(args.duration)
+    finally:
+        outputs.close()
+
+    print(json.dumps(stats, indent=4))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Run a trained yolo model over several video streams at once')
+    argparser.add_argument('-c', '--conf', help='path to configuration file with a "streams" section')
+    argparser.add_argument('-d', '--duration', type=float, default=None, help='stop after this many seconds')
+
+    args = argparser.parse_args()
+    _main_(args)
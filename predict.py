@@ -4,11 +4,49 @@ import os
 import argparse
 import json
 import cv2
-from utils.utils import get_yolo_boxes, makedirs
+from utils.utils import get_yolo_boxes, get_rect_net_size, makedirs
 from utils.bbox import draw_boxes
+from utils.inference import InferenceSession
+from utils.tiling import get_tiled_yolo_boxes
+from utils.streaming import predict_directory, is_image_file
+from utils.tracking import TrackingDetector
+from utils.motion import MotionGatedDetector
+from utils.render import BoxRenderer, boxes_to_columns
+from utils.profiling import profiler
 from keras.models import load_model
 from tqdm import tqdm
 import numpy as np
+import time
+
+def _get_net_size(image, net_h, net_w, rect):
+    if rect:
+        return get_rect_net_size(image.shape[0], image.shape[1], max(net_h, net_w))
+    return net_h, net_w
+
+def _create_frame_detector(infer_model, anchors, net_h, net_w, obj_thresh, nms_thresh, args):
+    if args.roi:
+        return MotionGatedDetector(infer_model, anchors, obj_thresh, nms_thresh, net_size=max(net_h, net_w))
+
+    if args.track_every <= 0:
+        return None
+
+    def detect(image):
+        image_net_h, image_net_w = _get_net_size(image, net_h, net_w, args.rect)
+        return get_yolo_boxes(infer_model, [image], image_net_h, image_net_w, anchors, obj_thresh, nms_thresh)[0]
+
+    return TrackingDetector(detect, detect_every=args.track_every, obj_thresh=obj_thresh)
+
+def _report_frame_detector(frame_detector, start):
+    if frame_detector is None: return
+
+    elapsed = time.time() - start
+    print('%d frames, %d network calls, %.2f effective fps' % (frame_detector.frames, frame_detector.detections, frame_detector.frames / max(elapsed, 1e-9)))
+
+def _draw(image, boxes, labels, obj_thresh, renderer):
+    with profiler.stage('draw_boxes'):
+        if renderer is None:
+            return draw_boxes(image, boxes, labels, obj_thresh)
+        return renderer.render(image, boxes_to_columns(boxes, obj_thresh))
 
 def _main_(args):
     config_path  = args.conf
@@ -20,6 +58,8 @@ def _main_(args):
 
     makedirs(output_path)
 
+    if args.profile: profiler.enable()
+
     ###############################
     #   Set some parameter
     ###############################       
@@ -32,12 +72,23 @@ def _main_(args):
     os.environ['CUDA_VISIBLE_DEVICES'] = config['train']['gpus']
     infer_model = load_model(config['train']['saved_weights_name'])
 
+    # specialize the model to the input size up front, so the first frame is not slow,
+    # with --rect to every one of the 2*(416//32)-1 input sizes it can letterbox to
+    infer_model = InferenceSession(infer_model, max_shapes=2*(max(net_h, net_w)//32) - 1 if args.rect else 4)
+    if not args.rect:
+        infer_model.warmup([(args.batch_size if args.stream else 1, net_h, net_w)])
+
+    renderer = BoxRenderer(config['model']['labels']) if args.fast_draw else None
+
     ###############################
     #   Predict bounding boxes 
     ###############################
     if 'webcam' in input_path: # do detection on the first webcam
         video_reader = cv2.VideoCapture(0)
 
+        frame_detector = _create_frame_detector(infer_model, config['model']['anchors'], net_h, net_w, obj_thresh, nms_thresh, args)
+        start   = time.time()
+
         # the main loop
         batch_size  = 1
         images      = []
@@ -46,15 +97,20 @@ def _main_(args):
             if ret_val == True: images += [image]
 
             if (len(images)==batch_size) or (ret_val==False and len(images)>0):
-                batch_boxes = get_yolo_boxes(infer_model, images, net_h, net_w, config['model']['anchors'], obj_thresh, nms_thresh)
+                if frame_detector is not None:
+                    batch_boxes = [frame_detector(image) for image in images]
+                else:
+                    image_net_h, image_net_w = _get_net_size(images[0], net_h, net_w, args.rect)
+                    batch_boxes = get_yolo_boxes(infer_model, images, image_net_h, image_net_w, config['model']['anchors'], obj_thresh, nms_thresh)
 
                 for i in range(len(images)):
-                    draw_boxes(images[i], batch_boxes[i], config['model']['labels'], obj_thresh) 
+                    _draw(images[i], batch_boxes[i], config['model']['labels'], obj_thresh, renderer) 
                     cv2.imshow('video with bboxes', images[i])
                 images = []
             if cv2.waitKey(1) == 27: 
                 break  # esc to quit
         cv2.destroyAllWindows()        
+        _report_frame_detector(frame_detector, start)
     elif input_path[-4:] == '.mp4': # do detection on a video  
         video_out = output_path + input_path.split('/')[-1]
         video_reader = cv2.VideoCapture(input_path)
@@ -63,10 +119,17 @@ def _main_(args):
         frame_h = int(video_reader.get(cv2.CAP_PROP_FRAME_HEIGHT))
         frame_w = int(video_reader.get(cv2.CAP_PROP_FRAME_WIDTH))
 
+        if args.rect:
+            net_h, net_w = get_rect_net_size(frame_h, frame_w, max(net_h, net_w))
+            infer_model.warmup([(1, net_h, net_w)])
+
         video_writer = cv2.VideoWriter(video_out,
                                cv2.VideoWriter_fourcc(*'MPEG'), 
                                50.0, 
                                (frame_w, frame_h))
+        frame_detector = _create_frame_detector(infer_model, config['model']['anchors'], net_h, net_w, obj_thresh, nms_thresh, args)
+        start   = time.time()
+
         # the main loop
         batch_size  = 1
         images      = []
@@ -80,11 +143,14 @@ def _main_(args):
 
                 if (i%batch_size == 0) or (i == (nb_frames-1) and len(images) > 0):
                     # predict the bounding boxes
-                    batch_boxes = get_yolo_boxes(infer_model, images, net_h, net_w, config['model']['anchors'], obj_thresh, nms_thresh)
+                    if frame_detector is not None:
+                        batch_boxes = [frame_detector(image) for image in images]
+                    else:
+                        batch_boxes = get_yolo_boxes(infer_model, images, net_h, net_w, config['model']['anchors'], obj_thresh, nms_thresh)
 
                     for i in range(len(images)):
                         # draw bounding boxes on the image using labels
-                        draw_boxes(images[i], batch_boxes[i], config['model']['labels'], obj_thresh)   
+                        _draw(images[i], batch_boxes[i], config['model']['labels'], obj_thresh, renderer)   
 
                         # show the video with detection bounding boxes          
                         if show_window: cv2.imshow('video with bboxes', images[i])  
@@ -97,6 +163,17 @@ def _main_(args):
         if show_window: cv2.destroyAllWindows()
         video_reader.release()
         video_writer.release()       
+        _report_frame_detector(frame_detector, start)
+    elif args.stream: # do batched detection over a directory tree, writing detections to a JSON-lines file
+        predict_directory(infer_model, 
+                          input_path, 
+                          args.detections or os.path.join(output_path, 'detections.jsonl'),
+                          config['model']['labels'], 
+                          config['model']['anchors'], 
+                          net_h, net_w, obj_thresh, nms_thresh,
+                          batch_size        = args.batch_size,
+                          workers           = args.workers,
+                          image_output_path = output_path if args.save_images else None)
     else: # do detection on an image or a set of images
         image_paths = []
 
@@ -106,27 +183,52 @@ def _main_(args):
         else:
             image_paths += [input_path]
 
-        image_paths = [inp_file for inp_file in image_paths if (inp_file[-4:] in ['.jpg', '.png', 'JPEG'])]
+        image_paths = [inp_file for inp_file in image_paths if is_image_file(inp_file)]
 
         # the main loop
         for image_path in image_paths:
-            image = cv2.imread(image_path)
+            with profiler.stage('imread'):
+                image = cv2.imread(image_path)
             print(image_path)
 
             # predict the bounding boxes
-            boxes = get_yolo_boxes(infer_model, [image], net_h, net_w, config['model']['anchors'], obj_thresh, nms_thresh)[0]
+            if args.tile:
+                boxes = get_tiled_yolo_boxes(infer_model, image, args.tile, args.tile, config['model']['anchors'], obj_thresh, nms_thresh,
+                                             overlap=args.tile_overlap, batch_size=args.tile_batch, fusion=args.tile_fusion)
+            else:
+                image_net_h, image_net_w = _get_net_size(image, net_h, net_w, args.rect)
+                boxes = get_yolo_boxes(infer_model, [image], image_net_h, image_net_w, config['model']['anchors'], obj_thresh, nms_thresh)[0]
 
             # draw bounding boxes on the image using labels
-            draw_boxes(image, boxes, config['model']['labels'], obj_thresh) 
+            _draw(image, boxes, config['model']['labels'], obj_thresh, renderer) 
      
             # write the image with bounding boxes to file
             cv2.imwrite(output_path + image_path.split('/')[-1], np.uint8(image))         
 
+    if args.profile:
+        print(profiler.report())
+        if args.profile_output: profiler.save(args.profile_output)
+
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description='Predict with a trained yolo model')
     argparser.add_argument('-c', '--conf', help='path to configuration file')
     argparser.add_argument('-i', '--input', help='path to an image, a directory of images, a video, or webcam')    
     argparser.add_argument('-o', '--output', default='output/', help='path to output directory')   
+    argparser.add_argument('--rect', action='store_true', help='letterbox into the smallest multiple-of-32 rectangle covering the image aspect ratio instead of a square')
+    argparser.add_argument('--tile', type=int, default=0, help='run on overlapping tiles of this size (a multiple of 32) at native resolution, for very large images')
+    argparser.add_argument('--tile-overlap', type=int, default=64, help='number of pixels shared by neighbouring tiles')
+    argparser.add_argument('--tile-batch', type=int, default=4, help='number of tiles per batch')
+    argparser.add_argument('--tile-fusion', action='store_true', help='extend merged boxes to the union of their duplicates across tile seams')
+    argparser.add_argument('--stream', action='store_true', help='scan the input directory recursively and write detections to a resumable JSON-lines file')
+    argparser.add_argument('--detections', help='path of the JSON-lines detections file in stream mode (default: OUTPUT/detections.jsonl)')
+    argparser.add_argument('--save-images', action='store_true', help='also write annotated images in stream mode')
+    argparser.add_argument('--batch-size', type=int, default=8, help='number of images per batch in stream mode')
+    argparser.add_argument('--workers', type=int, default=4, help='number of image decoding threads in stream mode')
+    argparser.add_argument('--track-every', type=int, default=0, help='on video, run the network at most every N frames and track boxes in between (0 runs it on every frame)')
+    argparser.add_argument('--roi', action='store_true', help='on video from a static camera, only run the network on regions that changed')
+    argparser.add_argument('--fast-draw', action='store_true', help='draw boxes with the cached, columnar renderer (best label only)')
+    argparser.add_argument('--profile', action='store_true', help='time every stage of the inference path and print the breakdown')
+    argparser.add_argument('--profile-output', help='also write the breakdown to this file, in Prometheus text format if it ends with .prom, JSON otherwise')
     
     args = argparser.parse_args()
     _main_(args)
@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+
+import os
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import TimeoutError
+import cv2
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+from utils.utils import get_yolo_boxes
+from utils.inference import InferenceSession
+from utils.batching import DynamicBatcher
+from utils.streaming import boxes_to_records
+
+def create_handler(batcher, timeout):
+    class DetectionHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send_json(200, batcher.metrics())
+            elif self.path == '/health':
+                self._send_json(200, {'status': 'ok'})
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/detect':
+                self._send_json(404, {'error': 'not found'})
+                return
+
+            length = int(self.headers.get('Content-Length', 0))
+            image  = cv2.imdecode(np.frombuffer(self.rfile.read(length), dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                self._send_json(400, {'error': 'unable to decode image'})
+                return
+
+            future = batcher.submit(image)
+            try:
+                boxes = future.result(timeout)
+            except TimeoutError:
+                future.cancel()
+                self._send_json(503, {'error': 'timed out'})
+                return
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+                return
+
+            self._send_json(200, {'height': image.shape[0], 'width': image.shape[1], 'boxes': boxes})
+
+        def log_message(self, format, *args):
+            pass # keep the console quiet under load
+
+    return DetectionHandler
+
+def _main_(args):
+    config_path = args.conf
+
+    with open(config_path) as config_buffer:
+        config = json.load(config_buffer)
+
+    ###############################
+    #   Set some parameter
+    ###############################
+    net_h, net_w = args.net_size, args.net_size # a multiple of 32, the smaller the faster
+    obj_thresh, nms_thresh = 0.5, 0.45
+    labels, anchors = config['model']['labels'], config['model']['anchors']
+
+    ###############################
+    #   Load the model
+    ###############################
+    os.environ['CUDA_VISIBLE_DEVICES'] = config['train']['gpus']
+    infer_model = InferenceSession(load_model(config['train']['saved_weights_name']), max_shapes=args.max_batch_size)
+
+    # the batching thread is not the one that loaded the model
+    graph = tf.get_default_graph()
+
+    def predict(images):
+        with graph.as_default():
+            batch_boxes = get_yolo_boxes(infer_model, images, net_h, net_w, anchors, obj_thresh, nms_thresh)
+        return [boxes_to_records(boxes, labels, obj_thresh) for boxes in batch_boxes]
+
+    infer_model.warmup([(size, net_h, net_w) for size in range(1, args.max_batch_size + 1)])
+
+    ###############################
+    #   Serve
+    ###############################
+    batcher = DynamicBatcher(predict, max_batch_size=args.max_batch_size, max_latency=args.max_latency / 1000.).start()
+    server  = ThreadingHTTPServer((args.host, args.port), create_handler(batcher, args.timeout))
+
+    print('Serving on http://%s:%d (POST /detect, GET /metrics)' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Serve a trained yolo model over HTTP with dynamic batching')
+    argparser.add_argument('-c', '--conf', help='path to configuration file')
+    argparser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    argparser.add_argument('-p', '--port', type=int, default=8080, help='port to listen on')
+    argparser.add_argument('-s', '--net-size', type=int, default=416, help='network input size, a multiple of 32')
+    argparser.add_argument('-b', '--max-batch-size', type=int, default=8, help='largest batch sent through the model')
+    argparser.add_argument('-l', '--max-latency', type=float, default=10., help='milliseconds a request may wait for a batch to fill')
+    argparser.add_argument('-t', '--timeout', type=float, default=30., help='seconds before a request is answered with 503')
+
+    args = argparser.parse_args()
+    _main_(args)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from generator import BatchGenerator
+
+ANCHORS = [10,13, 16,30, 33,23, 30,61, 62,45, 59,119, 116,90, 156,198, 373,326]
+
+def _instance(num_objects):
+    objects = [{'name': 'a', 'xmin': 10 + 40*i, 'ymin': 10 + 40*i, 'xmax': 40 + 40*i, 'ymax': 50 + 40*i} for i in range(num_objects)]
+    return {'filename': 'unused.jpg', 'width': 416, 'height': 416, 'object': objects}
+
+def _fill_batch(instances, max_box_per_image=8, per_batch_boxes=False):
+    generator = BatchGenerator(instances, ANCHORS, ['a'], max_box_per_image=max_box_per_image, batch_size=len(instances),
+                               shuffle=False, per_batch_boxes=per_batch_boxes)
+
+    _, t_batch, yolos, _ = generator._allocate_batch(len(instances), 416, 416, 3, generator._box_count(instances))
+    for instance_count, instance in enumerate(instances):
+        generator._fill_targets(instance['object'], instance_count, yolos, t_batch, 416, 416)
+    return t_batch
+
+def _rows_kept(t_batch):
+    # the rows YoloLayer compares the predictions against, see YoloLayer.call
+    filled = t_batch[..., 2] > 0
+    nb_true_boxes = filled.sum(axis=-1).max()
+    return filled[..., :nb_true_boxes].reshape(len(t_batch), -1).sum(axis=-1)
+
+def test_true_boxes_fill_every_image_from_the_first_row():
+    t_batch = _fill_batch([_instance(2) for _ in range(4)])
+
+    assert np.all(t_batch[:, 0, 0, 0, :2, 2] > 0)
+    assert np.all(t_batch[:, 0, 0, 0, 2:] == 0)
+    assert _rows_kept(t_batch).tolist() == [2, 2, 2, 2]
+
+def test_true_boxes_of_uneven_images_are_all_kept():
+    t_batch = _fill_batch([_instance(n) for n in [1, 5, 3, 2]])
+
+    assert _rows_kept(t_batch).tolist() == [1, 5, 3, 2]
+
+def test_per_batch_boxes_pads_to_the_fullest_image():
+    t_batch = _fill_batch([_instance(n) for n in [1, 5, 3, 2]], max_box_per_image=30, per_batch_boxes=True)
+
+    assert t_batch.shape[4] == 5
+    assert _rows_kept(t_batch).tolist() == [1, 5, 3, 2]
@@ -6,12 +6,18 @@ import numpy as np
 import json
 from voc import parse_voc_annotation
 import yolo
-from generator import BatchGenerator
+from generator import BatchGenerator, NetSizeScheduler, CachedFeatureGenerator
 from utils.utils import normalize, evaluate, makedirs
 from keras.callbacks import EarlyStopping, ReduceLROnPlateau
 from keras.optimizers import Adam
-from callbacks import CustomModelCheckpoint, CustomTensorBoard
+from callbacks import CustomModelCheckpoint, CustomTensorBoard, TrainingThroughput, AverageLogs, MeanAveragePrecision, TrainingState, HardExampleMining
 from utils.multi_gpu_model import multi_gpu_model
+from utils.precision import LossScaledAdam
+from utils.accumulation import GradientAccumulation
+from utils.allreduce import launch, shard
+from utils.data_parallel import DataParallelOptimizer, broadcast_weights, limit_threads
+from utils.checkpoint import CheckpointWriter, load_checkpoint, read_training_state
+from utils.sampling import HardExampleSampler, ClassBalancedSampler, BucketSampler, ImageLosses
 import tensorflow as tf
 import keras
 from keras.models import load_model
@@ -62,8 +68,12 @@ def create_training_instances(
 
     return train_ints, valid_ints, labels, max_box_per_image
 
-def create_callbacks(saved_weights_name, intermediate_saved_weights_name, tensorboard_logs, model_to_save):
+def create_callbacks(saved_weights_name, intermediate_saved_weights_name, tensorboard_logs, model_to_save, train_generator=None, allreduce=None,
+                     keep_checkpoints=None, full_checkpoint_every=1, map_evaluation=None, map_every=0, best_model_metric='loss', training_state=None):
     makedirs(tensorboard_logs)
+
+    # both checkpoints are written by the same background thread
+    writer = CheckpointWriter()
     
     early_stop = EarlyStopping(
         monitor     = 'loss', 
@@ -72,17 +82,23 @@ def create_callbacks(saved_weights_name, intermediate_saved_weights_name, tensor
         mode        = 'min', 
         verbose     = 1
     )
+    # the best model by val_mAP is only known every map_every epochs
+    best_by_map = best_model_metric == 'val_mAP'
     checkpoint = CustomModelCheckpoint(
         model_to_save   = model_to_save,
+        writer          = writer,
         filepath        = saved_weights_name,
-        monitor         = 'loss', 
+        monitor         = best_model_metric, 
         verbose         = 1, 
         save_best_only  = True, 
-        mode            = 'min', 
-        period          = 1
+        mode            = 'max' if best_by_map else 'min', 
+        period          = map_every if best_by_map else 1
     )
     checkpoint_intermediate = CustomModelCheckpoint(
         model_to_save   = model_to_save,
+        writer          = writer,
+        keep            = keep_checkpoints,
+        full_every      = full_checkpoint_every,
         filepath        = intermediate_saved_weights_name,
         monitor         = 'val_loss', 
         verbose         = 1, 
@@ -105,13 +121,39 @@ def create_callbacks(saved_weights_name, intermediate_saved_weights_name, tensor
         write_graph            = True,
         write_images           = True,
     )    
-    return [early_stop, checkpoint_intermediate, checkpoint, reduce_on_plateau, tensorboard]
+    callbacks = [early_stop, checkpoint_intermediate, checkpoint, reduce_on_plateau, tensorboard]
+
+    # val_mAP is in the logs of the callbacks after it
+    if map_evaluation is not None:
+        callbacks.insert(0, map_evaluation)
+
+    # data-parallel workers decide on the same averaged logs, only the first one writes anything
+    if allreduce is not None:
+        if allreduce.rank > 0:
+            callbacks = [AverageLogs(allreduce), early_stop, reduce_on_plateau]
+            if training_state is not None:
+                training_state.callbacks = list(callbacks)
+                callbacks.append(training_state)
+            return callbacks
+        callbacks.insert(0, AverageLogs(allreduce))
+
+    if train_generator is not None:
+        callbacks.append(TrainingThroughput(
+            generator = train_generator,
+            log_dir   = os.path.join(tensorboard_logs, 'throughput'),
+            csv_path  = os.path.join(tensorboard_logs, 'throughput.csv')
+        ))
+
+    # saves the state of the callbacks before it, and restores it after they reset themselves
+    if training_state is not None:
+        training_state.callbacks = list(callbacks)
+        callbacks.append(training_state)
+    return callbacks
 
 def create_model(
     nb_class, 
     anchors, 
     max_box_per_image, 
-    max_grid, batch_size, 
     warmup_batches, 
     ignore_thresh, 
     multi_gpu, 
@@ -124,7 +166,15 @@ def create_model(
     xywh_scale,
     class_scale,
     model_type="full",
-    input_image_size=(None, None, 3)
+    input_image_size=(None, None, 3),
+    compute_dtype=None,
+    loss_scale=1.,
+    loss_stats=False,
+    accumulation_steps=1,
+    allreduce=None,
+    freeze_layers=None,
+    cache_features=False,
+    image_losses=None
 ):
     if multi_gpu > 1:
         with tf.device('/cpu:0'):
@@ -133,8 +183,6 @@ def create_model(
                 nb_class            = nb_class, 
                 anchors             = anchors, 
                 max_box_per_image   = max_box_per_image, 
-                max_grid            = max_grid, 
-                batch_size          = batch_size//multi_gpu, 
                 warmup_batches      = warmup_batches,
                 ignore_thresh       = ignore_thresh,
                 grid_scales         = grid_scales,
@@ -142,7 +190,9 @@ def create_model(
                 noobj_scale         = noobj_scale,
                 xywh_scale          = xywh_scale,
                 class_scale         = class_scale,
-                input_image_size    = (input_image_size[1], input_image_size[0], input_image_size[2])
+                input_image_size    = (input_image_size[1], input_image_size[0], input_image_size[2]),
+                compute_dtype       = compute_dtype,
+                loss_stats          = loss_stats
             )
     else:
         template_model, infer_model = yolo.create_yolo_model(
@@ -150,8 +200,6 @@ def create_model(
             nb_class            = nb_class, 
             anchors             = anchors, 
             max_box_per_image   = max_box_per_image, 
-            max_grid            = max_grid, 
-            batch_size          = batch_size, 
             warmup_batches      = warmup_batches,
             ignore_thresh       = ignore_thresh,
             grid_scales         = grid_scales,
@@ -159,51 +207,84 @@ def create_model(
             noobj_scale         = noobj_scale,
             xywh_scale          = xywh_scale,
             class_scale         = class_scale,
-            input_image_size    = (input_image_size[1], input_image_size[0], input_image_size[2])
+            input_image_size    = (input_image_size[1], input_image_size[0], input_image_size[2]),
+            compute_dtype       = compute_dtype,
+            loss_stats          = loss_stats
         )  
 
     # load the pretrained weight if exists, otherwise load the backend weight only
     if os.path.exists(saved_weights_name): 
         print("\nLoading pretrained weights.\n")
-        template_model.load_weights(saved_weights_name)
+        load_checkpoint(template_model, saved_weights_name)
     elif pre_trained_weights:
         template_model.load_weights(pre_trained_weights)
     else:
         print("Not using pre trained weights!")
 
+    if freeze_layers is not None:
+        frozen = yolo.freeze_layers(template_model, *freeze_layers)
+        print("Freezing %d layers from conv_%d to conv_%d." % (frozen, freeze_layers[0], freeze_layers[1]))
+
+    # with cached backbone features, only the layers after the frozen ones are run
+    backbone_model = None
+    if cache_features:
+        backbone_model, template_model = yolo.split_backbone(template_model, freeze_layers[1])
+
     if multi_gpu > 1:
         train_model = multi_gpu_model(template_model, gpus=multi_gpu)
     else:
         train_model = template_model      
 
-    optimizer = Adam(lr=lr, clipnorm=0.001)
-    train_model.compile(loss=yolo.dummy_loss, optimizer=optimizer)
+    if compute_dtype is not None:
+        optimizer = LossScaledAdam(loss_scale=loss_scale, lr=lr, clipnorm=0.001)
+    else:
+        optimizer = Adam(lr=lr, clipnorm=0.001)
+    if accumulation_steps > 1:
+        optimizer = GradientAccumulation(optimizer, accumulation_steps)
+    if allreduce is not None:
+        optimizer = DataParallelOptimizer(optimizer, allreduce)
 
-    return train_model, infer_model
+    # the training step also reports the loss of every image, for the hard example sampler
+    if image_losses is not None:
+        train_model.compile(loss=yolo.dummy_loss, optimizer=optimizer, fetches=[image_losses.fetch(train_model)])
+    else:
+        train_model.compile(loss=yolo.dummy_loss, optimizer=optimizer)
 
-def _main_(args):
-    config_path = args.conf
+    # the replicas of a multi-GPU model compute their own statistics, which are not reported
+    if loss_stats and multi_gpu <= 1:
+        yolo.add_loss_stats(train_model)
 
-    with open(config_path) as config_buffer:    
-        config = json.loads(config_buffer.read())
+    return train_model, infer_model, backbone_model
 
-    ###############################
-    #   Parse the annotations 
-    ###############################
-    train_ints, valid_ints, labels, max_box_per_image = create_training_instances(
-        config['train']['train_annot_folder'],
-        config['train']['train_image_folder'],
-        config['train']['cache_name'],
-        config['valid']['valid_annot_folder'],
-        config['valid']['valid_image_folder'],
-        config['valid']['cache_name'],
-        config['model']['labels']
-    )
-    print('\nTraining on: \t' + str(labels) + '\n')
+def _train(config, train_ints, valid_ints, labels, max_box_per_image, resume=False, rank=0, world_size=1, allreduce=None):
+    # data-parallel workers train and validate on their own shard, the first one evaluates on all of valid_ints
+    if allreduce is not None:
+        train_ints = shard(train_ints, rank, world_size)
+        limit_threads(world_size)
 
     ###############################
     #   Create the generators 
     ###############################    
+    workers, max_queue_size = 4, 8
+
+    # with reuse_buffers, every batch still alive in fit_generator's queue needs its own buffer
+    buffer_pool = workers + max_queue_size + 2 if config['train'].get('reuse_buffers', False) else 0
+
+    # "hard_examples" draws the images by their last loss and the rarity of their classes instead of shuffling them,
+    # "class_balanced" by the rarity of their classes alone
+    sampler, image_losses = None, None
+    if config['train'].get('sampler', 'uniform') == 'hard_examples':
+        sampler      = HardExampleSampler(max_staleness=config['train'].get('sampler_max_staleness', 3))
+        image_losses = ImageLosses()
+    elif config['train'].get('sampler', 'uniform') == 'class_balanced':
+        sampler      = ClassBalancedSampler(class_power=config['train'].get('sampler_class_power', 1.0))
+
+    # batches of images with similar aspect ratios and numbers of objects, whose true boxes are then only
+    # padded to the fullest image of the batch rather than of the dataset
+    if config['train'].get('bucket_batches', False):
+        sampler = BucketSampler(config['train']['batch_size'], sampler=sampler)
+    per_batch_boxes = config['train'].get('per_batch_boxes', config['train'].get('bucket_batches', False))
+
     train_generator = BatchGenerator(
         instances           = train_ints,
         anchors             = config['model']['anchors'],
@@ -224,11 +305,20 @@ def _main_(args):
         aug_exposure        = config["train"]["augmentation"]["exposure"],
         aug_gray            = config["train"]["augmentation"]["gray"],
         aug_flip            = config["train"]["augmentation"]["flip"],
-        aug_pad             = config["train"]["augmentation"]["pad"]
+        aug_pad             = config["train"]["augmentation"]["pad"],
+        net_size_scheduler  = NetSizeScheduler(
+            min_net_size        = config['model']['min_input_size']//32*32,
+            max_net_size        = config['model']['max_input_size']//32*32,
+            seed                = config['train'].get('net_size_seed'),
+            contiguous          = config['train'].get('group_net_sizes', False)
+        ),
+        buffer_pool         = buffer_pool,
+        sampler             = sampler,
+        per_batch_boxes     = per_batch_boxes
     )
     
     valid_generator = BatchGenerator(
-        instances           = valid_ints,
+        instances           = valid_ints if allreduce is None else shard(valid_ints, rank, world_size),
         anchors             = config['model']['anchors'],
         labels              = labels,
         downsample          = 32, # ratio between network input's size and network output's size, 32 for YOLOv3
@@ -247,25 +337,58 @@ def _main_(args):
         aug_exposure        = None,
         aug_gray            = config["train"]["augmentation"]["gray"],
         aug_flip            = False,
-        aug_pad             = False
+        aug_pad             = False,
+        per_batch_boxes     = per_batch_boxes
     )
 
     ###############################
     #   Create the model 
     ###############################
-    if os.path.exists(config['train']['saved_weights_name']): 
+    # the full state of training, from which --resume continues at the epoch it was saved after
+    training_state_name = config['train'].get('training_state_name') or \
+                          os.path.splitext(config['train']['saved_weights_name'])[0] + '.state.h5'
+    initial_epoch = 0
+    if resume and not os.path.exists(training_state_name):
+        print("No training state in %s, starting from the beginning." % training_state_name)
+        resume = False
+
+    # the warmup continues where it stopped when resuming
+    if resume:
+        saved_state   = read_training_state(training_state_name)
+        initial_epoch = saved_state['epoch']
+        config['train']['warmup_epochs'] = saved_state['settings']['warmup_epochs']
+    elif os.path.exists(config['train']['saved_weights_name']): 
         config['train']['warmup_epochs'] = 0
+    # counted in generator batches, also when gradients are accumulated over several of them
     warmup_batches = config['train']['warmup_epochs'] * (config['train']['train_times']*len(train_generator))   
 
-    os.environ['CUDA_VISIBLE_DEVICES'] = config['train']['gpus']
-    multi_gpu = len(config['train']['gpus'].split(','))
+    # data-parallel workers get their device from launch
+    if allreduce is None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = config['train']['gpus']
+        multi_gpu = len(config['train']['gpus'].split(','))
+    else:
+        multi_gpu = 1
+
+    # freeze_layers is a [first, last] range of conv_N indices, or "backbone"
+    freeze = config['train'].get('freeze_layers')
+    if freeze == 'backbone':
+        freeze = yolo.BACKBONE_LAYERS[config['model']['architecture']]
+
+    # backbone features can be cached when they are the same every epoch
+    feature_cache = config['train'].get('feature_cache')
+    cache_features = bool(feature_cache) and freeze is not None and freeze[0] == 0 and multi_gpu <= 1 \
+                     and train_generator.is_deterministic() and valid_generator.is_deterministic()
+    if feature_cache and not cache_features:
+        print("Not caching backbone features: they need frozen layers from conv_0, a single GPU, a fixed input size and no random augmentation.")
 
-    train_model, infer_model = create_model(
+    # the darknet convolutions compute in float16 or bfloat16, the loss, batch normalization and Adam stay in float32
+    compute_dtype = config['train'].get('mixed_precision') or None
+    loss_scale    = config['train'].get('loss_scale', 128. if compute_dtype == 'float16' else 1.)
+
+    train_model, infer_model, backbone_model = create_model(
         nb_class            = len(labels), 
         anchors             = config['model']['anchors'], 
-        max_box_per_image   = max_box_per_image, 
-        max_grid            = [config['model']['max_input_size'], config['model']['max_input_size']], 
-        batch_size          = config['train']['batch_size'], 
+        max_box_per_image   = None if per_batch_boxes else max_box_per_image, 
         warmup_batches      = warmup_batches,
         ignore_thresh       = config['train']['ignore_thresh'],
         multi_gpu           = multi_gpu,
@@ -278,7 +401,51 @@ def _main_(args):
         xywh_scale          = config['train']['xywh_scale'],
         class_scale         = config['train']['class_scale'],
         model_type          = config["model"]["architecture"],
-        input_image_size    = config["model"]["explicit_input_size"]
+        input_image_size    = config["model"]["explicit_input_size"],
+        compute_dtype       = compute_dtype,
+        loss_scale          = loss_scale,
+        loss_stats          = config['train'].get('loss_stats', False),
+        accumulation_steps  = config['train'].get('accumulation_steps', 1),
+        allreduce           = allreduce,
+        freeze_layers       = freeze,
+        cache_features      = cache_features,
+        image_losses        = image_losses
+    )
+    if allreduce is not None:
+        broadcast_weights(infer_model, allreduce)
+
+    # the generators keep their order of the images but serve their cached features
+    fit_train_generator, fit_valid_generator = train_generator, valid_generator
+    if cache_features:
+        fit_train_generator = CachedFeatureGenerator(train_generator, backbone_model, feature_cache)
+        fit_valid_generator = CachedFeatureGenerator(valid_generator, backbone_model, feature_cache)
+
+    # the mAP of a fixed validation subset every map_every epochs, which can select the best model instead of the loss
+    best_model_metric = config['train'].get('best_model_metric', 'loss')
+    map_every         = config['train'].get('map_every', 1 if best_model_metric == 'val_mAP' else 0)
+
+    map_evaluation = None
+    if map_every > 0 and rank == 0:
+        map_evaluation = MeanAveragePrecision(
+            model       = infer_model,
+            instances   = valid_ints,
+            labels      = labels,
+            anchors     = config['model']['anchors'],
+            period      = map_every,
+            images      = config['train'].get('map_images', 100),
+            net_size    = config['train'].get('map_net_size', 416),
+            batch_size  = config['train']['batch_size'],
+            log_dir     = os.path.join(config['train']['tensorboard_dir'], 'map')
+        )
+
+    training_state = TrainingState(
+        filepath        = training_state_name,
+        model_to_save   = infer_model,
+        callbacks       = [],
+        generator       = train_generator,
+        resume          = resume,
+        save            = rank == 0,
+        settings        = {'warmup_epochs': config['train']['warmup_epochs']}
     )
 
     ###############################
@@ -288,21 +455,37 @@ def _main_(args):
         config['train']['saved_weights_name'],
         config['train']['intermediate_weights_name'],
         config['train']['tensorboard_dir'],
-        infer_model
+        infer_model,
+        fit_train_generator,
+        allreduce,
+        keep_checkpoints        = config['train'].get('keep_checkpoints'),
+        full_checkpoint_every   = config['train'].get('full_checkpoint_every', 1),
+        map_evaluation          = map_evaluation,
+        map_every               = map_every,
+        best_model_metric       = best_model_metric,
+        training_state          = training_state
     )
+    if image_losses is not None:
+        callbacks.insert(0, HardExampleMining(train_generator, image_losses))
 
     train_model.fit_generator(
-        generator        = train_generator, 
-        validation_data  = valid_generator,
+        generator        = fit_train_generator, 
+        validation_data  = fit_valid_generator,
         steps_per_epoch  = len(train_generator) * config['train']['train_times'], 
         epochs           = config['train']['nb_epochs'] + config['train']['warmup_epochs'], 
-        verbose          = 2 if config['train']['debug'] else 1,
+        initial_epoch    = initial_epoch,
+        verbose          = 0 if rank > 0 else 2 if config['train']['debug'] else 1,
         callbacks        = callbacks, 
-        workers          = 4,
-        max_queue_size   = 8,
-        use_multiprocessing = False
+        workers          = workers,
+        max_queue_size   = max_queue_size,
+        use_multiprocessing = False,
+        shuffle          = sampler is None
     )
 
+    if rank > 0:
+        return
+    valid_generator.instances = valid_ints
+
     # make a GPU version of infer_model for evaluation
     if multi_gpu > 1:
         infer_model = load_model(config['train']['saved_weights_name'])
@@ -318,9 +501,48 @@ def _main_(args):
         print(labels[label] + ': {:.4f}'.format(average_precision))
     print('mAP: {:.4f}'.format(sum(average_precisions.values()) / len(average_precisions)))           
 
+def _main_(args):
+    config_path = args.conf
+
+    with open(config_path) as config_buffer:    
+        config = json.loads(config_buffer.read())
+
+    # the best model by val_mAP needs the mAP evaluated
+    if config['train'].get('best_model_metric') == 'val_mAP' and config['train'].get('map_every', 1) <= 0:
+        raise ValueError('best_model_metric "val_mAP" needs map_every > 0')
+
+    ###############################
+    #   Parse the annotations 
+    ###############################
+    train_ints, valid_ints, labels, max_box_per_image = create_training_instances(
+        config['train']['train_annot_folder'],
+        config['train']['train_image_folder'],
+        config['train']['cache_name'],
+        config['valid']['valid_annot_folder'],
+        config['valid']['valid_image_folder'],
+        config['valid']['cache_name'],
+        config['model']['labels']
+    )
+    print('\nTraining on: \t' + str(labels) + '\n')
+
+    # data-parallel training in worker processes, one GPU each if there are any
+    processes = config['train'].get('processes', 1)
+    if processes > 1:
+        gpus = [gpu for gpu in config['train']['gpus'].split(',') if gpu.strip()]
+        launch(
+            _train,
+            world_size  = processes,
+            backend     = config['train'].get('allreduce', 'shared_memory'),
+            devices     = gpus or [''],
+            args        = (config, train_ints, valid_ints, list(labels), max_box_per_image, args.resume)
+        )
+    else:
+        _train(config, train_ints, valid_ints, labels, max_box_per_image, args.resume)
+
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description='train and evaluate YOLO_v3 model on any dataset')
     argparser.add_argument('-c', '--conf', default="training/yolo3_micro_gray_all_laptop.json", help='path to configuration file')
+    argparser.add_argument('-r', '--resume', action='store_true', help='continue from the training state saved after the last epoch')
 
     args = argparser.parse_args()
     _main_(args)
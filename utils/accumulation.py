@@ -0,0 +1,77 @@
+from keras.optimizers import Optimizer
+from keras import backend as K
+import tensorflow as tf
+
+class GradientAccumulation(Optimizer):
+    """ Wraps an optimizer to update the weights once every `steps` batches, with the
+    average of their gradients, for an effective batch size of steps x batch_size.
+
+    The gradients of every batch are added to accumulators. The wrapped optimizer
+    builds its usual updates from the averaged gradients, but all of them (weights,
+    moments, iteration count) only take effect on the last batch of each group, which
+    also resets the accumulators. Batch normalization statistics are still updated
+    every batch.
+
+    # Arguments
+        optimizer   : The optimizer to wrap, e.g. Adam or LossScaledAdam. Its gradient
+                      clipping and loss scaling apply to the gradients of every batch.
+        steps       : Number of batches per weight update.
+
+    reduce_gradients can be set to a function of the list of averaged gradients run only on
+    the batches that update the weights, as DataParallelOptimizer does to exchange them
+    between workers once per update rather than once per batch.
+    """
+    def __init__(self, optimizer, steps, **kwargs):
+        super(GradientAccumulation, self).__init__(**kwargs)
+        self.optimizer = optimizer
+        self.steps     = steps
+
+        with K.name_scope(self.__class__.__name__):
+            self.iterations = K.variable(0, dtype='int64', name='iterations')
+
+        # shared with the wrapped optimizer, so that ReduceLROnPlateau keeps working
+        self.lr = optimizer.lr
+
+        self.reduce_gradients = None
+
+    def get_updates(self, loss, params):
+        apply_updates = K.equal((self.iterations + 1) % self.steps, 0)
+        accumulators  = [K.zeros(K.int_shape(p), dtype=K.dtype(p)) for p in params]
+
+        grads = self.optimizer.get_gradients(loss, params)
+        totals = [accumulator + grad for accumulator, grad in zip(accumulators, grads)]
+
+        # build the updates of the wrapped optimizer from the average gradients, with
+        # every variable update made conditional on this being the last batch of the group
+        update, update_add, update_sub = K.update, K.update_add, K.update_sub
+
+        averages = [total / float(self.steps) for total in totals]
+        if self.reduce_gradients is not None:
+            averages = tf.cond(apply_updates, lambda: self.reduce_gradients(averages), lambda: averages)
+
+        K.update     = lambda x, new_x: update(x, K.switch(apply_updates, new_x, x))
+        K.update_add = lambda x, increment: update_add(x, increment * K.cast(apply_updates, K.dtype(x)))
+        K.update_sub = lambda x, decrement: update_sub(x, decrement * K.cast(apply_updates, K.dtype(x)))
+        self.optimizer.get_gradients = lambda loss, params: averages
+        try:
+            optimizer_updates = self.optimizer.get_updates(loss, params)
+        finally:
+            K.update, K.update_add, K.update_sub = update, update_add, update_sub
+            del self.optimizer.get_gradients
+
+        # the accumulators must only change once the wrapped optimizer has read them
+        with tf.control_dependencies(optimizer_updates):
+            accumulator_updates = [K.update(accumulator, K.switch(apply_updates, K.zeros_like(total), total))
+                                   for accumulator, total in zip(accumulators, totals)]
+            iteration_update = K.update_add(self.iterations, 1)
+
+        self.weights = [self.iterations] + accumulators + self.optimizer.weights
+        self.updates = optimizer_updates + accumulator_updates + [iteration_update]
+        return self.updates
+
+    def get_config(self):
+        config = {'optimizer': {'class_name': self.optimizer.__class__.__name__,
+                                'config': self.optimizer.get_config()},
+                  'steps': self.steps}
+        base_config = super(GradientAccumulation, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
@@ -0,0 +1,292 @@
+import os
+import time
+import shutil
+import socket
+import struct
+import tempfile
+import multiprocessing
+from multiprocessing.connection import wait
+from contextlib import contextmanager
+import numpy as np
+
+class AllReduce(object):
+    """ Averages lists of arrays over the worker processes of a data-parallel run.
+
+    Every worker calls allreduce (or broadcast) with arrays of the same shapes, in the
+    same order, and gets the average over all workers back. The arrays are packed into
+    a single float32 buffer, so a whole list costs one exchange.
+
+    Backends implement _sum and _broadcast on that buffer. prepare runs in the launching
+    process and yields the keyword arguments every worker builds its backend from.
+    """
+    def __init__(self, rank, world_size):
+        self.rank       = rank
+        self.world_size = world_size
+
+    @classmethod
+    @contextmanager
+    def prepare(cls, context, world_size):
+        yield {}
+
+    def allreduce(self, arrays):
+        return self._unpack(self._sum(self._pack(arrays)) / self.world_size, arrays)
+
+    def broadcast(self, arrays):
+        """ The arrays of the first worker, on all of them. """
+        return self._unpack(self._broadcast(self._pack(arrays)), arrays)
+
+    def close(self):
+        pass
+
+    def _sum(self, buffer):
+        raise NotImplementedError
+
+    def _broadcast(self, buffer):
+        raise NotImplementedError
+
+    @staticmethod
+    def _pack(arrays):
+        return np.concatenate([np.asarray(array, dtype=np.float32).ravel() for array in arrays])
+
+    @staticmethod
+    def _unpack(buffer, arrays):
+        unpacked, offset = [], 0
+        for array in arrays:
+            array = np.asarray(array)
+            unpacked.append(buffer[offset:offset + array.size].reshape(array.shape).astype(array.dtype))
+            offset += array.size
+        return unpacked
+
+class SharedMemoryAllReduce(AllReduce):
+    """ Exchanges buffers through memory mapped files in /dev/shm, for workers on one machine.
+
+    Every worker writes its buffer to its own row and sums all rows once a barrier says
+    they are all written. A second barrier keeps the rows from being overwritten by the
+    next exchange before every worker has read them.
+
+    # Arguments
+        path    : Directory of the shared files, made by prepare.
+        barrier : A multiprocessing.Barrier for world_size parties, made by prepare.
+        timeout : Seconds to wait for the other workers before giving up.
+    """
+    def __init__(self, rank, world_size, path, barrier, timeout=600):
+        super(SharedMemoryAllReduce, self).__init__(rank, world_size)
+        self.path    = path
+        self.barrier = barrier
+        self.timeout = timeout
+        self._tables = {}
+
+    @classmethod
+    @contextmanager
+    def prepare(cls, context, world_size):
+        shared_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        path = tempfile.mkdtemp(prefix='yolo_allreduce_', dir=shared_dir)
+        try:
+            yield {'path': path, 'barrier': context.Barrier(world_size)}
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _table(self, size):
+        # one table of world_size rows per buffer size, made by the first worker
+        if size not in self._tables:
+            filename = os.path.join(self.path, 'buffer_%d' % size)
+            if self.rank == 0:
+                np.memmap(filename, dtype=np.float32, mode='w+', shape=(self.world_size, size)).flush()
+            self.barrier.wait(self.timeout)
+            self._tables[size] = np.memmap(filename, dtype=np.float32, mode='r+', shape=(self.world_size, size))
+        return self._tables[size]
+
+    def _sum(self, buffer):
+        table = self._table(buffer.size)
+        table[self.rank] = buffer
+        self.barrier.wait(self.timeout)
+        total = table.sum(axis=0)
+        self.barrier.wait(self.timeout)
+        return total
+
+    def _broadcast(self, buffer):
+        table = self._table(buffer.size)
+        if self.rank == 0:
+            table[0] = buffer
+        self.barrier.wait(self.timeout)
+        result = np.array(table[0])
+        self.barrier.wait(self.timeout)
+        return result
+
+    def close(self):
+        self._tables = {}
+
+class SocketAllReduce(AllReduce):
+    """ Exchanges buffers over TCP, with the first worker summing and sending back the total.
+
+    prepare listens on the loopback interface; on several machines every worker gets the
+    address of the first one instead.
+
+    # Arguments
+        address : (host, port) the first worker listens on.
+        timeout : Seconds to wait for the other workers before giving up.
+    """
+    def __init__(self, rank, world_size, address, timeout=600):
+        super(SocketAllReduce, self).__init__(rank, world_size)
+        self.address = tuple(address)
+        self.timeout = timeout
+        self.peers   = []
+
+        if rank == 0:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.settimeout(timeout)
+            server.bind(self.address)
+            server.listen(world_size)
+
+            peers = {}
+            while len(peers) < world_size - 1:
+                connection, _ = server.accept()
+                connection.settimeout(timeout)
+                peers[struct.unpack('!I', self._receive(connection, 4))[0]] = connection
+            server.close()
+            self.peers = [peers[peer_rank] for peer_rank in sorted(peers)]
+        else:
+            self.peers = [self._connect()]
+            self.peers[0].sendall(struct.pack('!I', rank))
+
+        for peer in self.peers:
+            peer.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @classmethod
+    @contextmanager
+    def prepare(cls, context, world_size):
+        # a free port: taken again by the first worker, so a port grabbed in between fails the run loudly
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(('127.0.0.1', 0))
+        address = probe.getsockname()
+        probe.close()
+        yield {'address': address}
+
+    def _connect(self):
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                return socket.create_connection(self.address, timeout=self.timeout)
+            except ConnectionRefusedError:
+                # the first worker is not listening yet
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    @staticmethod
+    def _receive(connection, size):
+        data = bytearray(size)
+        view, received = memoryview(data), 0
+        while received < size:
+            count = connection.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError('a data-parallel worker disconnected')
+            received += count
+        return data
+
+    def _send_buffer(self, connection, buffer):
+        connection.sendall(buffer.tobytes())
+
+    def _receive_buffer(self, connection, size):
+        return np.frombuffer(self._receive(connection, size * 4), dtype=np.float32)
+
+    def _sum(self, buffer):
+        if self.rank == 0:
+            total = buffer.copy()
+            for peer in self.peers:
+                total += self._receive_buffer(peer, buffer.size)
+            for peer in self.peers:
+                self._send_buffer(peer, total)
+            return total
+
+        self._send_buffer(self.peers[0], buffer)
+        return self._receive_buffer(self.peers[0], buffer.size)
+
+    def _broadcast(self, buffer):
+        if self.rank == 0:
+            for peer in self.peers:
+                self._send_buffer(peer, buffer)
+            return buffer
+
+        return self._receive_buffer(self.peers[0], buffer.size)
+
+    def close(self):
+        for peer in self.peers:
+            peer.close()
+        self.peers = []
+
+BACKENDS = {
+    'shared_memory': SharedMemoryAllReduce,
+    'socket':        SocketAllReduce,
+}
+
+def shard(instances, rank, world_size):
+    """ The instances of one worker. Every worker gets the same number of them, so that
+    all of them run the same number of steps per epoch; up to world_size - 1 are dropped. """
+    return instances[rank::world_size][:len(instances) // world_size]
+
+def _run_worker(worker, rank, world_size, backend, backend_kwargs, device, connection, args, kwargs):
+    if device is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = device
+
+    allreduce = BACKENDS[backend](rank, world_size, **backend_kwargs)
+    try:
+        connection.send(worker(*args, rank=rank, world_size=world_size, allreduce=allreduce, **kwargs))
+    finally:
+        allreduce.close()
+        connection.close()
+
+def launch(worker, world_size, backend='shared_memory', devices=None, args=(), kwargs=None):
+    """ Runs worker(*args, rank=rank, world_size=world_size, allreduce=allreduce, **kwargs) in
+    world_size fresh processes and returns their results, ordered by rank.
+
+    If a worker fails, the others are terminated rather than left waiting for it.
+
+    # Arguments
+        worker      : A function importable by the worker processes.
+        backend     : Name of the AllReduce backend, a key of BACKENDS.
+        devices     : CUDA_VISIBLE_DEVICES of every worker, by rank, e.g. ['0', '1'] for a
+                      GPU each or [''] * world_size for CPU only. Inherited if None.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = [None] * world_size
+
+    with BACKENDS[backend].prepare(context, world_size) as backend_kwargs:
+        processes, readers = {}, {}
+        for rank in range(world_size):
+            reader, writer = context.Pipe(duplex=False)
+            device = None if devices is None else devices[rank % len(devices)]
+            process = context.Process(target=_run_worker, name='DataParallelWorker-%d' % rank,
+                                      args=(worker, rank, world_size, backend, backend_kwargs, device, writer, args, kwargs or {}))
+            process.start()
+            writer.close()
+
+            processes[process.sentinel] = (rank, process)
+            readers[reader] = rank
+
+        try:
+            while processes:
+                for ready in wait(list(processes) + list(readers)):
+                    if ready in readers:
+                        rank = readers.pop(ready)
+                        try:
+                            results[rank] = ready.recv()
+                        except EOFError:
+                            pass
+                        continue
+
+                    rank, process = processes.pop(ready)
+                    process.join()
+                    if process.exitcode != 0:
+                        raise RuntimeError('data-parallel worker %d exited with code %d' % (rank, process.exitcode))
+
+            for reader, rank in readers.items():
+                if reader.poll():
+                    results[rank] = reader.recv()
+        finally:
+            for _, process in processes.values():
+                process.terminate()
+                process.join()
+
+    return results
@@ -0,0 +1,115 @@
+import time
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+from queue import Queue, Empty
+import numpy as np
+
+class DynamicBatcher:
+    """ Coalesces concurrent requests into batches for a single worker thread.
+
+    The worker waits for a first item, then keeps collecting items until either
+    max_batch_size items are queued or max_latency seconds have passed since the first
+    one arrived, and hands the whole batch to predict_fn.
+
+    # Arguments
+        predict_fn      : Function mapping a list of items to a list of results of the same length.
+        max_batch_size  : The largest batch passed to predict_fn.
+        max_latency     : Maximum time in seconds the first item of a batch waits for company.
+        history         : Number of recent request latencies kept for percentiles.
+    """
+    def __init__(self, predict_fn, max_batch_size=8, max_latency=0.01, history=10000):
+        self.predict_fn     = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency    = max_latency
+
+        self.queue          = Queue()
+        self.batch_sizes    = Counter()
+        self.latencies      = deque(maxlen=history)
+        self.requests       = 0
+        self.errors         = 0
+
+        self._lock          = threading.Lock()
+        self._stopped       = threading.Event()
+        self._thread        = threading.Thread(target=self._run, name='DynamicBatcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _collect(self):
+        try:
+            batch = [self.queue.get(timeout=0.1)]
+        except Empty:
+            return []
+
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0: break
+
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if len(batch) == 0: continue
+
+            # drop requests whose caller already gave up
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if len(batch) == 0: continue
+
+            try:
+                results = self.predict_fn([item for item, _, _ in batch])
+            except Exception as e:
+                with self._lock:
+                    self.errors += len(batch)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for (_, future, submitted), result in zip(batch, results):
+                future.set_result(result)
+
+            with self._lock:
+                self.requests += len(batch)
+                self.batch_sizes[len(batch)] += 1
+                self.latencies.extend(done - submitted for _, _, submitted in batch)
+
+    def metrics(self):
+        with self._lock:
+            latencies   = np.array(self.latencies)
+            batch_sizes = dict(self.batch_sizes)
+            requests    = self.requests
+            errors      = self.errors
+
+        metrics = {
+            'queue_depth':    self.queue.qsize(),
+            'requests':       requests,
+            'errors':         errors,
+            'batch_sizes':    {str(size): count for size, count in sorted(batch_sizes.items())},
+            'latency_ms':     {}
+        }
+        if len(latencies) > 0:
+            for p in [50, 90, 95, 99]:
+                metrics['latency_ms']['p%d' % p] = float(np.percentile(latencies, p) * 1e3)
+
+        return metrics
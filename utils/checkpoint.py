@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+from collections import defaultdict, deque
+import numpy as np
+import h5py
+import keras
+from keras import backend as K
+from keras.utils.io_utils import H5Dict
+from .precision import plain_model_config
+
+def _json_type(obj):
+    # as keras.engine.saving does for model.save
+    if hasattr(obj, 'get_config'):
+        return {'class_name': obj.__class__.__name__, 'config': obj.get_config()}
+    if type(obj).__module__ == np.__name__:
+        return obj.tolist() if isinstance(obj, np.ndarray) else obj.item()
+    if callable(obj) or type(obj).__name__ == type.__name__:
+        return obj.__name__
+    raise TypeError('Not JSON Serializable: %s' % (obj,))
+
+def _weights_group(layers, values):
+    group = {
+        'layer_names':   [layer.name.encode('utf8') for layer in layers],
+        'backend':       K.backend().encode('utf8'),
+        'keras_version': str(keras.__version__).encode('utf8')
+    }
+
+    offset = 0
+    for layer in layers:
+        layer_values = values[offset:offset + len(layer.weights)]
+        offset += len(layer.weights)
+
+        # weight names are made unique the way keras does
+        weight_names = []
+        for i, weight in enumerate(layer.weights):
+            name = str(weight.name) if getattr(weight, 'name', None) else 'param_' + str(i)
+            unique_name, suffix = name, 1
+            while unique_name.encode('utf8') in weight_names:
+                unique_name = name + '_' + str(suffix)
+                suffix += 1
+            weight_names.append(unique_name.encode('utf8'))
+
+        group[layer.name] = dict(zip(weight_names, layer_values))
+        group[layer.name]['weight_names'] = weight_names
+
+    return group
+
+def snapshot_model(model, weights_only=False):
+    """ Copy the weights of a model to memory, with everything else model.save (or
+    model.save_weights) would write, so that a CheckpointWriter can write them later while
+    training goes on.
+
+    The weights are read in a single session run. Optimizer state is not included, as
+    for the uncompiled template and inference models this repo saves.
+    """
+    values = K.batch_get_value(model.weights)
+    weights = _weights_group(model.layers, values)
+    if weights_only:
+        return weights
+
+    # mixed precision layers are saved as the Conv2D layers they are in float32
+    model_config = {'class_name': model.__class__.__name__, 'config': plain_model_config(model.get_config())}
+    return {
+        'keras_version': str(keras.__version__).encode('utf8'),
+        'backend':       K.backend().encode('utf8'),
+        'model_config':  json.dumps(model_config, default=_json_type).encode('utf-8'),
+        'model_weights': weights
+    }
+
+def snapshot_training_state(model, optimizer, state):
+    """ Copy the weights of model and of optimizer (e.g. the iterations and moments of Adam)
+    to memory, with state, a JSON-serializable dict of everything else training needs to
+    resume, for a CheckpointWriter to write with save_snapshot. See load_training_state.
+    """
+    values = K.batch_get_value(model.weights + optimizer.weights)
+    model_values, optimizer_values = values[:len(model.weights)], values[len(model.weights):]
+
+    # optimizer weight names contain slashes, which would make HDF5 groups
+    optimizer_weights = {'param_%d' % i: value for i, value in enumerate(optimizer_values)}
+    optimizer_weights['weight_names'] = [weight.name.encode('utf8') for weight in optimizer.weights]
+
+    return {
+        'keras_version':     str(keras.__version__).encode('utf8'),
+        'backend':           K.backend().encode('utf8'),
+        'model_weights':     _weights_group(model.layers, model_values),
+        'optimizer_weights': optimizer_weights,
+        'training_state':    np.frombuffer(json.dumps(state, default=_json_type).encode('utf8'), dtype=np.uint8)
+    }
+
+def read_training_state(filepath):
+    """ The state dict of a snapshot_training_state file, without loading any weights. """
+    with h5py.File(filepath, 'r') as handle:
+        return json.loads(handle['training_state'][()].tobytes().decode('utf8'))
+
+def load_training_state(model, optimizer, filepath):
+    """ Load the weights of model and optimizer from a snapshot_training_state file, and
+    return its state dict. The optimizer weights only exist once the training function of
+    the model is built, e.g. in on_train_begin of a callback.
+    """
+    model.load_weights(filepath)
+
+    with h5py.File(filepath, 'r') as handle:
+        group = handle['optimizer_weights']
+        values = [group['param_%d' % i][()] for i in range(sum(1 for name in group if name.startswith('param_')))]
+
+    if len(values) != len(optimizer.weights):
+        raise ValueError('The training state in %s has %d optimizer weights, the optimizer %d: '
+                         'it was saved with different optimizer settings.' % (filepath, len(values), len(optimizer.weights)))
+    K.batch_set_value(list(zip(optimizer.weights, values)))
+
+    return read_training_state(filepath)
+
+def _write_group(h5dict, group):
+    for key, value in group.items():
+        if isinstance(value, dict):
+            _write_group(h5dict[key], value)
+        else:
+            h5dict[key] = value
+
+def _layer_weights(snapshot):
+    weights = snapshot.get('model_weights', snapshot)
+    layer_names = [layer_name.decode('utf8') for layer_name in weights['layer_names']]
+    return {layer_name: [weights[layer_name][name] for name in weights[layer_name]['weight_names']] for layer_name in layer_names}
+
+def delta_path(filepath):
+    """ Where the weights-only delta of the checkpoint at filepath is written, see CheckpointWriter. """
+    root, ext = os.path.splitext(filepath)
+    return root + '.delta' + ext
+
+def write_snapshot(snapshot, filepath, attributes=None):
+    """ Write a snapshot_model snapshot to filepath, through a temporary file renamed over it
+    once complete, so that filepath always holds either the previous or the new checkpoint. """
+    temp_path = filepath + '.tmp'
+    with h5py.File(temp_path, 'w') as handle:
+        _write_group(H5Dict(handle), snapshot)
+        for name, value in (attributes or {}).items():
+            handle.attrs[name] = value
+
+    # on disk before the rename, or a crash could still leave an empty file behind
+    fd = os.open(temp_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(temp_path, filepath)
+
+def _base_path(delta):
+    # the full checkpoint a delta was written against, in the same directory
+    with h5py.File(delta, 'r') as partial:
+        base_name = partial.attrs['base_checkpoint_path']
+    if isinstance(base_name, bytes):
+        base_name = base_name.decode('utf8')
+    return os.path.join(os.path.dirname(delta), base_name)
+
+def load_checkpoint(model, filepath):
+    """ Load the weights of a checkpoint written by a CheckpointWriter into model, including
+    its delta if one was written since. A checkpoint of which only the delta was written,
+    e.g. of an epoch between full ones, is loaded from the full checkpoint it is a delta of. """
+    delta = delta_path(filepath)
+    if not os.path.exists(filepath) and os.path.exists(delta):
+        filepath = _base_path(delta)
+    model.load_weights(filepath)
+
+    if os.path.exists(delta):
+        with h5py.File(filepath, 'r') as full, h5py.File(delta, 'r') as partial:
+            checkpoint_id = full.attrs.get('checkpoint_id')
+            current = checkpoint_id is not None and checkpoint_id == partial.attrs.get('base_checkpoint_id')
+        if current:
+            model.load_weights(delta, by_name=True)
+
+class CheckpointWriter(object):
+    """ Writes model snapshots on a background thread.
+
+    save copies the weights to memory on the calling thread and returns; the file is
+    written by the writer thread. At most max_pending snapshots wait to be written: when
+    more arrive, save blocks until the oldest is written, which bounds the memory used.
+    Errors of the writer thread are raised by the next save or flush.
+
+    # Arguments
+        async_write     : Write on the background thread, or in save if False.
+        max_pending     : Number of snapshots waiting to be written at most.
+    """
+    def __init__(self, async_write=True, max_pending=2):
+        self.async_write = async_write
+        self.write_times = deque(maxlen=1000)
+
+        self._written     = defaultdict(deque)
+        self._dropped     = defaultdict(set)
+        self._bases       = {}
+        self._delta_bases = {}
+        self._error   = None
+
+        if async_write:
+            self._queue  = queue.Queue(maxsize=max_pending)
+            self._thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+            self._thread.start()
+
+    def save(self, model, filepath, weights_only=False, keep=None, group=None, full_every=1):
+        """ Save a checkpoint of model to filepath.
+
+        # Arguments
+            keep        : Number of most recent files of the same group kept, e.g. for a
+                          filepath formatted with the epoch. All are kept if None.
+            group       : Name of the set of files keep and full_every apply to, usually the
+                          unformatted filepath.
+            full_every  : Write a full checkpoint only every full_every saves of the same
+                          group, and in between only the layers changed since, as weights
+                          to delta_path(filepath). load_checkpoint applies them. With a
+                          filepath formatted with the epoch, the epochs in between only
+                          have their delta, against the file of the last full one.
+        """
+        self.save_snapshot(snapshot_model(model, weights_only), filepath, keep, group, full_every)
+
+    def save_snapshot(self, snapshot, filepath, keep=None, group=None, full_every=1):
+        """ Save a snapshot made with snapshot_model or snapshot_training_state, see save. """
+        self._raise_error()
+        job = (snapshot, filepath, keep, group or filepath, full_every)
+
+        if self.async_write:
+            self._queue.put(job)
+        else:
+            self._write(*job)
+
+    def flush(self):
+        """ Wait until every pending snapshot is written. """
+        if self.async_write:
+            self._queue.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._write(*job)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, snapshot, filepath, keep, group, full_every):
+        start = time.perf_counter()
+
+        # the chain of deltas is per group, so that it spans the files of a filepath formatted with the epoch
+        written = self._written[group]
+        base = self._bases.get(group)
+        if full_every > 1 and base is not None and base['saves'] % full_every != 0:
+            self._write_delta(snapshot, filepath, base)
+            self._delta_bases[filepath] = base['path']
+
+            # an older full checkpoint of the same name would be taken for the base of the delta
+            if filepath != base['path'] and os.path.exists(filepath):
+                os.remove(filepath)
+        else:
+            checkpoint_id = uuid.uuid4().hex
+            write_snapshot(snapshot, filepath, {'checkpoint_id': checkpoint_id})
+            if os.path.exists(delta_path(filepath)):
+                os.remove(delta_path(filepath))
+            self._delta_bases.pop(filepath, None)
+
+            base = None
+            if full_every > 1:
+                base = {'id': checkpoint_id, 'path': filepath, 'weights': _layer_weights(snapshot), 'saves': 0}
+            self._bases[group] = base
+        if base is not None:
+            base['saves'] += 1
+
+        # the rolling set of the group
+        if filepath in written:
+            written.remove(filepath)
+        written.append(filepath)
+        while keep is not None and len(written) > keep:
+            old_path = written.popleft()
+            if os.path.exists(delta_path(old_path)):
+                os.remove(delta_path(old_path))
+            self._delta_bases.pop(old_path, None)
+            self._dropped[group].add(old_path)
+
+        # a full checkpoint out of the rolling set stays as long as a delta in it, or the next one, needs it
+        needed = set(self._delta_bases[path] for path in written if path in self._delta_bases)
+        if base is not None:
+            needed.add(base['path'])
+        for old_path in list(self._dropped[group]):
+            if old_path not in needed and old_path not in written:
+                self._dropped[group].discard(old_path)
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+
+        self.write_times.append(time.perf_counter() - start)
+
+    def _write_delta(self, snapshot, filepath, base):
+        weights = snapshot.get('model_weights', snapshot)
+
+        changed = []
+        for layer_name, values in _layer_weights(snapshot).items():
+            if any(not np.array_equal(value, base_value) for value, base_value in zip(values, base['weights'][layer_name])):
+                changed.append(layer_name)
+
+        delta = {
+            'layer_names':   [layer_name.encode('utf8') for layer_name in changed],
+            'backend':       weights['backend'],
+            'keras_version': weights['keras_version']
+        }
+        delta.update((layer_name, weights[layer_name]) for layer_name in changed)
+
+        write_snapshot(delta, delta_path(filepath), {'base_checkpoint_id':   base['id'],
+                                                     'base_checkpoint_path': os.path.basename(base['path'])})
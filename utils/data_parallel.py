@@ -0,0 +1,74 @@
+import multiprocessing
+from contextlib import contextmanager
+from keras.optimizers import Optimizer
+from keras import backend as K
+import tensorflow as tf
+from .accumulation import GradientAccumulation
+
+class DataParallelOptimizer(Optimizer):
+    """ Wraps an optimizer to average the gradients of every batch over the workers of a
+    data-parallel run (see utils.allreduce.launch) before they are applied.
+
+    The gradients leave the graph once per batch, through the allreduce backend. Loss
+    scaling and gradient clipping of the wrapped optimizer apply to the averaged
+    gradients; batch normalization statistics stay local to every worker.
+
+    Around a GradientAccumulation, the gradients are only exchanged on the batches that
+    update the weights, once averaged over the accumulated batches, and its clipping
+    applies to the gradients of every worker and batch before that.
+
+    # Arguments
+        optimizer   : The optimizer to wrap, e.g. Adam, LossScaledAdam or GradientAccumulation.
+        allreduce   : The utils.allreduce.AllReduce of this worker.
+    """
+    def __init__(self, optimizer, allreduce, **kwargs):
+        super(DataParallelOptimizer, self).__init__(**kwargs)
+        self.optimizer  = optimizer
+        self.allreduce  = allreduce
+
+        self.iterations = optimizer.iterations
+        self.lr         = optimizer.lr
+
+    def _allreduce(self, grads):
+        averaged = tf.py_func(lambda *arrays: self.allreduce.allreduce(arrays), grads, [grad.dtype for grad in grads])
+        for grad, average in zip(grads, averaged):
+            average.set_shape(grad.get_shape())
+        return averaged
+
+    @contextmanager
+    def _averaged_gradients(self):
+        # the wrapped optimizer differentiates with K.gradients, whatever it does around it
+        gradients = K.gradients
+
+        K.gradients = lambda loss, variables: self._allreduce(gradients(loss, variables))
+        try:
+            yield
+        finally:
+            K.gradients = gradients
+
+    def get_gradients(self, loss, params):
+        with self._averaged_gradients():
+            return self.optimizer.get_gradients(loss, params)
+
+    def get_updates(self, loss, params):
+        if isinstance(self.optimizer, GradientAccumulation):
+            self.optimizer.reduce_gradients = self._allreduce
+            self.updates = self.optimizer.get_updates(loss, params)
+        else:
+            with self._averaged_gradients():
+                self.updates = self.optimizer.get_updates(loss, params)
+        self.weights = self.optimizer.weights
+        return self.updates
+
+    def get_config(self):
+        return self.optimizer.get_config()
+
+def broadcast_weights(model, allreduce):
+    """ Gives every worker the weights of the first one, so that they all start alike. """
+    model.set_weights(allreduce.broadcast(model.get_weights()))
+
+def limit_threads(world_size):
+    """ Shares the CPU cores between the workers instead of letting each of them take all. """
+    threads = max(1, multiprocessing.cpu_count() // world_size)
+    K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                                   inter_op_parallelism_threads=2)))
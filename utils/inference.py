@@ -0,0 +1,108 @@
+from keras.layers import Input
+from keras.models import Model
+import numpy as np
+
+class InferenceSession:
+    """ Wraps an inference model and keeps predict functions specialized to a fixed
+    (batch, net_h, net_w) input shape.
+
+    The models in yolo.py are built with Input(shape=(None, None, 3)), so every new
+    input resolution makes the backend re-plan the graph on the first call. A
+    session re-applies the model to a fully static Input per shape, so each
+    resolution is planned once and can be warmed up ahead of time.
+
+    Every specialization adds a copy of the model to the graph, which dropping it
+    would not free, so at most max_shapes are built and any other shape runs
+    through the model itself. A batch smaller than a cached one of the same input
+    size, e.g. the last one of a stream, is padded up to it instead.
+
+    # Arguments
+        model       : The inference model (e.g. infer_model from create_yolo_model or load_model).
+        max_shapes  : The maximum number of specialized shapes, e.g. every input size of a
+                      rectangular inference, see get_rect_net_size.
+    """
+    def __init__(self, model, max_shapes=4):
+        self.model      = model
+        self.max_shapes = max_shapes
+        self.channels   = model.input_shape[-1] or 3
+
+        self.hits       = 0
+        self.misses     = 0
+        self.padded     = 0
+        self.fallbacks  = 0
+
+        self._functions = {}
+
+    def _specialize(self, batch_size, net_h, net_w):
+        input_image = Input(batch_shape=(batch_size, net_h, net_w, self.channels))
+        outputs     = self.model(input_image)
+        if not isinstance(outputs, list):
+            outputs = [outputs]
+
+        function = Model(input_image, outputs)
+        function._make_predict_function()
+
+        return function
+
+    def get_function(self, batch_size, net_h, net_w):
+        """ The predict function of a shape, built on the first call, or None once
+        max_shapes are built.
+        """
+        key = (batch_size, net_h, net_w)
+
+        if key in self._functions:
+            self.hits += 1
+            return self._functions[key]
+
+        if len(self._functions) >= self.max_shapes:
+            return None
+
+        self.misses += 1
+        self._functions[key] = self._specialize(batch_size, net_h, net_w)
+        return self._functions[key]
+
+    def _padded_batch_size(self, batch_size, net_h, net_w):
+        # the smallest cached batch of the same input size that holds batch_size images
+        sizes = [size for size, h, w in self._functions if (h, w) == (net_h, net_w) and size > batch_size]
+        return min(sizes) if sizes else None
+
+    def warmup(self, shapes):
+        """ Build and run the predict functions for a list of (batch, net_h, net_w) shapes.
+        """
+        for batch_size, net_h, net_w in shapes:
+            function = self.get_function(batch_size, net_h, net_w)
+            if function is not None:
+                function.predict_on_batch(np.zeros((batch_size, net_h, net_w, self.channels)))
+
+    def predict_on_batch(self, batch_input):
+        batch_size, net_h, net_w = batch_input.shape[:3]
+
+        if (batch_size, net_h, net_w) not in self._functions:
+            padded_size = self._padded_batch_size(batch_size, net_h, net_w)
+            if padded_size is not None:
+                self.hits   += 1
+                self.padded += 1
+
+                padded = np.zeros((padded_size,) + batch_input.shape[1:], dtype=batch_input.dtype)
+                padded[:batch_size] = batch_input
+                outputs = self._functions[(padded_size, net_h, net_w)].predict_on_batch(padded)
+                return [output[:batch_size] for output in outputs] if isinstance(outputs, list) else outputs[:batch_size]
+
+        function = self.get_function(batch_size, net_h, net_w)
+        if function is None:
+            self.fallbacks += 1
+            return self.model.predict_on_batch(batch_input)
+
+        return function.predict_on_batch(batch_input)
+
+    def cached_shapes(self):
+        return list(self._functions.keys())
+
+    def stats(self):
+        return {
+            'hits':      self.hits,
+            'misses':    self.misses,
+            'padded':    self.padded,
+            'fallbacks': self.fallbacks,
+            'shapes':    self.cached_shapes()
+        }
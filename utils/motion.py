@@ -0,0 +1,161 @@
+import cv2
+import numpy as np
+from .utils import get_yolo_boxes
+from .tiling import merge_boxes
+
+class BackgroundModel:
+    """ Running-average background model on a downscaled gray frame.
+
+    # Arguments
+        alpha       : Weight of the newest frame in the running average.
+        diff_thresh : Gray level difference (0-255) above which a pixel counts as changed.
+        min_area    : Smallest changed region, in full resolution pixels, that is reported.
+        scale       : Downscale factor applied before differencing, the smaller the cheaper.
+    """
+    def __init__(self, alpha=0.05, diff_thresh=25, min_area=256, scale=0.25):
+        self.alpha       = alpha
+        self.diff_thresh = diff_thresh
+        self.min_area    = min_area
+        self.scale       = scale
+        self.background  = None
+
+    def apply(self, frame):
+        """ Update the model with a frame and return the changed regions as (x, y, w, h)
+        rectangles in frame coordinates.
+        """
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        gray  = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+            return []
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(gray, self.background, self.alpha)
+
+        mask = cv2.threshold(diff, self.diff_thresh, 255, cv2.THRESH_BINARY)[1]
+        mask = cv2.dilate(mask, None, iterations=2)
+
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+        regions = []
+        for contour in contours:
+            x, y, w, h = [int(v / self.scale) for v in cv2.boundingRect(contour)]
+            if w * h >= self.min_area:
+                regions.append((x, y, w, h))
+
+        return regions
+
+def merge_regions(regions, image_h, image_w, min_size=416, padding=32, downsample=32):
+    """ Grow changed regions into crops that suit the network: padded, at least
+    min_size on each side, sides rounded up to multiples of downsample and clipped to
+    the image. Overlapping crops are merged into their union until none overlap.
+    """
+    crops = []
+    for x, y, w, h in regions:
+        w_new = max(min_size, int(np.ceil((w + 2*padding) / float(downsample))) * downsample)
+        h_new = max(min_size, int(np.ceil((h + 2*padding) / float(downsample))) * downsample)
+        crops.append(_clip(x + w//2 - w_new//2, y + h//2 - h_new//2, w_new, h_new, image_h, image_w))
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(crops)):
+            for j in range(i + 1, len(crops)):
+                if _overlaps(crops[i], crops[j]):
+                    x0 = min(crops[i][0], crops[j][0])
+                    y0 = min(crops[i][1], crops[j][1])
+                    x1 = max(crops[i][0] + crops[i][2], crops[j][0] + crops[j][2])
+                    y1 = max(crops[i][1] + crops[i][3], crops[j][1] + crops[j][3])
+
+                    crops[i] = _clip(x0, y0, x1 - x0, y1 - y0, image_h, image_w)
+                    del crops[j]
+                    merged = True
+                    break
+            if merged: break
+
+    return crops
+
+def _clip(x, y, w, h, image_h, image_w):
+    w, h = min(w, image_w), min(h, image_h)
+    x = int(np.clip(x, 0, image_w - w))
+    y = int(np.clip(y, 0, image_h - h))
+    return (x, y, w, h)
+
+def _overlaps(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def _box_in_regions(box, regions):
+    return any(_overlaps((box.xmin, box.ymin, box.xmax - box.xmin, box.ymax - box.ymin), region) for region in regions)
+
+class MotionGatedDetector:
+    """ Detector for static cameras that only runs the network on regions that changed.
+
+    Boxes from earlier frames that do not touch a changed region are kept as they are.
+    Changed regions are grown into net-friendly crops, batched through the model and
+    mapped back through the letterbox correction of get_yolo_boxes. If the changed crops
+    cover more than full_frame_ratio of the frame, or every refresh_every frames, the
+    full frame is processed instead.
+
+    # Arguments
+        model            : The inference model.
+        net_size         : The square network input size used for crops and full frames.
+        batch_size       : Number of crops per predict_on_batch call.
+        background       : A BackgroundModel; a default one is created if None.
+    """
+    def __init__(self, model, anchors, obj_thresh, nms_thresh, net_size=416, batch_size=4,
+                 full_frame_ratio=0.5, refresh_every=300, background=None):
+        self.model            = model
+        self.anchors          = anchors
+        self.obj_thresh       = obj_thresh
+        self.nms_thresh       = nms_thresh
+        self.net_size         = net_size
+        self.batch_size       = batch_size
+        self.full_frame_ratio = full_frame_ratio
+        self.refresh_every    = refresh_every
+        self.background       = background or BackgroundModel()
+
+        self.boxes            = []
+        self.frames           = 0
+        self.detections       = 0
+        self.crops            = 0
+
+    def _detect(self, images):
+        self.detections += 1
+        return get_yolo_boxes(self.model, images, self.net_size, self.net_size, self.anchors, self.obj_thresh, self.nms_thresh)
+
+    def __call__(self, frame):
+        image_h, image_w = frame.shape[:2]
+        regions = self.background.apply(frame)
+        refresh = self.frames % self.refresh_every == 0
+        self.frames += 1
+
+        if not refresh and len(regions) == 0:
+            return self.boxes
+
+        crops = merge_regions(regions, image_h, image_w, self.net_size)
+
+        if refresh or sum(w * h for _, _, w, h in crops) > self.full_frame_ratio * image_h * image_w:
+            self.boxes = [box for box in self._detect([frame])[0] if box.get_score() > self.obj_thresh]
+            return self.boxes
+
+        boxes = [box for box in self.boxes if not _box_in_regions(box, crops)]
+
+        for i in range(0, len(crops), self.batch_size):
+            batch = crops[i:i + self.batch_size]
+            batch_boxes = self._detect([frame[y:y+h, x:x+w] for x, y, w, h in batch])
+            self.crops += len(batch)
+
+            for (x, y, _, _), crop_boxes in zip(batch, batch_boxes):
+                for box in crop_boxes:
+                    if box.get_score() <= self.obj_thresh: continue
+
+                    box.xmin += x
+                    box.xmax += x
+                    box.ymin += y
+                    box.ymax += y
+                    boxes.append(box)
+
+        self.boxes = merge_boxes(boxes, 0.6)
+
+        return self.boxes
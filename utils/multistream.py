@@ -0,0 +1,166 @@
+import time
+import threading
+from collections import deque
+import cv2
+from .utils import get_yolo_boxes
+
+class StreamReader(threading.Thread):
+    """ Decodes one video source on its own thread into a small buffer.
+
+    When the buffer is full the oldest frame is dropped, so a stream that inference
+    cannot keep up with stays current instead of falling further behind.
+
+    # Arguments
+        source      : A video file path, URL, or device index.
+        buffer_size : Number of decoded frames kept waiting for inference.
+        pace        : Read files at their native frame rate instead of as fast as possible,
+                      as a live camera would deliver them.
+    """
+    def __init__(self, stream_id, source, buffer_size=2, pace=True):
+        super(StreamReader, self).__init__(name='StreamReader-%d' % stream_id, daemon=True)
+        self.stream_id   = stream_id
+        self.source      = source
+        self.pace        = pace
+
+        self.frames      = deque(maxlen=buffer_size)
+        self.decoded     = 0
+        self.dropped     = 0
+        self.finished    = False
+        self.frame_size  = None
+        self.fps         = None
+
+        self._lock       = threading.Lock()
+        self._stopped    = threading.Event()
+
+    def run(self):
+        video_reader = cv2.VideoCapture(self.source)
+        self.fps        = video_reader.get(cv2.CAP_PROP_FPS) or 25.
+        self.frame_size = (int(video_reader.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video_reader.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        interval        = 1. / self.fps if self.pace and not isinstance(self.source, int) else 0.
+        next_frame      = time.perf_counter()
+
+        while not self._stopped.is_set():
+            ret_val, frame = video_reader.read()
+            if not ret_val: break
+
+            with self._lock:
+                if len(self.frames) == self.frames.maxlen:
+                    self.dropped += 1
+                self.frames.append((self.decoded, frame))
+                self.decoded += 1
+
+            if interval > 0:
+                next_frame += interval
+                time.sleep(max(0., next_frame - time.perf_counter()))
+
+        video_reader.release()
+        self.finished = True
+
+    def stop(self):
+        self._stopped.set()
+
+    def get(self):
+        """ Return the oldest buffered (frame_index, frame), or None if nothing is buffered.
+        """
+        with self._lock:
+            if len(self.frames) == 0: return None
+            return self.frames.popleft()
+
+    def exhausted(self):
+        return self.finished and len(self.frames) == 0
+
+class RoundRobinScheduler:
+    """ Assembles cross-stream batches fairly: each tick takes at most frames_per_stream
+    frames from every stream, starting from a different stream every time, until
+    max_batch_size is reached.
+    """
+    def __init__(self, readers, max_batch_size=8, frames_per_stream=1):
+        self.readers           = readers
+        self.max_batch_size    = max_batch_size
+        self.frames_per_stream = frames_per_stream
+        self.offset            = 0
+
+    def next_batch(self):
+        batch = []
+        count = len(self.readers)
+
+        for i in range(count):
+            reader = self.readers[(self.offset + i) % count]
+
+            for _ in range(self.frames_per_stream):
+                if len(batch) == self.max_batch_size: break
+
+                item = reader.get()
+                if item is None: break
+                batch.append((reader.stream_id, item[0], item[1]))
+
+        self.offset = (self.offset + 1) % max(count, 1)
+
+        return batch
+
+class MultiStreamRunner:
+    """ Runs one predict_on_batch per tick over frames gathered from several streams and
+    hands each result to on_result(stream_id, frame_index, frame, boxes).
+
+    # Arguments
+        sources         : List of video file paths, URLs or device indices.
+        on_result       : Callback receiving the detections of every processed frame.
+        max_batch_size  : Largest cross-stream batch.
+        buffer_size     : Frames buffered per stream before the oldest are dropped.
+        pace            : See StreamReader.
+    """
+    def __init__(self, model, sources, anchors, net_h, net_w, obj_thresh, nms_thresh, on_result,
+                 max_batch_size=8, frames_per_stream=1, buffer_size=2, pace=True):
+        self.model      = model
+        self.anchors    = anchors
+        self.net_h      = net_h
+        self.net_w      = net_w
+        self.obj_thresh = obj_thresh
+        self.nms_thresh = nms_thresh
+        self.on_result  = on_result
+
+        self.readers    = [StreamReader(i, source, buffer_size, pace) for i, source in enumerate(sources)]
+        self.scheduler  = RoundRobinScheduler(self.readers, max_batch_size, frames_per_stream)
+        self.processed  = [0] * len(self.readers)
+        self.batches    = 0
+
+    def run(self, duration=None):
+        """ Process until every stream is exhausted, or for duration seconds.
+        Returns the statistics of the run.
+        """
+        for reader in self.readers:
+            reader.start()
+
+        start = time.perf_counter()
+        try:
+            while not all(reader.exhausted() for reader in self.readers):
+                if duration is not None and time.perf_counter() - start > duration: break
+
+                batch = self.scheduler.next_batch()
+                if len(batch) == 0:
+                    time.sleep(0.001)
+                    continue
+
+                batch_boxes = get_yolo_boxes(self.model, [frame for _, _, frame in batch],
+                                             self.net_h, self.net_w, self.anchors, self.obj_thresh, self.nms_thresh)
+                self.batches += 1
+
+                for (stream_id, frame_index, frame), boxes in zip(batch, batch_boxes):
+                    self.processed[stream_id] += 1
+                    self.on_result(stream_id, frame_index, frame, boxes)
+        finally:
+            for reader in self.readers:
+                reader.stop()
+
+        return self.stats(time.perf_counter() - start)
+
+    def stats(self, elapsed):
+        return {
+            'seconds':       elapsed,
+            'batches':       self.batches,
+            'aggregate_fps': sum(self.processed) / max(elapsed, 1e-9),
+            'streams':       [{'source':    reader.source,
+                               'processed': self.processed[reader.stream_id],
+                               'decoded':   reader.decoded,
+                               'dropped':   reader.dropped} for reader in self.readers]
+        }
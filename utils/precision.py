@@ -0,0 +1,92 @@
+from keras.layers import Conv2D
+from keras.optimizers import Adam, clip_norm
+from keras import backend as K
+
+class MixedPrecisionConv2D(Conv2D):
+    """ A Conv2D that keeps its weights in float32 but convolves in a reduced precision.
+
+    The inputs and weights are cast to compute_dtype for the convolution and the result
+    is cast back to float32, so the layers around it (batch normalization in particular)
+    and the optimizer only ever see float32 tensors.
+
+    Its config is the one of a Conv2D, without compute_dtype, and utils.checkpoint saves
+    models through plain_model_config: a saved model loads with keras.models.load_model
+    without custom objects and runs in float32.
+
+    # Arguments
+        compute_dtype   : 'float16' or 'bfloat16'.
+    """
+    def __init__(self, *args, compute_dtype='float16', **kwargs):
+        super(MixedPrecisionConv2D, self).__init__(*args, **kwargs)
+        self.compute_dtype = compute_dtype
+
+    def call(self, inputs):
+        outputs = K.conv2d(
+            K.cast(inputs, self.compute_dtype),
+            K.cast(self.kernel, self.compute_dtype),
+            strides=self.strides,
+            padding=self.padding,
+            data_format=self.data_format,
+            dilation_rate=self.dilation_rate)
+
+        if self.use_bias:
+            outputs = K.bias_add(
+                outputs,
+                K.cast(self.bias, self.compute_dtype),
+                data_format=self.data_format)
+
+        outputs = K.cast(outputs, 'float32')
+
+        if self.activation is not None:
+            return self.activation(outputs)
+        return outputs
+
+def plain_model_config(config):
+    """ The config of a model, as from model.get_config, with its MixedPrecisionConv2D
+    layers turned into plain Conv2D layers, nested models included.
+    """
+    if isinstance(config, list):
+        return [plain_model_config(value) for value in config]
+    if not isinstance(config, dict):
+        return config
+
+    config = {key: plain_model_config(value) for key, value in config.items()}
+    if config.get('class_name') == MixedPrecisionConv2D.__name__:
+        config['class_name'] = Conv2D.__name__
+    return config
+
+class LossScaledAdam(Adam):
+    """ Adam with a static loss scale, for training layers that compute in float16.
+
+    The loss is multiplied by loss_scale before differentiation, so that small gradients
+    do not underflow in float16, and the float32 gradients are divided by it again before
+    clipping and the update.
+
+    # Arguments
+        loss_scale  : The loss multiplier, a power of two. 1 disables scaling, which is
+                      enough for bfloat16 since it has the exponent range of float32.
+    """
+    def __init__(self, loss_scale=128., **kwargs):
+        super(LossScaledAdam, self).__init__(**kwargs)
+        self.loss_scale = float(loss_scale)
+
+    def get_gradients(self, loss, params):
+        grads = K.gradients(loss * self.loss_scale, params)
+        if None in grads:
+            raise ValueError('An operation has `None` for gradient.')
+
+        grads = [grad / self.loss_scale for grad in grads]
+
+        # clip after unscaling, so that clipnorm and clipvalue keep their usual meaning
+        if getattr(self, 'clipnorm', 0) > 0:
+            norm = K.sqrt(sum([K.sum(K.square(grad)) for grad in grads]))
+            grads = [clip_norm(grad, self.clipnorm, norm) for grad in grads]
+        if getattr(self, 'clipvalue', 0) > 0:
+            grads = [K.clip(grad, -self.clipvalue, self.clipvalue) for grad in grads]
+
+        return grads
+
+    def get_config(self):
+        config = super(LossScaledAdam, self).get_config()
+        config['loss_scale'] = self.loss_scale
+        return config
@@ -0,0 +1,138 @@
+import time
+import json
+import threading
+from collections import defaultdict, deque
+import numpy as np
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name     = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class Profiler:
+    """ Collects per-stage wall times and item counts.
+
+    While disabled, stage() returns a shared no-op context manager and count() returns
+    immediately, so the instrumentation can stay in hot loops.
+
+        with profiler.stage('predict_on_batch'):
+            batch_output = model.predict_on_batch(batch_input)
+
+    # Arguments
+        enabled : Whether to record anything.
+        history : Number of most recent samples per stage kept for percentiles.
+    """
+    def __init__(self, enabled=False, history=100000):
+        self.enabled = enabled
+        self.history = history
+        self.reset()
+
+    def reset(self):
+        self._lock    = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.history))
+        self._totals  = defaultdict(float)
+        self._calls   = defaultdict(int)
+        self._counts  = defaultdict(int)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples[name].append(seconds)
+            self._totals[name] += seconds
+            self._calls[name]  += 1
+
+    def count(self, name, value):
+        """ Add value to the item counter of a stage, e.g. the number of boxes it produced.
+        """
+        if not self.enabled: return
+        with self._lock:
+            self._counts[name] += value
+
+    def summary(self):
+        with self._lock:
+            names   = list(self._calls.keys()) + [name for name in self._counts if name not in self._calls]
+            summary = {}
+
+            for name in names:
+                samples = np.array(self._samples[name]) if name in self._samples else np.zeros(0)
+                stats   = {
+                    'calls':    self._calls.get(name, 0),
+                    'total_s':  self._totals.get(name, 0.),
+                    'items':    self._counts.get(name, 0)
+                }
+                if len(samples) > 0:
+                    stats['mean_ms'] = float(np.mean(samples) * 1e3)
+                    for p in [50, 95, 99]:
+                        stats['p%d_ms' % p] = float(np.percentile(samples, p) * 1e3)
+                summary[name] = stats
+
+        return summary
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=4, sort_keys=True)
+
+    def to_prometheus(self, prefix='yolo'):
+        lines = [
+            '# TYPE %s_stage_seconds summary' % prefix,
+            '# TYPE %s_stage_items_total counter' % prefix
+        ]
+
+        for name, stats in sorted(self.summary().items()):
+            for p in [50, 95, 99]:
+                if 'p%d_ms' % p in stats:
+                    lines.append('%s_stage_seconds{stage="%s",quantile="0.%d"} %.9f' % (prefix, name, p, stats['p%d_ms' % p] / 1e3))
+            lines.append('%s_stage_seconds_sum{stage="%s"} %.9f' % (prefix, name, stats['total_s']))
+            lines.append('%s_stage_seconds_count{stage="%s"} %d' % (prefix, name, stats['calls']))
+            lines.append('%s_stage_items_total{stage="%s"} %d' % (prefix, name, stats['items']))
+
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        summary = self.summary()
+        total   = sum(stats['total_s'] for stats in summary.values()) or 1.
+
+        lines = ['%-20s %8s %10s %6s %9s %9s %9s %9s' % ('stage', 'calls', 'total s', '%', 'p50 ms', 'p95 ms', 'p99 ms', 'items')]
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]['total_s']):
+            lines.append('%-20s %8d %10.3f %6.1f %9.3f %9.3f %9.3f %9d' % (
+                name, stats['calls'], stats['total_s'], 100. * stats['total_s'] / total,
+                stats.get('p50_ms', 0.), stats.get('p95_ms', 0.), stats.get('p99_ms', 0.), stats['items']))
+
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """ Write the summary to path, in Prometheus text format if it ends with .prom, JSON otherwise.
+        """
+        with open(path, 'w') as handle:
+            handle.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+# the profiler used by the inference path, disabled unless a script turns it on
+profiler = Profiler()
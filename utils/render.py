@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+from .colors import get_color
+
+def boxes_to_columns(boxes, obj_thresh):
+    """ Convert a list of BoundBox into columnar arrays, keeping boxes scoring above obj_thresh.
+
+    # Returns
+        A dict with 'coords' (N, 4) int32 xmin, ymin, xmax, ymax, 'labels' (N,) int32
+        and 'scores' (N,) float32.
+    """
+    boxes = [box for box in boxes if box.get_score() > obj_thresh]
+
+    if len(boxes) == 0:
+        return {'coords': np.zeros((0, 4), dtype=np.int32),
+                'labels': np.zeros((0,), dtype=np.int32),
+                'scores': np.zeros((0,), dtype=np.float32)}
+
+    return {'coords': np.array([[box.xmin, box.ymin, box.xmax, box.ymax] for box in boxes], dtype=np.int32),
+            'labels': np.array([box.get_label() for box in boxes], dtype=np.int32),
+            'scores': np.array([box.get_score() for box in boxes], dtype=np.float32)}
+
+class BoxRenderer:
+    """ Draws detections from columnar arrays, as a faster replacement for draw_boxes.
+
+    Colors are looked up once per label. The text of every label and of every whole
+    percentage is rasterized once per font scale, and the resulting colored label
+    sprites are cached and pasted with numpy slicing. Box outlines are drawn with
+    slice assignments too. Unlike draw_boxes, only the best label of each box is written.
+
+    # Arguments
+        labels          : The label names.
+        thickness       : Box outline thickness at full resolution.
+        preview_scale   : If set, render() draws into a copy of the image downscaled by this
+                          factor instead of into the full resolution image.
+    """
+    def __init__(self, labels, thickness=5, preview_scale=None):
+        self.labels        = labels
+        self.thickness     = thickness
+        self.preview_scale = preview_scale
+        self.colors        = np.array([get_color(i) for i in range(len(labels))], dtype=np.uint8)
+        self._masks        = {}
+        self._sprites      = {}
+
+    def _text_mask(self, text, font_scale):
+        key = (text, font_scale)
+
+        if key not in self._masks:
+            (width, height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 2)
+            canvas = np.zeros((height + baseline + 4, width + 4), dtype=np.uint8)
+            cv2.putText(canvas, text, (2, height + 2), cv2.FONT_HERSHEY_SIMPLEX, font_scale, 255, 2)
+            self._masks[key] = canvas > 0
+
+        return self._masks[key]
+
+    def _label_sprite(self, label, score, font_scale):
+        percent = int(round(score * 100))
+        key     = (label, percent, font_scale)
+
+        if key not in self._sprites:
+            name  = self._text_mask(self.labels[label] + ' ', font_scale)
+            value = self._text_mask('%d%%' % percent, font_scale)
+
+            mask = np.zeros((max(name.shape[0], value.shape[0]), name.shape[1] + value.shape[1]), dtype=bool)
+            mask[:name.shape[0], :name.shape[1]] = name
+            mask[:value.shape[0], name.shape[1]:] = value
+
+            sprite = np.empty(mask.shape + (3,), dtype=np.uint8)
+            sprite[:] = self.colors[label]
+            sprite[mask] = 0
+            self._sprites[key] = sprite
+
+        return self._sprites[key]
+
+    def render(self, image, columns):
+        """ Draw the detections of boxes_to_columns onto the image.
+
+        # Returns
+            The image drawn into: the image itself, or a downscaled copy when preview_scale is set.
+        """
+        coords, labels, scores = columns['coords'], columns['labels'], columns['scores']
+        scale = 1.
+
+        if self.preview_scale is not None:
+            scale  = self.preview_scale
+            image  = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            coords = (coords * scale).astype(np.int32)
+
+        image_h, image_w = image.shape[:2]
+        if len(coords) == 0: return image
+
+        thickness  = max(1, int(round(self.thickness * scale)))
+        font_scale = round(1e-3 * image_h, 2)
+
+        coords = coords.copy()
+        coords[:, [0, 2]] = np.clip(coords[:, [0, 2]], 0, image_w - 1)
+        coords[:, [1, 3]] = np.clip(coords[:, [1, 3]], 0, image_h - 1)
+        colors = self.colors[labels]
+
+        for (xmin, ymin, xmax, ymax), color in zip(coords.tolist(), colors):
+            image[ymin:ymin+thickness, xmin:xmax+1] = color
+            image[max(ymax-thickness+1, 0):ymax+1, xmin:xmax+1] = color
+            image[ymin:ymax+1, xmin:xmin+thickness] = color
+            image[ymin:ymax+1, max(xmax-thickness+1, 0):xmax+1] = color
+
+        # labels are drawn after all outlines so that they stay readable
+        for (xmin, ymin, _, _), label, score in zip(coords.tolist(), labels.tolist(), scores.tolist()):
+            sprite = self._label_sprite(label, score, font_scale)
+            sprite_h, sprite_w = sprite.shape[:2]
+
+            y0 = max(ymin - sprite_h, 0)
+            x0 = min(xmin, max(image_w - sprite_w, 0))
+            region = image[y0:y0+sprite_h, x0:x0+sprite_w]
+
+            region[:] = sprite[:region.shape[0], :region.shape[1]]
+
+        return image
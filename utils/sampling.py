@@ -0,0 +1,311 @@
+import threading
+from collections import Counter
+import numpy as np
+
+def image_stats(instance):
+    """ The statistics of an image the samplers look at, computed by voc.parse_voc_annotation
+    at parse time and kept in instance['stats'].
+    """
+    objects = instance['object']
+    image_area = float(max(instance['width'] * instance['height'], 1))
+    box_areas  = [(obj['xmax'] - obj['xmin']) * (obj['ymax'] - obj['ymin']) / image_area for obj in objects] or [0.]
+
+    return {
+        'num_objects':      len(objects),
+        'class_counts':     dict(Counter(obj['name'] for obj in objects)),
+        'box_area_min':     min(box_areas),
+        'box_area_mean':    sum(box_areas) / len(box_areas),
+        'box_area_max':     max(box_areas),
+        'aspect':           instance['width'] / float(max(instance['height'], 1))
+    }
+
+class ImageIndex(object):
+    """ The image_stats of a list of instances as arrays, one row per image in the order of
+    the instances. The stats are read from instance['stats'] when parsed with them, and
+    computed otherwise.
+
+    # Arguments
+        instances   : The images, as parsed by voc.parse_voc_annotation.
+        labels      : The columns of class_counts, the classes of the images if None.
+    """
+    def __init__(self, instances, labels=None):
+        stats = [instance.get('stats') or image_stats(instance) for instance in instances]
+
+        self.labels         = list(labels) if labels else sorted(set(name for stat in stats for name in stat['class_counts']))
+        self.num_objects    = np.array([stat['num_objects'] for stat in stats], dtype=np.int64)
+        self.class_counts   = np.array([[stat['class_counts'].get(name, 0) for name in self.labels] for stat in stats],
+                                       dtype=np.int64).reshape(len(stats), len(self.labels))
+        self.box_area_min   = np.array([stat['box_area_min'] for stat in stats])
+        self.box_area_mean  = np.array([stat['box_area_mean'] for stat in stats])
+        self.box_area_max   = np.array([stat['box_area_max'] for stat in stats])
+        self.aspect         = np.array([stat['aspect'] for stat in stats])
+
+    def __len__(self):
+        return len(self.num_objects)
+
+    def rarity(self, power, per_object=False):
+        """ (1 / (num_classes * share))**power for the rarest class of every image, share being
+        the number of images with that class, or of its objects if per_object, over the sum of
+        that number over all classes, and 1 for images without objects.
+        """
+        has_class = self.class_counts > 0
+        counts    = (self.class_counts if per_object else has_class).sum(axis=0).astype(np.float64)
+        present   = counts > 0
+
+        weights = np.zeros(len(self.labels))
+        weights[present] = (counts.sum() / (present.sum() * counts[present]))**power
+
+        rarity = np.where(has_class, weights, 0.).max(axis=1) if len(self.labels) else np.zeros(len(self))
+        return np.where(has_class.any(axis=1), rarity, 1.)
+
+class SumTree(object):
+    """ Non-negative priorities in the leaves of a binary tree whose every node holds the
+    sum of its children, so that indices are drawn with probability proportional to their
+    priority, and priorities are updated, in O(log n).
+
+    # Arguments
+        size    : Number of priorities, all 0 at first.
+    """
+    def __init__(self, size):
+        self.size     = size
+        self.capacity = 2
+        while self.capacity < size:
+            self.capacity *= 2
+
+        # node 1 is the root, the children of node i are 2i and 2i+1, the leaves start at capacity
+        self.nodes = np.zeros(2*self.capacity)
+
+    def total(self):
+        return self.nodes[1]
+
+    def get(self, indices):
+        return self.nodes[self.capacity + np.asarray(indices, dtype=np.int64)]
+
+    def update(self, indices, priorities):
+        nodes = self.capacity + np.asarray(indices, dtype=np.int64).reshape(-1)
+        if len(nodes) == 0:
+            return
+        self.nodes[nodes] = priorities
+
+        # one level up at a time, every changed node once
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2*nodes] + self.nodes[2*nodes + 1]
+
+    def sample(self, count, rng=np.random):
+        if count == 0:
+            return np.zeros((0,), dtype=np.int64)
+
+        values = rng.uniform(0, self.total(), count)
+        nodes  = np.ones(count, dtype=np.int64)
+
+        while nodes[0] < self.capacity:
+            left     = 2*nodes
+            go_right = values >= self.nodes[left]
+            values   = np.where(go_right, values - self.nodes[left], values)
+            nodes    = np.where(go_right, left + 1, left)
+
+        # rounding can end on one of the empty leaves past size
+        return np.minimum(nodes - self.capacity, self.size - 1)
+
+class HardExampleSampler(object):
+    """ Decides the order of the images of a BatchGenerator for every epoch, drawing them
+    with probability weighted toward the images the model currently gets most wrong and
+    toward the images of rare classes, instead of shuffling them uniformly.
+
+    The priority of an image is rarity * loss**loss_power, where loss is its last training
+    loss, reported through update (see callbacks.HardExampleMining), and rarity is
+    (1 / (num_classes * share))**class_power for the rarest class in it, share being the
+    number of images with that class over the sum of that number over all classes. The
+    priorities are kept in a SumTree.
+
+    An image whose loss was last measured more than max_staleness epochs ago is put in the
+    next epoch for sure, so that no loss is older than that; the first epoch thus goes
+    through all the images once. The rest of every epoch is drawn by priority, with
+    replacement. The losses are not reweighted for the sampling bias.
+
+    # Arguments
+        loss_power      : How much the loss matters, from 0 (not at all) to 1 (proportionally).
+        class_power     : How much rare classes are favored, 0 not at all.
+        max_staleness   : Number of epochs after which an image is measured again.
+        seed            : Seed of the draws, which only depend on it and the epoch; random if None.
+    """
+    def __init__(self, loss_power=0.6, class_power=0.5, max_staleness=3, seed=None):
+        self.loss_power     = loss_power
+        self.class_power    = class_power
+        self.max_staleness  = max_staleness
+        self.seed           = np.random.randint(2**31) if seed is None else seed
+        self._lock          = threading.Lock()
+
+    def bind(self, instances):
+        """ Start over for the images of a generator, in the order of its instances. """
+        self.rarity = ImageIndex(instances).rarity(self.class_power)
+
+        with self._lock:
+            self.losses    = np.zeros(len(instances))
+            self.last_seen = np.full(len(instances), -self.max_staleness - 1, dtype=np.int64)
+            self.tree      = SumTree(len(instances))
+
+    def _priorities(self, indices):
+        return self.rarity[indices] * (self.losses[indices] + 1e-6)**self.loss_power
+
+    def update(self, indices, losses, epoch):
+        """ Report the training losses of the images at indices, seen in epoch. """
+        indices = np.asarray(indices, dtype=np.int64)
+        with self._lock:
+            self.losses[indices]    = losses
+            self.last_seen[indices] = epoch
+            self.tree.update(indices, self._priorities(indices))
+
+    def order(self, epoch):
+        """ The indices of the images of an epoch, as many as there are images. """
+        rng = np.random.RandomState((self.seed + epoch) % 2**32)
+        size = len(self.losses)
+
+        with self._lock:
+            stale = np.nonzero(epoch - self.last_seen > self.max_staleness)[0]
+            stale = stale[np.argsort(self.last_seen[stale], kind='stable')][:size]
+
+            count = size - len(stale)
+            drawn = self.tree.sample(count, rng) if self.tree.total() > 0 else rng.randint(size, size=count)
+
+        order = np.concatenate([stale, drawn]).astype(np.int64)
+        rng.shuffle(order)
+        return order
+
+    def get_state(self):
+        with self._lock:
+            return {'losses': self.losses.tolist(), 'last_seen': self.last_seen.tolist(), 'seed': int(self.seed)}
+
+    def set_state(self, state):
+        with self._lock:
+            self.losses    = np.array(state['losses'], dtype=np.float64)
+            self.last_seen = np.array(state['last_seen'], dtype=np.int64)
+            self.seed      = state['seed']
+
+            self.tree = SumTree(len(self.losses))
+            seen = np.nonzero(self.last_seen >= 0)[0]
+            self.tree.update(seen, self._priorities(seen))
+
+class ImageLosses(object):
+    """ Collects the loss of every image of the training batches of a compiled train model,
+    from the outputs of its YoloLayers, as part of the training step rather than with
+    another session run.
+
+    compile the model with fetches=[image_losses.fetch(model)], and arm it before every
+    training batch: the losses of the batches run while it is not armed, e.g. validation
+    batches, are ignored.
+    """
+    def __init__(self):
+        self.armed  = False
+        self.losses = None
+
+    def _record(self, losses):
+        if self.armed:
+            self.losses = losses
+            self.armed  = False
+        return np.bool_(True)
+
+    def fetch(self, model):
+        import tensorflow as tf
+
+        losses = tf.add_n([tf.reshape(output, [-1]) for output in model.outputs])
+        return tf.py_func(self._record, [losses], tf.bool, stateful=True)
+
+    def pop(self):
+        losses, self.losses = self.losses, None
+        return losses
+
+class ClassBalancedSampler(object):
+    """ Decides the order of the images of a BatchGenerator for every epoch, drawing them with
+    replacement with a probability that grows with the rarity of their rarest class, see
+    ImageIndex.rarity, so that the classes of imbalanced datasets are seen more evenly.
+
+    Rarity is by number of objects: in datasets like RBC, where nearly every image has the
+    common class, the images with a rare class are not rare, their objects are.
+
+    # Arguments
+        class_power : How much rare classes are favored, from 0 (uniformly) to 1 (every class
+                      in as many images).
+        seed        : Seed of the draws, which only depend on it and the epoch; random if None.
+    """
+    def __init__(self, class_power=1.0, seed=None):
+        self.class_power = class_power
+        self.seed        = np.random.randint(2**31) if seed is None else seed
+
+    def bind(self, instances):
+        """ Start over for the images of a generator, in the order of its instances. """
+        rarity = ImageIndex(instances).rarity(self.class_power, per_object=True)
+        self.probabilities = rarity / rarity.sum()
+
+    def order(self, epoch):
+        """ The indices of the images of an epoch, as many as there are images. """
+        rng = np.random.RandomState((self.seed + epoch) % 2**32)
+        size = len(self.probabilities)
+        return rng.choice(size, size, p=self.probabilities).astype(np.int64)
+
+    def get_state(self):
+        return {'seed': int(self.seed)}
+
+    def set_state(self, state):
+        self.seed = state['seed']
+
+class BucketSampler(object):
+    """ Decides the order of the images of a BatchGenerator for every epoch so that every batch
+    has images of similar aspect ratios and numbers of objects, which, with per_batch_boxes,
+    keeps the true boxes of a batch from being padded to the fullest image of the dataset.
+
+    The images, shuffled or as ordered by another sampler, are split into num_aspect_buckets
+    quantiles of aspect ratio, sorted by number of objects within them, cut into batches
+    and the batches are shuffled.
+
+    # Arguments
+        batch_size          : The batch size of the generator.
+        num_aspect_buckets  : Number of aspect ratio groups, 1 to only group by number of objects.
+        sampler             : Another sampler, e.g. ClassBalancedSampler, deciding which images
+                              every epoch has before they are bucketed; all of them once if None.
+        seed                : Seed of the shuffling, which only depends on it and the epoch; random if None.
+    """
+    def __init__(self, batch_size, num_aspect_buckets=2, sampler=None, seed=None):
+        self.batch_size         = batch_size
+        self.num_aspect_buckets = num_aspect_buckets
+        self.sampler            = sampler
+        self.seed               = np.random.randint(2**31) if seed is None else seed
+
+    def bind(self, instances):
+        """ Start over for the images of a generator, in the order of its instances. """
+        index = ImageIndex(instances)
+        self.num_objects = index.num_objects
+
+        edges = np.percentile(np.log(index.aspect), np.linspace(0, 100, self.num_aspect_buckets + 1)[1:-1]) if len(index) else []
+        self.aspect_bucket = np.searchsorted(edges, np.log(index.aspect), side='right') if len(index) else np.zeros(0, dtype=np.int64)
+
+        if self.sampler is not None:
+            self.sampler.bind(instances)
+
+    def update(self, indices, losses, epoch):
+        """ Passed on to the other sampler, e.g. a HardExampleSampler. """
+        self.sampler.update(indices, losses, epoch)
+
+    def order(self, epoch):
+        """ The indices of the images of an epoch, as many as there are images. """
+        rng = np.random.RandomState((self.seed + epoch) % 2**32)
+        indices = self.sampler.order(epoch) if self.sampler is not None else np.arange(len(self.num_objects))
+
+        # sorted by bucket, then number of objects, ties broken at random
+        indices = indices[np.lexsort((rng.uniform(size=len(indices)), self.num_objects[indices], self.aspect_bucket[indices]))]
+
+        batches = [indices[start:start + self.batch_size] for start in range(0, len(indices), self.batch_size)]
+        rng.shuffle(batches)
+
+        # a batch short of batch_size anywhere but last would shift the batches after it
+        batches.sort(key=lambda batch: len(batch) < self.batch_size)
+        return np.concatenate(batches).astype(np.int64) if batches else indices
+
+    def get_state(self):
+        return {'seed': int(self.seed), 'sampler': self.sampler.get_state() if self.sampler is not None else None}
+
+    def set_state(self, state):
+        self.seed = state['seed']
+        if self.sampler is not None and state['sampler'] is not None:
+            self.sampler.set_state(state['sampler'])
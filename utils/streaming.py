@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import itertools
+import resource
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from .utils import get_yolo_boxes
+from .bbox import draw_boxes
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def is_image_file(path, extensions=IMAGE_EXTENSIONS):
+    return os.path.splitext(path)[1].lower() in extensions
+
+def scan_images(path, recursive=True, extensions=IMAGE_EXTENSIONS):
+    """ Lazily yield image paths under path in a deterministic (sorted, depth-first) order.
+    """
+    if not os.path.isdir(path):
+        if is_image_file(path, extensions): yield path
+        return
+
+    entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+
+    for entry in entries:
+        if entry.is_dir():
+            if recursive:
+                yield from scan_images(entry.path, recursive, extensions)
+        elif is_image_file(entry.name, extensions):
+            yield entry.path
+
+def iter_decoded(paths, workers=4, max_pending=32):
+    """ Decode images in a thread pool, yielding (path, image) in input order.
+    At most max_pending images are decoded ahead of the consumer.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        for path in paths:
+            pending.append((path, executor.submit(cv2.imread, path)))
+
+            if len(pending) >= max_pending:
+                done_path, future = pending.popleft()
+                yield done_path, future.result()
+
+        while pending:
+            done_path, future = pending.popleft()
+            yield done_path, future.result()
+
+def iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def boxes_to_records(boxes, labels, obj_thresh):
+    records = []
+
+    for box in boxes:
+        if box.get_score() <= obj_thresh: continue
+
+        records.append({
+            'label': labels[box.get_label()],
+            'score': round(float(box.get_score()), 4),
+            'xmin':  int(box.xmin),
+            'ymin':  int(box.ymin),
+            'xmax':  int(box.xmax),
+            'ymax':  int(box.ymax)
+        })
+
+    return records
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+
+    with open(checkpoint_path) as handle:
+        return json.load(handle)
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    # write-then-rename so a crash never leaves a half written checkpoint
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'w') as handle:
+        json.dump(checkpoint, handle)
+    os.replace(temp_path, checkpoint_path)
+
+def _scan_key(path, root):
+    # scan_images goes through the entries of every directory sorted by name, depth-first,
+    # which is the order of the tuples of the path components under root
+    return tuple(os.path.relpath(path, root).split(os.sep))
+
+def _skip_until(paths, last_path, root):
+    # by scan position rather than by equality, so a last_path removed since is no different
+    last_key = _scan_key(last_path, root)
+    return itertools.dropwhile(lambda path: _scan_key(path, root) <= last_key, paths)
+
+def _image_output_file(image_output_path, path, root):
+    # the path under root is kept, so that images of the same name in different directories do not collide
+    relative = os.path.relpath(path, root) if os.path.isdir(root) else os.path.basename(path)
+    output_file = os.path.join(image_output_path, relative)
+
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    return output_file
+
+def predict_directory(model, input_path, detections_path, labels, anchors, net_h, net_w, obj_thresh, nms_thresh,
+                      batch_size=8, workers=4, recursive=True, image_output_path=None, report_every=100):
+    """ Run detection over a (possibly huge) directory tree with bounded memory.
+
+    Paths are scanned lazily, decoded in a thread pool and sent through the model
+    batch_size at a time. Detections are appended to detections_path as one JSON
+    object per image. After every batch a checkpoint records the last processed path
+    and the size of the detections file, so a rerun truncates any partial write and
+    resumes with the paths that come after that one in the scan order, whether or not
+    it still exists. Files added before the checkpointed path between runs are not
+    picked up.
+
+    # Arguments
+        image_output_path : If given, also write annotated images to this directory, at their
+                            path under input_path.
+        report_every      : Print throughput and peak memory every that many images.
+    # Returns
+        A dict with the number of processed images, elapsed seconds and images/s.
+    """
+    checkpoint_path = detections_path + '.checkpoint'
+    checkpoint      = load_checkpoint(checkpoint_path)
+    paths           = scan_images(input_path, recursive)
+
+    mode = 'w'
+    if checkpoint is not None:
+        print('Resuming after %s (%d images done)' % (checkpoint['last_path'], checkpoint['count']))
+        paths = _skip_until(paths, checkpoint['last_path'], input_path)
+
+        with open(detections_path, 'a') as handle:
+            handle.truncate(checkpoint['offset'])
+        mode = 'a'
+
+    count       = checkpoint['count'] if checkpoint else 0
+    processed   = 0
+    start       = time.perf_counter()
+    next_report = report_every
+
+    with open(detections_path, mode) as detections:
+        for batch in iter_batches(iter_decoded(paths, workers, max_pending=2*batch_size), batch_size):
+            last_path  = batch[-1][0]
+            unreadable = [path for path, image in batch if image is None]
+            batch      = [(path, image) for path, image in batch if image is not None]
+
+            for path in unreadable:
+                print('Unable to load image file: %s' % path)
+
+            if len(batch) > 0:
+                images      = [image for _, image in batch]
+                batch_boxes = get_yolo_boxes(model, images, net_h, net_w, anchors, obj_thresh, nms_thresh)
+
+                for (path, image), boxes in zip(batch, batch_boxes):
+                    detections.write(json.dumps({
+                        'path':   path,
+                        'height': image.shape[0],
+                        'width':  image.shape[1],
+                        'boxes':  boxes_to_records(boxes, labels, obj_thresh)
+                    }) + '\n')
+
+                    if image_output_path is not None:
+                        draw_boxes(image, boxes, labels, obj_thresh)
+                        cv2.imwrite(_image_output_file(image_output_path, path, input_path), np.uint8(image))
+
+            detections.flush()
+
+            processed += len(batch) + len(unreadable)
+            count     += len(batch) + len(unreadable)
+            save_checkpoint(checkpoint_path, {'last_path': last_path, 'offset': detections.tell(), 'count': count})
+
+            if processed >= next_report:
+                next_report += report_every
+                _report(processed, start)
+
+    return _report(processed, start)
+
+def _report(processed, start):
+    elapsed = time.perf_counter() - start
+    stats = {
+        'images':        processed,
+        'seconds':       elapsed,
+        'images_per_s':  processed / max(elapsed, 1e-9),
+        'max_rss_mb':    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    }
+    print('%(images)d images, %(images_per_s).2f images/s, peak memory %(max_rss_mb).1f MB' % stats)
+
+    return stats
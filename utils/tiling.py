@@ -0,0 +1,126 @@
+import numpy as np
+from .bbox import BoundBox
+from .utils import get_yolo_boxes
+
+def get_tile_origins(length, tile_size, overlap):
+    """ Return the start offsets of tiles of tile_size covering [0, length) with at least
+    overlap pixels shared between neighbours. The last tile is aligned to the end.
+    """
+    if length <= tile_size:
+        return [0]
+
+    stride  = max(1, tile_size - overlap)
+    origins = list(range(0, length - tile_size, stride))
+
+    return origins + [length - tile_size]
+
+def iter_tiles(image, tile_h, tile_w, overlap):
+    """ Lazily yield (y, x, tile) views over the image, row by row.
+    """
+    image_h, image_w = image.shape[:2]
+
+    for y in get_tile_origins(image_h, tile_h, overlap):
+        for x in get_tile_origins(image_w, tile_w, overlap):
+            yield y, x, image[y:y+tile_h, x:x+tile_w]
+
+def merge_boxes(boxes, merge_thresh, fusion=False):
+    """ Merge duplicate detections of the same class, e.g. of one object seen by two tiles.
+
+    Two boxes are duplicates when their intersection covers at least merge_thresh of
+    the smaller box, so that an object cut by a tile seam is matched to the complete
+    detection from the neighbouring tile.
+
+    # Arguments
+        boxes        : List of BoundBox in image coordinates.
+        merge_thresh : Intersection over the smaller area above which boxes are merged.
+        fusion       : If True, the kept box is extended to the union of its duplicates,
+                       which reassembles objects larger than the tile overlap.
+    # Returns
+        The list of remaining BoundBox, highest score first.
+    """
+    if len(boxes) == 0:
+        return []
+
+    coords = np.array([[box.xmin, box.ymin, box.xmax, box.ymax] for box in boxes], dtype=np.float64)
+    scores = np.array([box.get_score() for box in boxes])
+    labels = np.array([box.get_label() for box in boxes])
+    areas  = np.maximum(coords[:, 2] - coords[:, 0], 0) * np.maximum(coords[:, 3] - coords[:, 1], 0)
+
+    merged = []
+
+    for label in np.unique(labels):
+        order = np.where(labels == label)[0]
+        order = order[np.argsort(-scores[order])]
+
+        while len(order) > 0:
+            i, rest = order[0], order[1:]
+
+            iw = np.minimum(coords[i, 2], coords[rest, 2]) - np.maximum(coords[i, 0], coords[rest, 0])
+            ih = np.minimum(coords[i, 3], coords[rest, 3]) - np.maximum(coords[i, 1], coords[rest, 1])
+            intersection = np.maximum(iw, 0) * np.maximum(ih, 0)
+            min_area     = np.maximum(np.minimum(areas[i], areas[rest]), np.finfo(float).eps)
+
+            duplicate = (intersection / min_area) >= merge_thresh
+
+            box = boxes[i]
+            if fusion and np.any(duplicate):
+                cluster  = np.concatenate([[i], rest[duplicate]])
+                box.xmin = int(coords[cluster, 0].min())
+                box.ymin = int(coords[cluster, 1].min())
+                box.xmax = int(coords[cluster, 2].max())
+                box.ymax = int(coords[cluster, 3].max())
+
+            merged.append(box)
+            order = rest[~duplicate]
+
+    merged.sort(key=lambda box: -box.get_score())
+
+    return merged
+
+def get_tiled_yolo_boxes(model, image, net_h, net_w, anchors, obj_thresh, nms_thresh,
+                         overlap=64, batch_size=4, merge_thresh=0.6, fusion=False):
+    """ Detect objects in an image much larger than the network input by running the
+    model over overlapping net_h x net_w tiles at native resolution.
+
+    Tiles are produced lazily and sent through the model batch_size at a time, so only
+    one batch of preprocessed tiles is held in memory regardless of the image size.
+
+    # Arguments
+        model        : The inference model.
+        image        : The full image, as loaded by cv2.imread.
+        net_h, net_w : The tile size, which is also the network input size.
+        overlap      : Number of pixels shared by neighbouring tiles. Should be at least
+                       the size of the largest object expected.
+        batch_size   : Number of tiles per predict_on_batch call.
+        merge_thresh : See merge_boxes.
+        fusion       : See merge_boxes.
+    # Returns
+        A list of BoundBox in image coordinates.
+    """
+    all_boxes = []
+    origins   = []
+    tiles     = []
+
+    def flush():
+        batch_boxes = get_yolo_boxes(model, tiles, net_h, net_w, anchors, obj_thresh, nms_thresh)
+
+        for (y, x), boxes in zip(origins, batch_boxes):
+            for box in boxes:
+                if box.get_score() <= obj_thresh: continue
+
+                all_boxes.append(BoundBox(box.xmin + x, box.ymin + y, box.xmax + x, box.ymax + y, box.c, box.classes))
+
+        del origins[:]
+        del tiles[:]
+
+    for y, x, tile in iter_tiles(image, net_h, net_w, overlap):
+        origins.append((y, x))
+        tiles.append(tile)
+
+        if len(tiles) == batch_size:
+            flush()
+
+    if len(tiles) > 0:
+        flush()
+
+    return merge_boxes(all_boxes, merge_thresh, fusion)
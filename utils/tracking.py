@@ -0,0 +1,204 @@
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from .bbox import BoundBox
+from .utils import compute_overlap
+
+class KalmanBoxFilter:
+    """ Constant velocity Kalman filter over a box state [cx, cy, w, h, vcx, vcy, vw, vh].
+    """
+    def __init__(self, box, process_noise=1e-2, measurement_noise=1e-1):
+        self.x = np.zeros(8)
+        self.x[:4] = _to_cxcywh(box)
+
+        self.F = np.eye(8)
+        self.F[:4, 4:] = np.eye(4)
+        self.H = np.eye(4, 8)
+
+        # noise is scaled by the box size so that big and small boxes behave alike
+        scale  = max(self.x[2], self.x[3], 1.)
+        self.P = np.diag([1., 1., 1., 1., 10., 10., 10., 10.]) * scale
+        self.Q = np.eye(8) * process_noise * scale
+        self.R = np.eye(4) * measurement_noise * scale
+
+    def predict(self):
+        self.x = self.F.dot(self.x)
+        self.P = self.F.dot(self.P).dot(self.F.T) + self.Q
+
+        # do not let the size collapse
+        self.x[2:4] = np.maximum(self.x[2:4], 1.)
+
+        return _to_xyxy(self.x[:4])
+
+    def update(self, box):
+        y = _to_cxcywh(box) - self.H.dot(self.x)
+        S = self.H.dot(self.P).dot(self.H.T) + self.R
+        K = self.P.dot(self.H.T).dot(np.linalg.inv(S))
+
+        self.x = self.x + K.dot(y)
+        self.P = (np.eye(8) - K.dot(self.H)).dot(self.P)
+
+        return _to_xyxy(self.x[:4])
+
+def _to_cxcywh(box):
+    xmin, ymin, xmax, ymax = box
+    return np.array([(xmin + xmax) / 2., (ymin + ymax) / 2., xmax - xmin, ymax - ymin], dtype=np.float64)
+
+def _to_xyxy(state):
+    cx, cy, w, h = state
+    return np.array([cx - w / 2., cy - h / 2., cx + w / 2., cy + h / 2.])
+
+class Track:
+    def __init__(self, track_id, box):
+        self.track_id          = track_id
+        self.filter            = KalmanBoxFilter([box.xmin, box.ymin, box.xmax, box.ymax])
+        self.coords            = np.array([box.xmin, box.ymin, box.xmax, box.ymax], dtype=np.float64)
+        self.label             = box.get_label()
+        self.classes           = box.classes
+        self.score             = box.get_score()
+        self.hits              = 1
+        self.frames_since_seen = 0
+
+    def predict(self):
+        self.coords = self.filter.predict()
+        self.frames_since_seen += 1
+
+    def update(self, box):
+        self.coords            = self.filter.update([box.xmin, box.ymin, box.xmax, box.ymax])
+        self.classes           = box.classes
+        self.score             = box.get_score()
+        self.hits             += 1
+        self.frames_since_seen = 0
+
+    def confidence(self, decay):
+        return self.score * decay**self.frames_since_seen
+
+    def to_box(self, decay):
+        xmin, ymin, xmax, ymax = [int(round(v)) for v in self.coords]
+
+        box = BoundBox(xmin, ymin, xmax, ymax, self.score, self.classes)
+        box.label    = self.label
+        box.score    = self.confidence(decay)
+        box.track_id = self.track_id
+
+        return box
+
+class IoUTracker:
+    """ Associates detections to tracks by IoU (optimal assignment per label) and
+    propagates unmatched tracks with their Kalman filters.
+
+    # Arguments
+        iou_thresh  : Minimum IoU between a predicted track and a detection to match them.
+        max_age     : Frames a track survives without being matched to a detection.
+        decay       : Per-frame multiplier applied to a track's confidence while it is not matched.
+    """
+    def __init__(self, iou_thresh=0.3, max_age=15, decay=0.95):
+        self.iou_thresh = iou_thresh
+        self.max_age    = max_age
+        self.decay      = decay
+        self.tracks     = []
+        self.next_id    = 0
+
+    def predict(self):
+        """ Advance all tracks by one frame without a detection. Returns the tracked boxes.
+        """
+        for track in self.tracks:
+            track.predict()
+
+        self.tracks = [track for track in self.tracks if track.frames_since_seen <= self.max_age]
+
+        return self.boxes()
+
+    def update(self, boxes, obj_thresh=0.):
+        """ Advance all tracks by one frame and correct them with fresh detections.
+        Returns the tracked boxes, with stable track_id attributes.
+        """
+        for track in self.tracks:
+            track.predict()
+
+        boxes     = [box for box in boxes if box.get_score() > obj_thresh]
+        unmatched = set(range(len(boxes)))
+
+        if len(self.tracks) > 0 and len(boxes) > 0:
+            track_coords = np.array([track.coords for track in self.tracks])
+            box_coords   = np.array([[box.xmin, box.ymin, box.xmax, box.ymax] for box in boxes], dtype=np.float64)
+
+            ious = compute_overlap(track_coords, box_coords)
+
+            # never match across labels
+            track_labels = np.array([track.label for track in self.tracks])
+            box_labels   = np.array([box.get_label() for box in boxes])
+            ious[track_labels[:, None] != box_labels[None, :]] = 0
+
+            rows, cols = linear_sum_assignment(-ious)
+            for row, col in zip(rows, cols):
+                if ious[row, col] < self.iou_thresh: continue
+
+                self.tracks[row].update(boxes[col])
+                unmatched.discard(col)
+
+        for i in sorted(unmatched):
+            self.tracks.append(Track(self.next_id, boxes[i]))
+            self.next_id += 1
+
+        self.tracks = [track for track in self.tracks if track.frames_since_seen <= self.max_age]
+
+        return self.boxes()
+
+    def boxes(self):
+        return [track.to_box(self.decay) for track in self.tracks]
+
+    def min_confidence(self):
+        if len(self.tracks) == 0: return 0.
+        return min(track.confidence(self.decay) for track in self.tracks)
+
+class TrackingDetector:
+    """ Runs the detector only every detect_every frames, or earlier when the scene
+    changed or a track's confidence fell below min_confidence, and propagates boxes
+    with an IoUTracker in between.
+
+    # Arguments
+        detect_fn       : Function mapping a frame to a list of BoundBox (e.g. a get_yolo_boxes closure).
+        detect_every    : Maximum number of frames between two detections.
+        min_confidence  : Re-detect as soon as a track's decayed confidence drops below this.
+        motion_thresh   : Re-detect when the mean absolute difference of a downscaled gray frame
+                          to the last detected frame exceeds this value (0-255). None disables it.
+        obj_thresh      : Detections at or below this score do not start or update tracks.
+    """
+    def __init__(self, detect_fn, detect_every=5, min_confidence=0.3, motion_thresh=12., obj_thresh=0.5, tracker=None):
+        self.detect_fn      = detect_fn
+        self.detect_every   = detect_every
+        self.min_confidence = min_confidence
+        self.motion_thresh  = motion_thresh
+        self.obj_thresh     = obj_thresh
+        self.tracker        = tracker or IoUTracker()
+
+        self.frames         = 0
+        self.detections     = 0
+        self._since_detect  = None
+        self._last_thumb    = None
+
+    def _thumbnail(self, frame):
+        return cv2.cvtColor(cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+    def _should_detect(self, thumb):
+        if self._since_detect is None or self._since_detect + 1 >= self.detect_every:
+            return True
+        if len(self.tracker.tracks) > 0 and self.tracker.min_confidence() < self.min_confidence:
+            return True
+        if thumb is not None and np.mean(np.abs(thumb - self._last_thumb)) > self.motion_thresh:
+            return True
+        return False
+
+    def __call__(self, frame):
+        self.frames += 1
+        thumb = self._thumbnail(frame) if self.motion_thresh is not None else None
+
+        if self._should_detect(thumb):
+            self.detections   += 1
+            self._since_detect = 0
+            self._last_thumb   = thumb
+            return self.tracker.update(self.detect_fn(frame), self.obj_thresh)
+
+        self._since_detect += 1
+        return self.tracker.predict()
@@ -2,6 +2,7 @@ import cv2
 import numpy as np
 import os
 from .bbox import BoundBox, bbox_iou
+from .profiling import profiler
 from scipy.special import expit
 
 def _sigmoid(x):
@@ -21,7 +22,8 @@ def evaluate(model,
              nms_thresh=0.45,
              net_h=416,
              net_w=416,
-             save_path=None):
+             save_path=None,
+             rect=False):
     """ Evaluate a given dataset using a given model.
     code originally from https://github.com/fizyr/keras-retinanet
 
@@ -34,6 +36,8 @@ def evaluate(model,
         net_h           : The height of the input image to the model, higher value results in better accuracy
         net_w           : The width of the input image to the model
         save_path       : The path to save images with visualized detections to.
+        rect            : Letterbox each image into the smallest rectangle covering its aspect ratio
+                          (long side max(net_h, net_w)) instead of the square net_h x net_w.
     # Returns
         A dict mapping class names to mAP scores.
     """    
@@ -42,10 +46,16 @@ def evaluate(model,
     all_annotations    = [[None for i in range(generator.num_classes())] for j in range(generator.size())]
 
     for i in range(generator.size()):
-        raw_image = [generator.load_image(i)]
+        with profiler.stage('imread'):
+            raw_image = [generator.load_image(i)]
+
+        if rect:
+            image_net_h, image_net_w = get_rect_net_size(raw_image[0].shape[0], raw_image[0].shape[1], max(net_h, net_w))
+        else:
+            image_net_h, image_net_w = net_h, net_w
 
         # make the boxes and the labels
-        pred_boxes = get_yolo_boxes(model, raw_image, net_h, net_w, generator.get_anchors(), obj_thresh, nms_thresh)[0]
+        pred_boxes = get_yolo_boxes(model, raw_image, image_net_h, image_net_w, generator.get_anchors(), obj_thresh, nms_thresh)[0]
 
         score = np.array([box.get_score() for box in pred_boxes])
         pred_labels = np.array([box.label for box in pred_boxes])        
@@ -53,7 +63,7 @@ def evaluate(model,
         if len(pred_boxes) > 0:
             pred_boxes = np.array([[box.xmin, box.ymin, box.xmax, box.ymax, box.get_score()] for box in pred_boxes]) 
         else:
-            pred_boxes = np.array([[]])  
+            pred_boxes = np.zeros((0, 5))
         
         # sort the boxes and the labels according to scores
         score_sort = np.argsort(-score)
@@ -71,70 +81,26 @@ def evaluate(model,
             all_annotations[i][label] = annotations[annotations[:, 4] == label, :4].copy()
 
     # compute mAP by comparing all detections and all annotations
-    average_precisions = {}
-    
-    for label in range(generator.num_classes()):
-        false_positives = np.zeros((0,))
-        true_positives  = np.zeros((0,))
-        scores          = np.zeros((0,))
-        num_annotations = 0.0
-
-        for i in range(generator.size()):
-            detections           = all_detections[i][label]
-            annotations          = all_annotations[i][label]
-            num_annotations     += annotations.shape[0]
-            detected_annotations = []
-
-            for d in detections:
-                scores = np.append(scores, d[4])
-
-                if annotations.shape[0] == 0:
-                    false_positives = np.append(false_positives, 1)
-                    true_positives  = np.append(true_positives, 0)
-                    continue
-
-                overlaps            = compute_overlap(np.expand_dims(d, axis=0), annotations)
-                assigned_annotation = np.argmax(overlaps, axis=1)
-                max_overlap         = overlaps[0, assigned_annotation]
-
-                if max_overlap >= iou_threshold and assigned_annotation not in detected_annotations:
-                    false_positives = np.append(false_positives, 0)
-                    true_positives  = np.append(true_positives, 1)
-                    detected_annotations.append(assigned_annotation)
-                else:
-                    false_positives = np.append(false_positives, 1)
-                    true_positives  = np.append(true_positives, 0)
-
-        # no annotations -> AP for this class is 0 (is this correct?)
-        if num_annotations == 0:
-            average_precisions[label] = 0
-            continue
-
-        # sort by score
-        indices         = np.argsort(-scores)
-        false_positives = false_positives[indices]
-        true_positives  = true_positives[indices]
-
-        # compute false positives and true positives
-        false_positives = np.cumsum(false_positives)
-        true_positives  = np.cumsum(true_positives)
+    return compute_average_precisions(all_detections, all_annotations, iou_threshold)
 
-        # compute recall and precision
-        recall    = true_positives / num_annotations
-        precision = true_positives / np.maximum(true_positives + false_positives, np.finfo(np.float64).eps)
+def get_rect_net_size(image_h, image_w, net_size, downsample=32):
+    """ Return the smallest (net_h, net_w), in multiples of downsample, that holds the
+    image letterboxed with its long side scaled to net_size.
+    """
+    net_size = max(downsample, (net_size//downsample)*downsample)
+    scale    = float(net_size) / max(image_h, image_w)
 
-        # compute average precision
-        average_precision  = compute_ap(recall, precision)  
-        average_precisions[label] = average_precision
+    net_h = int(np.ceil(image_h*scale/downsample))*downsample
+    net_w = int(np.ceil(image_w*scale/downsample))*downsample
 
-    return average_precisions    
+    return min(net_h, net_size), min(net_w, net_size)
 
 def correct_yolo_boxes(boxes, image_h, image_w, net_h, net_w):
     if (float(net_w)/image_w) < (float(net_h)/image_h):
         new_w = net_w
         new_h = (image_h*net_w)/image_w
     else:
-        new_h = net_w
+        new_h = net_h
         new_w = (image_w*net_h)/image_h
         
     for i in range(len(boxes)):
@@ -227,39 +193,155 @@ def preprocess_input(image, net_h, net_w):
 
     return new_image
 
+def letterbox_image(image, net_h, net_w):
+    """ preprocess_input without the normalization: the RGB image resized into the letter box
+    as uint8, a quarter of the memory, to hold many preprocessed images at once. The border
+    is 128, within 1/255 of the 0.5 of preprocess_input.
+    """
+    new_h, new_w, _ = image.shape
+
+    if (float(net_w)/new_w) < (float(net_h)/new_h):
+        new_h = (new_h * net_w)//new_w
+        new_w = net_w
+    else:
+        new_w = (new_w * net_h)//new_h
+        new_h = net_h
+
+    resized = cv2.resize(image[:,:,::-1], (new_w, new_h))
+
+    new_image = np.full((net_h, net_w, 3), 128, dtype=np.uint8)
+    new_image[(net_h-new_h)//2:(net_h+new_h)//2, (net_w-new_w)//2:(net_w+new_w)//2, :] = resized
+
+    return new_image
+
 def normalize(image):
     return image/255.
        
+def decode_yolo_output(yolos, anchors, obj_thresh, nms_thresh, image_h, image_w, net_h, net_w):
+    """ Turn the network outputs for a single image into boxes in image coordinates.
+    """
+    boxes = []
+
+    # decode the output of the network
+    with profiler.stage('decode_netout'):
+        for j in range(len(yolos)):
+            start_index = len(anchors) - 6*(j + 1)
+            yolo_anchors = anchors[start_index:start_index+6] # config['model']['anchors']
+            boxes += decode_netout(yolos[j], yolo_anchors, obj_thresh, net_h, net_w)
+    profiler.count('decode_netout', len(boxes))
+
+    # correct the sizes of the bounding boxes
+    with profiler.stage('correct_yolo_boxes'):
+        correct_yolo_boxes(boxes, image_h, image_w, net_h, net_w)
+
+    # suppress non-maximal boxes
+    with profiler.stage('do_nms'):
+        do_nms(boxes, nms_thresh)
+    if profiler.enabled:
+        profiler.count('do_nms', sum(1 for box in boxes if np.max(box.classes) > 0))
+
+    return boxes
+
+def decode_netout_arrays(netout, anchors, obj_thresh, net_h, net_w):
+    """ decode_netout on arrays: the boxes above obj_thresh as an (N, 4) array of xmin, ymin,
+    xmax, ymax in units of the network input, and their (N, nb_class) class scores.
+    """
+    grid_h, grid_w = netout.shape[:2]
+    nb_box = len(anchors) // 2
+    netout = netout.reshape((grid_h, grid_w, nb_box, -1))
+
+    objectness = _sigmoid(netout[..., 4])
+    rows, cols, anchor = np.nonzero(objectness > obj_thresh)
+    netout, objectness = netout[rows, cols, anchor], objectness[rows, cols, anchor]
+
+    anchors = np.reshape(anchors, (-1, 2))
+    x = (cols + _sigmoid(netout[:, 0])) / grid_w
+    y = (rows + _sigmoid(netout[:, 1])) / grid_h
+    w = anchors[anchor, 0] * np.exp(netout[:, 2]) / net_w
+    h = anchors[anchor, 1] * np.exp(netout[:, 3]) / net_h
+
+    classes  = objectness[:, np.newaxis] * _softmax(netout[:, 5:])
+    classes *= classes > obj_thresh
+
+    return np.stack([x - w/2, y - h/2, x + w/2, y + h/2], axis=-1), classes
+
+def nms_arrays(boxes, classes, nms_thresh):
+    """ do_nms on arrays: zero the score of every class of a box that overlaps a box with a
+    higher score for that class by nms_thresh or more, in place.
+    """
+    for c in range(classes.shape[1]):
+        candidates = np.nonzero(classes[:, c] > 0)[0]
+        if len(candidates) < 2: continue
+
+        candidates = candidates[np.argsort(-classes[candidates, c], kind='stable')]
+        overlaps   = compute_overlap(boxes[candidates], boxes[candidates])
+
+        # a suppressed box does not suppress others
+        keep = np.ones(len(candidates), dtype=bool)
+        for i in range(len(candidates)):
+            if keep[i]:
+                keep[i+1:] &= overlaps[i, i+1:] < nms_thresh
+
+        classes[candidates[~keep], c] = 0
+
+def decode_yolo_arrays(yolos, anchors, obj_thresh, nms_thresh, image_h, image_w, net_h, net_w):
+    """ decode_yolo_output on arrays, for scoring many images quickly.
+
+    # Returns
+        The detections of the image as an (N, 5) array of xmin, ymin, xmax, ymax and score
+        in image coordinates, highest score first, and their (N,) labels. Boxes suppressed
+        for every class are left out.
+    """
+    boxes, classes = [], []
+    for j in range(len(yolos)):
+        start_index = len(anchors) - 6*(j + 1)
+        yolo_boxes, yolo_classes = decode_netout_arrays(yolos[j], anchors[start_index:start_index+6], obj_thresh, net_h, net_w)
+        boxes.append(yolo_boxes)
+        classes.append(yolo_classes)
+    boxes, classes = np.concatenate(boxes), np.concatenate(classes)
+
+    # correct the boxes for the letter box, as correct_yolo_boxes
+    if (float(net_w)/image_w) < (float(net_h)/image_h):
+        new_w, new_h = net_w, (image_h*net_w)/image_w
+    else:
+        new_w, new_h = (image_w*net_h)/image_h, net_h
+
+    x_offset, x_scale = (net_w - new_w)/2./net_w, float(new_w)/net_w
+    y_offset, y_scale = (net_h - new_h)/2./net_h, float(new_h)/net_h
+    boxes[:, 0::2] = (boxes[:, 0::2] - x_offset) / x_scale * image_w
+    boxes[:, 1::2] = (boxes[:, 1::2] - y_offset) / y_scale * image_h
+
+    nms_arrays(boxes, classes, nms_thresh)
+
+    labels = np.argmax(classes, axis=1) if len(classes) > 0 else np.zeros((0,), dtype=int)
+    scores = classes[np.arange(len(classes)), labels]
+
+    order = np.argsort(-scores, kind='stable')
+    order = order[scores[order] > 0]
+
+    return np.concatenate([boxes[order], scores[order, np.newaxis]], axis=1), labels[order]
+
 def get_yolo_boxes(model, images, net_h, net_w, anchors, obj_thresh, nms_thresh):
-    image_h, image_w, _ = images[0].shape
     nb_images           = len(images)
     batch_input         = np.zeros((nb_images, net_h, net_w, 3))
 
     # preprocess the input
-    for i in range(nb_images):
-        batch_input[i] = preprocess_input(images[i], net_h, net_w)        
+    with profiler.stage('preprocess_input'):
+        for i in range(nb_images):
+            batch_input[i] = preprocess_input(images[i], net_h, net_w)
+    profiler.count('preprocess_input', nb_images)
 
     # run the prediction
-    batch_output = model.predict_on_batch(batch_input)
+    with profiler.stage('predict_on_batch'):
+        batch_output = model.predict_on_batch(batch_input)
+    profiler.count('predict_on_batch', nb_images)
     batch_boxes  = [None]*nb_images
 
     for i in range(nb_images):
         yolos = [output[i] for output in batch_output]
-        boxes = []
-
-        # decode the output of the network
-        for j in range(len(yolos)):
-            start_index = len(anchors) - 6*(j + 1)
-            yolo_anchors = anchors[start_index:start_index+6] # config['model']['anchors']
-            boxes += decode_netout(yolos[j], yolo_anchors, obj_thresh, net_h, net_w)
-
-        # correct the sizes of the bounding boxes
-        correct_yolo_boxes(boxes, image_h, image_w, net_h, net_w)
+        image_h, image_w, _ = images[i].shape
 
-        # suppress non-maximal boxes
-        do_nms(boxes, nms_thresh)        
-           
-        batch_boxes[i] = boxes
+        batch_boxes[i] = decode_yolo_output(yolos, anchors, obj_thresh, nms_thresh, image_h, image_w, net_h, net_w)
 
     return batch_boxes        
 
@@ -290,6 +372,66 @@ def compute_overlap(a, b):
 
     return intersection / ua  
     
+def _match_detections(detections, annotations, iou_threshold):
+    # a detection is a true positive if it overlaps an annotation by iou_threshold or more,
+    # the annotation it overlaps most, and no detection with a higher score matched it before
+    true_positives = np.zeros((len(detections),))
+    if len(detections) == 0 or len(annotations) == 0:
+        return true_positives
+
+    overlaps = compute_overlap(detections, annotations)
+    assigned = np.argmax(overlaps, axis=1)
+    matched  = np.nonzero(overlaps[np.arange(len(detections)), assigned] >= iou_threshold)[0]
+
+    _, first = np.unique(assigned[matched], return_index=True)
+    true_positives[matched[first]] = 1
+
+    return true_positives
+
+def compute_average_precisions(all_detections, all_annotations, iou_threshold=0.5):
+    """ Score the detections of a dataset against its annotations.
+
+    # Arguments
+        all_detections  : For every image and class, an (N, 5) array of xmin, ymin, xmax, ymax
+                          and score, highest score first.
+        all_annotations : For every image and class, an (M, 4) array of xmin, ymin, xmax, ymax.
+        iou_threshold   : The threshold used to consider when a detection is positive or negative.
+    # Returns
+        A dict mapping class indices to average precisions.
+    """
+    num_classes = len(all_annotations[0]) if len(all_annotations) > 0 else 0
+    average_precisions = {}
+
+    for label in range(num_classes):
+        scores          = [detections[label][:, 4] for detections in all_detections]
+        true_positives  = [_match_detections(detections[label], annotations[label], iou_threshold)
+                           for detections, annotations in zip(all_detections, all_annotations)]
+        num_annotations = sum(annotations[label].shape[0] for annotations in all_annotations)
+
+        # no annotations -> AP for this class is 0 (is this correct?)
+        if num_annotations == 0:
+            average_precisions[label] = 0
+            continue
+
+        # sort by score
+        scores          = np.concatenate(scores)
+        indices         = np.argsort(-scores, kind='stable')
+        true_positives  = np.concatenate(true_positives)[indices]
+        false_positives = 1 - true_positives
+
+        # compute false positives and true positives
+        false_positives = np.cumsum(false_positives)
+        true_positives  = np.cumsum(true_positives)
+
+        # compute recall and precision
+        recall    = true_positives / num_annotations
+        precision = true_positives / np.maximum(true_positives + false_positives, np.finfo(np.float64).eps)
+
+        # compute average precision
+        average_precisions[label] = compute_ap(recall, precision)
+
+    return average_precisions
+
 def compute_ap(recall, precision):
     """ Compute the average precision, given the recall and precision curves.
     Code originally from https://github.com/rbgirshick/py-faster-rcnn.
@@ -306,8 +448,7 @@ def compute_ap(recall, precision):
     mpre = np.concatenate(([0.], precision, [0.]))
 
     # compute the precision envelope
-    for i in range(mpre.size - 1, 0, -1):
-        mpre[i - 1] = np.maximum(mpre[i - 1], mpre[i])
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
 
     # to calculate area under PR curve, look for points
     # where X axis (recall) changes value
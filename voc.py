@@ -3,6 +3,7 @@ import os
 import xml.etree.ElementTree as ET
 import pickle
 from collections import defaultdict
+from utils.sampling import image_stats
 
 def _parse_voc_object(object_node: ET.Element):
     return {
@@ -25,15 +26,17 @@ def _parse_voc_annotation(annotation_node: ET.Element, image_directory, labels):
     if labels:
         instance["object"] = [obj for obj in instance["object"] if obj["name"] in labels]
 
+    # Per-image stats for the samplers, see utils.sampling.ImageIndex
+    instance["stats"] = image_stats(instance)
+
     return instance
 
 def parse_voc_annotation_file(filename, image_directory, labels=None):
     tree = ET.parse(filename)
 
-    if tree.getroot() == "annotation":
+    if tree.getroot().tag == "annotation":
         # Single file with single annotation
-        inst = [_parse_voc_annotation(tree, image_directory, labels)]
-        instances = [inst]
+        instances = [_parse_voc_annotation(tree.getroot(), image_directory, labels)]
     else:
         # File with multiple annotations
         instances = [_parse_voc_annotation(node, image_directory, labels) for node in tree.findall("annotation")]
@@ -1,13 +1,32 @@
 from keras.layers import Conv2D, Input, BatchNormalization, LeakyReLU, ZeroPadding2D, UpSampling2D, Lambda, MaxPooling2D, Concatenate
 from keras.layers.merge import add, concatenate
 from keras.models import Model
-from keras.engine.topology import Layer
+from keras.engine.topology import Layer, InputLayer
+from keras import backend as K
+from utils.precision import MixedPrecisionConv2D
 import tensorflow as tf
+import re
+
+def _box_iou(mins_a, maxes_a, mins_b, maxes_b):
+    intersect_wh    = tf.maximum(tf.minimum(maxes_a, maxes_b) - tf.maximum(mins_a, mins_b), 0.)
+    intersect_areas = intersect_wh[..., 0] * intersect_wh[..., 1]
+
+    wh_a = maxes_a - mins_a
+    wh_b = maxes_b - mins_b
+    union_areas = wh_a[..., 0] * wh_a[..., 1] + wh_b[..., 0] * wh_b[..., 1] - intersect_areas
+
+    return tf.truediv(intersect_areas, union_areas)
 
 class YoloLayer(Layer):
-    def __init__(self, anchors, max_grid, batch_size, warmup_batches, ignore_thresh, 
+    """ The loss of one output scale.
+
+    # Arguments
+        stats   : Also compute recall50, recall75, avg_iou, avg_obj, avg_noobj, avg_cat and count.
+                  They are made available in self.stat_tensors, see add_loss_stats.
+    """
+    def __init__(self, anchors, warmup_batches, ignore_thresh, 
                     grid_scale, obj_scale, noobj_scale, xywh_scale, class_scale, 
-                    **kwargs):
+                    stats=False, **kwargs):
         # make the model settings persistent
         self.ignore_thresh  = ignore_thresh
         self.warmup_batches = warmup_batches
@@ -17,13 +36,9 @@ class YoloLayer(Layer):
         self.noobj_scale    = noobj_scale
         self.xywh_scale     = xywh_scale
         self.class_scale    = class_scale        
-
-        # make a persistent mesh grid
-        max_grid_h, max_grid_w = max_grid
-
-        cell_x = tf.to_float(tf.reshape(tf.tile(tf.range(max_grid_w), [max_grid_h]), (1, max_grid_h, max_grid_w, 1, 1)))
-        cell_y = tf.transpose(cell_x, (0,2,1,3,4))
-        self.cell_grid = tf.tile(tf.concat([cell_x,cell_y],-1), [batch_size, 1, 1, 3, 1])
+        self.stats          = stats
+        self.stat_tensors   = {}
+        self.batch_seen     = []
 
         super(YoloLayer, self).__init__(**kwargs)
 
@@ -39,8 +54,10 @@ class YoloLayer(Layer):
         # initialize the masks
         object_mask     = tf.expand_dims(y_true[..., 4], 4)
 
-        # the variable to keep track of number of batches processed
-        batch_seen = tf.Variable(0.)        
+        # the variable to keep track of number of batches processed, one per call of the layer
+        # (e.g. per replica of a multi-GPU model), see get_batches_seen
+        batch_seen = K.variable(0., name='batch_seen')
+        self.batch_seen.append(batch_seen)
 
         # compute grid factor and net factor
         grid_h      = tf.shape(y_true)[1]
@@ -50,15 +67,24 @@ class YoloLayer(Layer):
         net_h       = tf.shape(input_image)[1]
         net_w       = tf.shape(input_image)[2]            
         net_factor  = tf.reshape(tf.cast([net_w, net_h], tf.float32), [1,1,1,1,2])
+
+        # the x, y offsets of the cells of this grid, broadcast over the batch and the anchors
+        cell_grid   = tf.reshape(tf.stack(tf.meshgrid(tf.to_float(tf.range(grid_w)), tf.to_float(tf.range(grid_h))), -1), [1, grid_h, grid_w, 1, 2])
         
         """
         Adjust prediction
         """
-        pred_box_xy    = (self.cell_grid[:,:grid_h,:grid_w,:,:] + tf.sigmoid(y_pred[..., :2]))  # sigma(t_xy) + c_xy
+        pred_box_xy    = (cell_grid + tf.sigmoid(y_pred[..., :2]))                              # sigma(t_xy) + c_xy
         pred_box_wh    = y_pred[..., 2:4]                                                       # t_wh
         pred_box_conf  = tf.expand_dims(tf.sigmoid(y_pred[..., 4]), 4)                          # adjust confidence
         pred_box_class = y_pred[..., 5:]                                                        # adjust class probabilities      
 
+        # corners of the predicted boxes relative to the image, shared by the ignore mask and the statistics
+        pred_xy      = pred_box_xy / grid_factor
+        pred_wh_half = tf.exp(pred_box_wh) * self.anchors / net_factor / 2.
+        pred_mins    = pred_xy - pred_wh_half
+        pred_maxes   = pred_xy + pred_wh_half
+
         """
         Adjust ground truth
         """
@@ -73,75 +99,43 @@ class YoloLayer(Layer):
         # initially, drag all objectness of all boxes to 0
         conf_delta  = pred_box_conf - 0 
 
-        # then, ignore the boxes which have good overlap with some true box
-        true_xy = true_boxes[..., 0:2] / grid_factor
-        true_wh = true_boxes[..., 2:4] / net_factor
-        
-        true_wh_half = true_wh / 2.
-        true_mins    = true_xy - true_wh_half
-        true_maxes   = true_xy + true_wh_half
-        
-        pred_xy = tf.expand_dims(pred_box_xy / grid_factor, 4)
-        pred_wh = tf.expand_dims(tf.exp(pred_box_wh) * self.anchors / net_factor, 4)
-        
-        pred_wh_half = pred_wh / 2.
-        pred_mins    = pred_xy - pred_wh_half
-        pred_maxes   = pred_xy + pred_wh_half    
-
-        intersect_mins  = tf.maximum(pred_mins,  true_mins)
-        intersect_maxes = tf.minimum(pred_maxes, true_maxes)
+        # true_boxes is filled from the first row and zero padded to max_box_per_image,
+        # only compare against as many rows as the fullest image of the batch uses
+        nb_true_boxes = tf.reduce_max(tf.reduce_sum(tf.to_int32(true_boxes[..., 2] > 0), axis=-1))
+        true_boxes    = true_boxes[..., :nb_true_boxes, :]
 
-        intersect_wh    = tf.maximum(intersect_maxes - intersect_mins, 0.)
-        intersect_areas = intersect_wh[..., 0] * intersect_wh[..., 1]
-        
-        true_areas = true_wh[..., 0] * true_wh[..., 1]
-        pred_areas = pred_wh[..., 0] * pred_wh[..., 1]
-
-        union_areas = pred_areas + true_areas - intersect_areas
-        iou_scores  = tf.truediv(intersect_areas, union_areas)
+        # then, ignore the boxes which have good overlap with some true box
+        true_xy      = true_boxes[..., 0:2] / grid_factor
+        true_wh_half = true_boxes[..., 2:4] / net_factor / 2.
 
+        iou_scores  = _box_iou(tf.expand_dims(pred_mins, 4), tf.expand_dims(pred_maxes, 4), true_xy - true_wh_half, true_xy + true_wh_half)
         best_ious   = tf.reduce_max(iou_scores, axis=4)        
         conf_delta *= tf.expand_dims(tf.to_float(best_ious < self.ignore_thresh), 4)
 
         """
         Compute some online statistics
         """            
-        true_xy = true_box_xy / grid_factor
-        true_wh = tf.exp(true_box_wh) * self.anchors / net_factor
-
-        true_wh_half = true_wh / 2.
-        true_mins    = true_xy - true_wh_half
-        true_maxes   = true_xy + true_wh_half
-
-        pred_xy = pred_box_xy / grid_factor
-        pred_wh = tf.exp(pred_box_wh) * self.anchors / net_factor 
-        
-        pred_wh_half = pred_wh / 2.
-        pred_mins    = pred_xy - pred_wh_half
-        pred_maxes   = pred_xy + pred_wh_half      
-
-        intersect_mins  = tf.maximum(pred_mins,  true_mins)
-        intersect_maxes = tf.minimum(pred_maxes, true_maxes)
-        intersect_wh    = tf.maximum(intersect_maxes - intersect_mins, 0.)
-        intersect_areas = intersect_wh[..., 0] * intersect_wh[..., 1]
-        
-        true_areas = true_wh[..., 0] * true_wh[..., 1]
-        pred_areas = pred_wh[..., 0] * pred_wh[..., 1]
-
-        union_areas = pred_areas + true_areas - intersect_areas
-        iou_scores  = tf.truediv(intersect_areas, union_areas)
-        iou_scores  = object_mask * tf.expand_dims(iou_scores, 4)
-        
-        count       = tf.reduce_sum(object_mask)
-        count_noobj = tf.reduce_sum(1 - object_mask)
-        detect_mask = tf.to_float((pred_box_conf*object_mask) >= 0.5)
-        class_mask  = tf.expand_dims(tf.to_float(tf.equal(tf.argmax(pred_box_class, -1), true_box_class)), 4)
-        recall50    = tf.reduce_sum(tf.to_float(iou_scores >= 0.5 ) * detect_mask  * class_mask) / (count + 1e-3)
-        recall75    = tf.reduce_sum(tf.to_float(iou_scores >= 0.75) * detect_mask  * class_mask) / (count + 1e-3)    
-        avg_iou     = tf.reduce_sum(iou_scores) / (count + 1e-3)
-        avg_obj     = tf.reduce_sum(pred_box_conf  * object_mask)  / (count + 1e-3)
-        avg_noobj   = tf.reduce_sum(pred_box_conf  * (1-object_mask))  / (count_noobj + 1e-3)
-        avg_cat     = tf.reduce_sum(object_mask * class_mask) / (count + 1e-3) 
+        if self.stats:
+            true_xy      = true_box_xy / grid_factor
+            true_wh_half = tf.exp(true_box_wh) * self.anchors / net_factor / 2.
+
+            iou_scores  = _box_iou(pred_mins, pred_maxes, true_xy - true_wh_half, true_xy + true_wh_half)
+            iou_scores  = object_mask * tf.expand_dims(iou_scores, 4)
+            
+            count       = tf.reduce_sum(object_mask)
+            count_noobj = tf.reduce_sum(1 - object_mask)
+            detect_mask = tf.to_float((pred_box_conf*object_mask) >= 0.5)
+            class_mask  = tf.expand_dims(tf.to_float(tf.equal(tf.argmax(pred_box_class, -1), true_box_class)), 4)
+
+            self.stat_tensors = {
+                'recall50':  tf.reduce_sum(tf.to_float(iou_scores >= 0.5 ) * detect_mask  * class_mask) / (count + 1e-3),
+                'recall75':  tf.reduce_sum(tf.to_float(iou_scores >= 0.75) * detect_mask  * class_mask) / (count + 1e-3),
+                'avg_iou':   tf.reduce_sum(iou_scores) / (count + 1e-3),
+                'avg_obj':   tf.reduce_sum(pred_box_conf  * object_mask)  / (count + 1e-3),
+                'avg_noobj': tf.reduce_sum(pred_box_conf  * (1-object_mask))  / (count_noobj + 1e-3),
+                'avg_cat':   tf.reduce_sum(object_mask * class_mask) / (count + 1e-3),
+                'count':     count
+            }
 
         """
         Warm-up training
@@ -149,7 +143,7 @@ class YoloLayer(Layer):
         batch_seen = tf.assign_add(batch_seen, 1.)
         
         true_box_xy, true_box_wh, xywh_mask = tf.cond(tf.less(batch_seen, self.warmup_batches+1), 
-                              lambda: [true_box_xy + (0.5 + self.cell_grid[:,:grid_h,:grid_w,:,:]) * (1-object_mask), 
+                              lambda: [true_box_xy + (0.5 + cell_grid) * (1-object_mask), 
                                        true_box_wh + tf.zeros_like(true_box_wh) * (1-object_mask), 
                                        tf.ones_like(object_mask)],
                               lambda: [true_box_xy, 
@@ -176,19 +170,6 @@ class YoloLayer(Layer):
 
         loss = loss_xy + loss_wh + loss_conf + loss_class
 
-        # loss = tf.Print(loss, [grid_h, avg_obj], message='avg_obj \t\t', summarize=1000)
-        # loss = tf.Print(loss, [grid_h, avg_noobj], message='avg_noobj \t\t', summarize=1000)
-        # loss = tf.Print(loss, [grid_h, avg_iou], message='avg_iou \t\t', summarize=1000)
-        # loss = tf.Print(loss, [grid_h, avg_cat], message='avg_cat \t\t', summarize=1000)
-        # loss = tf.Print(loss, [grid_h, recall50], message='recall50 \t', summarize=1000)
-        # loss = tf.Print(loss, [grid_h, recall75], message='recall75 \t', summarize=1000)   
-        # loss = tf.Print(loss, [grid_h, count], message='count \t', summarize=1000)     
-        # loss = tf.Print(loss, [grid_h, tf.reduce_sum(loss_xy), 
-        #                                tf.reduce_sum(loss_wh), 
-        #                                tf.reduce_sum(loss_conf), 
-        #                                tf.reduce_sum(loss_class)],  message='loss xy, wh, conf, class: \t',   summarize=1000)   
-
-
         return loss*self.grid_scale
 
     def compute_output_shape(self, input_shape):
@@ -197,7 +178,12 @@ class YoloLayer(Layer):
 def max_pool_layer(pool_size=2, strides=2, padding="same"):
     return MaxPooling2D(pool_size=pool_size, strides=strides, padding=padding)
 
-def darknet_conv_block_layers(layer_index, filter=None, kernel_size=3, strides=1, max_pool_size=None, max_pool_stride=None, activation="LeakyReLU", batch_normalization=True):
+def _conv2d(*args, compute_dtype=None, **kwargs):
+    if compute_dtype is None:
+        return Conv2D(*args, **kwargs)
+    return MixedPrecisionConv2D(*args, compute_dtype=compute_dtype, **kwargs)
+
+def darknet_conv_block_layers(layer_index, filter=None, kernel_size=3, strides=1, max_pool_size=None, max_pool_stride=None, activation="LeakyReLU", batch_normalization=True, compute_dtype=None):
     layers = []
 
     # Convolution
@@ -206,12 +192,13 @@ def darknet_conv_block_layers(layer_index, filter=None, kernel_size=3, strides=1
         if strides > 1:
             layers.append(ZeroPadding2D(((1,0),(1,0))))
 
-        layers.append(Conv2D(filter,
+        layers.append(_conv2d(filter,
             kernel_size,
             strides=strides,
             padding="valid" if strides > 1 else "same", # unlike tensorflow darknet prefer left and top paddings
             name="conv_%d" % layer_index,
-            use_bias=not batch_normalization
+            use_bias=not batch_normalization,
+            compute_dtype=compute_dtype
         ))
 
     # Batch normalization
@@ -236,7 +223,7 @@ def compose_layers(x, layers):
         x = layer(x)
     return x
 
-def _conv_block(inp, convs, do_skip=True):
+def _conv_block(inp, convs, do_skip=True, compute_dtype=None):
     x = inp
     count = 0
     
@@ -246,12 +233,13 @@ def _conv_block(inp, convs, do_skip=True):
         count += 1
         
         if conv['stride'] > 1: x = ZeroPadding2D(((1,0),(1,0)))(x) # unlike tensorflow darknet prefer left and top paddings
-        x = Conv2D(conv['filter'], 
-                   conv['kernel'], 
-                   strides=conv['stride'], 
-                   padding='valid' if conv['stride'] > 1 else 'same', # unlike tensorflow darknet prefer left and top paddings
-                   name='conv_' + str(conv['layer_idx']), 
-                   use_bias=False if conv['bnorm'] else True)(x)
+        x = _conv2d(conv['filter'], 
+                    conv['kernel'], 
+                    strides=conv['stride'], 
+                    padding='valid' if conv['stride'] > 1 else 'same', # unlike tensorflow darknet prefer left and top paddings
+                    name='conv_' + str(conv['layer_idx']), 
+                    use_bias=False if conv['bnorm'] else True,
+                    compute_dtype=compute_dtype)(x)
         if conv['bnorm']: x = BatchNormalization(epsilon=0.001, name='bnorm_' + str(conv['layer_idx']))(x)
         if conv['leaky']: x = LeakyReLU(alpha=0.1, name='leaky_' + str(conv['layer_idx']))(x)
 
@@ -274,12 +262,89 @@ def get_num_yolo_scales(model_type):
     }
     return scales[model_type]
 
+# conv_N ranges of the backbones: darknet-53 for the full model, up to the 1024 filter convolution for tiny and micro
+BACKBONE_LAYERS = {
+    "full": (0, 74),
+    "tiny": (0, 7),
+    "micro": (0, 7)
+}
+
+_INDEXED_LAYER = re.compile(r'^(conv|bnorm|leaky|activation|maxpool|upsample|concat)_(\d+)$')
+
+def _layer_index(layer):
+    match = _INDEXED_LAYER.match(layer.name)
+    return int(match.group(2)) if match else None
+
+def freeze_layers(model, first, last):
+    """ Stop training the conv_N and bnorm_N layers with first <= N <= last, e.g. the
+    darknet-53 backbone with BACKBONE_LAYERS["full"]. Takes effect when the model is compiled.
+    Returns the number of frozen layers.
+    """
+    frozen = 0
+    for layer in model.layers:
+        index = _layer_index(layer)
+        if index is not None and first <= index <= last and layer.weights:
+            layer.trainable = False
+            frozen += 1
+    return frozen
+
+def split_backbone(train_model, last):
+    """ Split a training model after conv_<last>, to train the rest of it on precomputed features.
+
+    The backbone is every layer computed from the input image alone, up to conv_<last>. Its
+    outputs are the tensors the rest of the model reads from it, e.g. the outputs of conv_36,
+    conv_61 and conv_74 for the full model split at 74.
+
+    # Returns
+        backbone_model  : From the input image to the features.
+        heads_model     : A training model sharing the layers, and so the weights, of train_model.
+                          Its inputs are [image_size] + features + the other inputs of train_model.
+                          The YoloLayers only read the height and width of the input image, so
+                          image_size takes an array of shape (batch, net_h, net_w, 0).
+    """
+    input_image = train_model.inputs[0]
+    backbone    = set([input_image._keras_history[0]])
+
+    # train_model.layers is in topological order, and every layer was called once
+    for layer in train_model.layers:
+        inbound_layers = layer._inbound_nodes[0].inbound_layers
+        index = _layer_index(layer)
+        if inbound_layers and all(inbound in backbone for inbound in inbound_layers) and (index is None or index <= last):
+            backbone.add(layer)
+
+    features = []
+    for layer in train_model.layers:
+        if layer in backbone or isinstance(layer, InputLayer):
+            continue
+        node = layer._inbound_nodes[0]
+        for inbound, tensor in zip(node.inbound_layers, node.input_tensors):
+            if inbound in backbone and tensor is not input_image and not any(tensor is feature for feature in features):
+                features.append(tensor)
+
+    image_size     = Input(shape=(None, None, 0), name='image_size')
+    feature_inputs = [Input(shape=K.int_shape(feature)[1:], name='features_%d' % i) for i, feature in enumerate(features)]
+
+    # call the layers after the backbone again, on the new inputs
+    tensors = {id(input_image): image_size}
+    tensors.update((id(feature), feature_input) for feature, feature_input in zip(features, feature_inputs))
+    tensors.update((id(other_input), other_input) for other_input in train_model.inputs[1:])
+
+    for layer in train_model.layers:
+        if layer in backbone or isinstance(layer, InputLayer):
+            continue
+        node = layer._inbound_nodes[0]
+        inputs = [tensors[id(tensor)] for tensor in node.input_tensors]
+        tensors[id(node.output_tensors[0])] = layer(inputs if len(inputs) > 1 else inputs[0])
+
+    backbone_model = Model(input_image, features)
+    heads_model    = Model([image_size] + feature_inputs + train_model.inputs[1:], [tensors[id(output)] for output in train_model.outputs])
+
+    return backbone_model, heads_model
+
 def create_yolov3_model(
     nb_class, 
     anchors, 
     max_box_per_image, 
-    max_grid, 
-    batch_size, 
     warmup_batches,
     ignore_thresh,
     grid_scales,
@@ -287,7 +352,9 @@ def create_yolov3_model(
     noobj_scale,
     xywh_scale,
     class_scale,
-    input_image_size=None
+    input_image_size=None,
+    compute_dtype=None,
+    loss_stats=False
 ):
     input_image = Input(shape=input_image_size or (None, None, 3)) # net_h, net_w, 3
     true_boxes  = Input(shape=(1, 1, 1, max_box_per_image, 4))
@@ -299,74 +366,73 @@ def create_yolov3_model(
     x = _conv_block(input_image, [{'filter': 32, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 0},
                                   {'filter': 64, 'kernel': 3, 'stride': 2, 'bnorm': True, 'leaky': True, 'layer_idx': 1},
                                   {'filter': 32, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 2},
-                                  {'filter': 64, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 3}])
+                                  {'filter': 64, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 3}], compute_dtype=compute_dtype)
 
     # Layer  5 => 8
     x = _conv_block(x, [{'filter': 128, 'kernel': 3, 'stride': 2, 'bnorm': True, 'leaky': True, 'layer_idx': 5},
                         {'filter':  64, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 6},
-                        {'filter': 128, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 7}])
+                        {'filter': 128, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 7}], compute_dtype=compute_dtype)
 
     # Layer  9 => 11
     x = _conv_block(x, [{'filter':  64, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 9},
-                        {'filter': 128, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 10}])
+                        {'filter': 128, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 10}], compute_dtype=compute_dtype)
 
     # Layer 12 => 15
     x = _conv_block(x, [{'filter': 256, 'kernel': 3, 'stride': 2, 'bnorm': True, 'leaky': True, 'layer_idx': 12},
                         {'filter': 128, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 13},
-                        {'filter': 256, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 14}])
+                        {'filter': 256, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 14}], compute_dtype=compute_dtype)
 
     # Layer 16 => 36
     for i in range(7):
         x = _conv_block(x, [{'filter': 128, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 16+i*3},
-                            {'filter': 256, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 17+i*3}])
+                            {'filter': 256, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 17+i*3}], compute_dtype=compute_dtype)
         
     skip_36 = x
         
     # Layer 37 => 40
     x = _conv_block(x, [{'filter': 512, 'kernel': 3, 'stride': 2, 'bnorm': True, 'leaky': True, 'layer_idx': 37},
                         {'filter': 256, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 38},
-                        {'filter': 512, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 39}])
+                        {'filter': 512, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 39}], compute_dtype=compute_dtype)
 
     # Layer 41 => 61
     for i in range(7):
         x = _conv_block(x, [{'filter': 256, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 41+i*3},
-                            {'filter': 512, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 42+i*3}])
+                            {'filter': 512, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 42+i*3}], compute_dtype=compute_dtype)
         
     skip_61 = x
         
     # Layer 62 => 65
     x = _conv_block(x, [{'filter': 1024, 'kernel': 3, 'stride': 2, 'bnorm': True, 'leaky': True, 'layer_idx': 62},
                         {'filter':  512, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 63},
-                        {'filter': 1024, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 64}])
+                        {'filter': 1024, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 64}], compute_dtype=compute_dtype)
 
     # Layer 66 => 74
     for i in range(3):
         x = _conv_block(x, [{'filter':  512, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 66+i*3},
-                            {'filter': 1024, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 67+i*3}])
+                            {'filter': 1024, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 67+i*3}], compute_dtype=compute_dtype)
         
     # Layer 75 => 79
     x = _conv_block(x, [{'filter':  512, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 75},
                         {'filter': 1024, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 76},
                         {'filter':  512, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 77},
                         {'filter': 1024, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 78},
-                        {'filter':  512, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 79}], do_skip=False)
+                        {'filter':  512, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 79}], do_skip=False, compute_dtype=compute_dtype)
 
     # Layer 80 => 82
     pred_yolo_1 = _conv_block(x, [{'filter': 1024, 'kernel': 3, 'stride': 1, 'bnorm': True,  'leaky': True,  'layer_idx': 80},
-                             {'filter': (3*(5+nb_class)), 'kernel': 1, 'stride': 1, 'bnorm': False, 'leaky': False, 'layer_idx': 81}], do_skip=False)
+                             {'filter': (3*(5+nb_class)), 'kernel': 1, 'stride': 1, 'bnorm': False, 'leaky': False, 'layer_idx': 81}], do_skip=False, compute_dtype=compute_dtype)
     loss_yolo_1 = YoloLayer(anchors[12:], 
-                            [1*num for num in max_grid], 
-                            batch_size, 
                             warmup_batches, 
                             ignore_thresh, 
                             grid_scales[0],
                             obj_scale,
                             noobj_scale,
                             xywh_scale,
-                            class_scale)([input_image, pred_yolo_1, true_yolo_1, true_boxes])
+                            class_scale,
+                            stats=loss_stats)([input_image, pred_yolo_1, true_yolo_1, true_boxes])
 
     # Layer 83 => 86
-    x = _conv_block(x, [{'filter': 256, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 84}], do_skip=False)
+    x = _conv_block(x, [{'filter': 256, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 84}], do_skip=False, compute_dtype=compute_dtype)
     x = UpSampling2D(2)(x)
     x = concatenate([x, skip_61])
 
@@ -375,24 +441,23 @@ def create_yolov3_model(
                         {'filter': 512, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 88},
                         {'filter': 256, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 89},
                         {'filter': 512, 'kernel': 3, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 90},
-                        {'filter': 256, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 91}], do_skip=False)
+                        {'filter': 256, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True, 'layer_idx': 91}], do_skip=False, compute_dtype=compute_dtype)
 
     # Layer 92 => 94
     pred_yolo_2 = _conv_block(x, [{'filter': 512, 'kernel': 3, 'stride': 1, 'bnorm': True,  'leaky': True,  'layer_idx': 92},
-                             {'filter': (3*(5+nb_class)), 'kernel': 1, 'stride': 1, 'bnorm': False, 'leaky': False, 'layer_idx': 93}], do_skip=False)
+                             {'filter': (3*(5+nb_class)), 'kernel': 1, 'stride': 1, 'bnorm': False, 'leaky': False, 'layer_idx': 93}], do_skip=False, compute_dtype=compute_dtype)
     loss_yolo_2 = YoloLayer(anchors[6:12], 
-                            [2*num for num in max_grid], 
-                            batch_size, 
                             warmup_batches, 
                             ignore_thresh, 
                             grid_scales[1],
                             obj_scale,
                             noobj_scale,
                             xywh_scale,
-                            class_scale)([input_image, pred_yolo_2, true_yolo_2, true_boxes])
+                            class_scale,
+                            stats=loss_stats)([input_image, pred_yolo_2, true_yolo_2, true_boxes])
 
     # Layer 95 => 98
-    x = _conv_block(x, [{'filter': 128, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True,   'layer_idx': 96}], do_skip=False)
+    x = _conv_block(x, [{'filter': 128, 'kernel': 1, 'stride': 1, 'bnorm': True, 'leaky': True,   'layer_idx': 96}], do_skip=False, compute_dtype=compute_dtype)
     x = UpSampling2D(2)(x)
     x = concatenate([x, skip_36])
 
@@ -403,17 +468,16 @@ def create_yolov3_model(
                              {'filter': 256, 'kernel': 3, 'stride': 1, 'bnorm': True,  'leaky': True,  'layer_idx': 102},
                              {'filter': 128, 'kernel': 1, 'stride': 1, 'bnorm': True,  'leaky': True,  'layer_idx': 103},
                              {'filter': 256, 'kernel': 3, 'stride': 1, 'bnorm': True,  'leaky': True,  'layer_idx': 104},
-                             {'filter': (3*(5+nb_class)), 'kernel': 1, 'stride': 1, 'bnorm': False, 'leaky': False, 'layer_idx': 105}], do_skip=False)
+                             {'filter': (3*(5+nb_class)), 'kernel': 1, 'stride': 1, 'bnorm': False, 'leaky': False, 'layer_idx': 105}], do_skip=False, compute_dtype=compute_dtype)
     loss_yolo_3 = YoloLayer(anchors[:6], 
-                            [4*num for num in max_grid], 
-                            batch_size, 
                             warmup_batches, 
                             ignore_thresh, 
                             grid_scales[2],
                             obj_scale,
                             noobj_scale,
                             xywh_scale,
-                            class_scale)([input_image, pred_yolo_3, true_yolo_3, true_boxes]) 
+                            class_scale,
+                            stats=loss_stats)([input_image, pred_yolo_3, true_yolo_3, true_boxes]) 
 
     train_model = Model([input_image, true_boxes, true_yolo_1, true_yolo_2, true_yolo_3], [loss_yolo_1, loss_yolo_2, loss_yolo_3])
     infer_model = Model(input_image, [pred_yolo_1, pred_yolo_2, pred_yolo_3])
@@ -424,8 +488,6 @@ def create_tiny_yolov3_model(
     nb_class, 
     anchors, 
     max_box_per_image, 
-    max_grid, 
-    batch_size, 
     warmup_batches,
     ignore_thresh,
     grid_scales,
@@ -433,7 +495,9 @@ def create_tiny_yolov3_model(
     noobj_scale,
     xywh_scale,
     class_scale,
-    input_image_size=None
+    input_image_size=None,
+    compute_dtype=None,
+    loss_stats=False
 ):
     """See https://github.com/pjreddie/darknet/blob/master/cfg/yolov3-tiny.cfg"""
 
@@ -467,57 +531,55 @@ def create_tiny_yolov3_model(
     #
 
     x1 = compose_layers(input_image,
-        darknet_conv_block_layers( 0,   16, kernel_size=3, max_pool_size=2, max_pool_stride=2) +
-        darknet_conv_block_layers( 1,   32, kernel_size=3, max_pool_size=2, max_pool_stride=2) +
-        darknet_conv_block_layers( 2,   64, kernel_size=3, max_pool_size=2, max_pool_stride=2) +
-        darknet_conv_block_layers( 3,  128, kernel_size=3, max_pool_size=2, max_pool_stride=2) +
-        darknet_conv_block_layers( 4,  256, kernel_size=3)
+        darknet_conv_block_layers( 0,   16, kernel_size=3, max_pool_size=2, max_pool_stride=2, compute_dtype=compute_dtype) +
+        darknet_conv_block_layers( 1,   32, kernel_size=3, max_pool_size=2, max_pool_stride=2, compute_dtype=compute_dtype) +
+        darknet_conv_block_layers( 2,   64, kernel_size=3, max_pool_size=2, max_pool_stride=2, compute_dtype=compute_dtype) +
+        darknet_conv_block_layers( 3,  128, kernel_size=3, max_pool_size=2, max_pool_stride=2, compute_dtype=compute_dtype) +
+        darknet_conv_block_layers( 4,  256, kernel_size=3, compute_dtype=compute_dtype)
     )
 
     x2 = compose_layers(x1,
-        darknet_conv_block_layers( 5,  None,               max_pool_size=2, max_pool_stride=2, batch_normalization=False)   +
-        darknet_conv_block_layers( 6,  512, kernel_size=3, max_pool_size=2, max_pool_stride=1)                              +
-        darknet_conv_block_layers( 7, 1024, kernel_size=3)                                                                  +
-        darknet_conv_block_layers( 8,  256, kernel_size=1)
+        darknet_conv_block_layers( 5,  None,               max_pool_size=2, max_pool_stride=2, batch_normalization=False, compute_dtype=compute_dtype)   +
+        darknet_conv_block_layers( 6,  512, kernel_size=3, max_pool_size=2, max_pool_stride=1, compute_dtype=compute_dtype)                              +
+        darknet_conv_block_layers( 7, 1024, kernel_size=3, compute_dtype=compute_dtype)                                                                  +
+        darknet_conv_block_layers( 8,  256, kernel_size=1, compute_dtype=compute_dtype)
     )
 
     pred_yolo_1 = compose_layers(x2,
-        darknet_conv_block_layers( 9,                                512, kernel_size=3)                                                +
-        darknet_conv_block_layers(10,  nb_anchors_per_scale*(nb_class+5), kernel_size=1, activation=None, batch_normalization=False)
+        darknet_conv_block_layers( 9,                                512, kernel_size=3, compute_dtype=compute_dtype)                                                +
+        darknet_conv_block_layers(10,  nb_anchors_per_scale*(nb_class+5), kernel_size=1, activation=None, batch_normalization=False, compute_dtype=compute_dtype)
     )
 
     x2 = compose_layers(x2,
-        darknet_conv_block_layers(11,  128, kernel_size=1) +
+        darknet_conv_block_layers(11,  128, kernel_size=1, compute_dtype=compute_dtype) +
         [UpSampling2D(2, name="upsample_12")]
     )
 
     pred_yolo_2 = compose_layers([x2, x1],
-        [Concatenate(name="concat_13")]                                                                                                 +
-        darknet_conv_block_layers(14,                                256, kernel_size=3)                                                +
-        darknet_conv_block_layers(15,  nb_anchors_per_scale*(nb_class+5), kernel_size=1, activation=None, batch_normalization=False)
+        [Concatenate(name="concat_13")]                                                                                                                              +
+        darknet_conv_block_layers(14,                                256, kernel_size=3, compute_dtype=compute_dtype)                                                +
+        darknet_conv_block_layers(15,  nb_anchors_per_scale*(nb_class+5), kernel_size=1, activation=None, batch_normalization=False, compute_dtype=compute_dtype)
     )
 
     loss_yolo_1 = YoloLayer(anchors[12:], 
-                            [1*num for num in max_grid], 
-                            batch_size, 
                             warmup_batches, 
                             ignore_thresh, 
                             grid_scales[0],
                             obj_scale,
                             noobj_scale,
                             xywh_scale,
-                            class_scale)([input_image, pred_yolo_1, true_yolo_1, true_boxes])
+                            class_scale,
+                            stats=loss_stats)([input_image, pred_yolo_1, true_yolo_1, true_boxes])
 
     loss_yolo_2 = YoloLayer(anchors[6:12], 
-                            [2*num for num in max_grid], 
-                            batch_size, 
                             warmup_batches, 
                             ignore_thresh, 
                             grid_scales[1],
                             obj_scale,
                             noobj_scale,
                             xywh_scale,
-                            class_scale)([input_image, pred_yolo_2, true_yolo_2, true_boxes])
+                            class_scale,
+                            stats=loss_stats)([input_image, pred_yolo_2, true_yolo_2, true_boxes])
 
     train_model = Model([input_image, true_boxes, true_yolo_1, true_yolo_2,], [loss_yolo_1, loss_yolo_2,])
     infer_model = Model(input_image, [pred_yolo_1, pred_yolo_2])
@@ -527,13 +589,41 @@ def create_tiny_yolov3_model(
 def dummy_loss(y_true, y_pred):
     return tf.sqrt(tf.reduce_sum(y_pred))
 
+def add_loss_stats(model):
+    """ Report the statistics of the YoloLayers built with stats=True as metrics of a compiled model,
+    e.g. yolo_layer_1_recall50.
+    """
+    for layer in model.layers:
+        if isinstance(layer, YoloLayer):
+            for name, tensor in sorted(layer.stat_tensors.items()):
+                model.metrics_names.append(layer.name + '_' + name)
+                model.metrics_tensors.append(tensor)
+
+def _batch_seen_variables(model):
+    # also of the template model inside a multi-GPU model
+    variables = []
+    for layer in model.layers:
+        if isinstance(layer, YoloLayer):
+            variables += layer.batch_seen
+        elif isinstance(layer, Model):
+            variables += _batch_seen_variables(layer)
+    return variables
+
+def get_batches_seen(model):
+    """ The number of batches the YoloLayers of model counted for the warmup.
+    """
+    values = K.batch_get_value(_batch_seen_variables(model))
+    return float(max(values)) if values else 0.
+
+def set_batches_seen(model, batches_seen):
+    """ Continue the warmup of the YoloLayers of model from batches_seen, e.g. when resuming training.
+    """
+    K.batch_set_value([(variable, batches_seen) for variable in _batch_seen_variables(model)])
 
 def create_micro_yolov3_model(
     nb_class, 
     anchors, 
     max_box_per_image, 
-    max_grid, 
-    batch_size, 
     warmup_batches,
     ignore_thresh,
     grid_scales,
@@ -541,7 +631,9 @@ def create_micro_yolov3_model(
     noobj_scale,
     xywh_scale,
     class_scale,
-    input_image_size=None
+    input_image_size=None,
+    compute_dtype=None,
+    loss_stats=False
 ):
     """See https://github.com/pjreddie/darknet/blob/master/cfg/yolov3-tiny.cfg"""
 
@@ -554,57 +646,55 @@ def create_micro_yolov3_model(
     true_yolo_2 = Input(shape=(None, None, nb_anchors_per_scale, 4+1+nb_class)) # grid_h, grid_w, nb_anchor, 5+nb_class
 
     x1 = compose_layers(input_image,
-        darknet_conv_block_layers( 0,   16, kernel_size=3, max_pool_size=2, max_pool_stride=2) +
-        darknet_conv_block_layers( 1,   32, kernel_size=3, max_pool_size=2, max_pool_stride=2) +
-        darknet_conv_block_layers( 2,   64, kernel_size=3, max_pool_size=2, max_pool_stride=2) +
-        darknet_conv_block_layers( 3,  128, kernel_size=3, max_pool_size=2, max_pool_stride=2) +
-        darknet_conv_block_layers( 4,  128, kernel_size=3)
+        darknet_conv_block_layers( 0,   16, kernel_size=3, max_pool_size=2, max_pool_stride=2, compute_dtype=compute_dtype) +
+        darknet_conv_block_layers( 1,   32, kernel_size=3, max_pool_size=2, max_pool_stride=2, compute_dtype=compute_dtype) +
+        darknet_conv_block_layers( 2,   64, kernel_size=3, max_pool_size=2, max_pool_stride=2, compute_dtype=compute_dtype) +
+        darknet_conv_block_layers( 3,  128, kernel_size=3, max_pool_size=2, max_pool_stride=2, compute_dtype=compute_dtype) +
+        darknet_conv_block_layers( 4,  128, kernel_size=3, compute_dtype=compute_dtype)
     )
 
     x2 = compose_layers(x1,
-        darknet_conv_block_layers( 5,  None,               max_pool_size=2, max_pool_stride=2, batch_normalization=False)   +
-        darknet_conv_block_layers( 6,  512, kernel_size=3, max_pool_size=2, max_pool_stride=1)                              +
-        darknet_conv_block_layers( 7,  512, kernel_size=3)                                                                  +
-        darknet_conv_block_layers( 8,  256, kernel_size=1)
+        darknet_conv_block_layers( 5,  None,               max_pool_size=2, max_pool_stride=2, batch_normalization=False, compute_dtype=compute_dtype)   +
+        darknet_conv_block_layers( 6,  512, kernel_size=3, max_pool_size=2, max_pool_stride=1, compute_dtype=compute_dtype)                              +
+        darknet_conv_block_layers( 7,  512, kernel_size=3, compute_dtype=compute_dtype)                                                                  +
+        darknet_conv_block_layers( 8,  256, kernel_size=1, compute_dtype=compute_dtype)
     )
 
     pred_yolo_1 = compose_layers(x2,
-        darknet_conv_block_layers( 9,                                256, kernel_size=3)                                                +
-        darknet_conv_block_layers(10,  nb_anchors_per_scale*(nb_class+5), kernel_size=1, activation=None, batch_normalization=False)
+        darknet_conv_block_layers( 9,                                256, kernel_size=3, compute_dtype=compute_dtype)                                                +
+        darknet_conv_block_layers(10,  nb_anchors_per_scale*(nb_class+5), kernel_size=1, activation=None, batch_normalization=False, compute_dtype=compute_dtype)
     )
 
     x2 = compose_layers(x2,
-        darknet_conv_block_layers(11,  128, kernel_size=1) +
+        darknet_conv_block_layers(11,  128, kernel_size=1, compute_dtype=compute_dtype) +
         [UpSampling2D(2, name="upsample_12")]
     )
 
     pred_yolo_2 = compose_layers([x2, x1],
-        [Concatenate(name="concat_13")]                                                                                                 +
-        darknet_conv_block_layers(14,                                128, kernel_size=3)                                                +
-        darknet_conv_block_layers(15,  nb_anchors_per_scale*(nb_class+5), kernel_size=1, activation=None, batch_normalization=False)
+        [Concatenate(name="concat_13")]                                                                                                                              +
+        darknet_conv_block_layers(14,                                128, kernel_size=3, compute_dtype=compute_dtype)                                                +
+        darknet_conv_block_layers(15,  nb_anchors_per_scale*(nb_class+5), kernel_size=1, activation=None, batch_normalization=False, compute_dtype=compute_dtype)
     )
 
     loss_yolo_1 = YoloLayer(anchors[12:], 
-                            [1*num for num in max_grid], 
-                            batch_size, 
                             warmup_batches, 
                             ignore_thresh, 
                             grid_scales[0],
                             obj_scale,
                             noobj_scale,
                             xywh_scale,
-                            class_scale)([input_image, pred_yolo_1, true_yolo_1, true_boxes])
+                            class_scale,
+                            stats=loss_stats)([input_image, pred_yolo_1, true_yolo_1, true_boxes])
 
     loss_yolo_2 = YoloLayer(anchors[6:12], 
-                            [2*num for num in max_grid], 
-                            batch_size, 
                             warmup_batches, 
                             ignore_thresh, 
                             grid_scales[1],
                             obj_scale,
                             noobj_scale,
                             xywh_scale,
-                            class_scale)([input_image, pred_yolo_2, true_yolo_2, true_boxes])
+                            class_scale,
+                            stats=loss_stats)([input_image, pred_yolo_2, true_yolo_2, true_boxes])
 
     train_model = Model([input_image, true_boxes, true_yolo_1, true_yolo_2,], [loss_yolo_1, loss_yolo_2,])
     infer_model = Model(input_image, [pred_yolo_1, pred_yolo_2])